@@ -14,12 +14,36 @@ matplotlib.use('Agg')  # 使用非交互式后端，避免tkinter冲突
 
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
-from matplotlib.patches import Rectangle
+from matplotlib.patches import BoxStyle
+from matplotlib.path import Path
+from matplotlib.collections import LineCollection, PolyCollection
+from matplotlib.textpath import TextPath
+from matplotlib.transforms import Affine2D, offset_copy
 import matplotlib.font_manager as fm
 from scipy.signal import argrelextrema
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from functools import lru_cache, partial
+from contextlib import contextmanager
 import threading
+import queue
+from multiprocessing import shared_memory
+import asyncio
+import json
+import itertools
+import shutil
+import gc
+import hashlib
+import zlib
+
+try:
+    import aiohttp
+except ImportError:  # 异步客户端为可选功能，未安装时仅影响异步接口
+    aiohttp = None
+
+try:
+    import psutil
+except ImportError:  # 内存统计优先使用 psutil，未安装时在Linux下读取 /proc
+    psutil = None
 
 warnings.filterwarnings('ignore')
 
@@ -37,10 +61,118 @@ pro = ts.pro_api(TOKEN)
 # 线程锁用于API调用
 api_lock = threading.Lock()
 
+# 是否使用进程池执行TD分析计算（数据获取仍在主进程线程池中进行）
+ANALYSIS_USE_PROCESS_POOL = False
+# 进程池模式下是否通过共享内存面板向子进程传递数据（需先加载全部股票数据）
+ANALYSIS_USE_SHARED_MEMORY = False
+
+# 全局API限速（每分钟调用次数，None表示不限速），所有线程共享
+API_CALLS_PER_MINUTE = 450
+api_rate_lock = threading.Lock()
+_api_next_slot = 0.0
+
+
+def reserve_api_slot():
+    """预约一次API调用时间，返回需要等待的秒数"""
+    global _api_next_slot
+    interval = 60.0 / API_CALLS_PER_MINUTE if API_CALLS_PER_MINUTE else 0.0
+    with api_rate_lock:
+        now = time.monotonic()
+        slot = max(now, _api_next_slot)
+        _api_next_slot = slot + interval
+    return slot - now
+
+
+def throttle_api_call():
+    """按全局限速等待，直到可以发起下一次API调用"""
+    delay = reserve_api_slot()
+    if delay > 0:
+        time.sleep(delay)
+
+
+@contextmanager
+def rate_limited_api_call():
+    """同步Tushare调用入口：先按全局限速等待，再持有API锁"""
+    throttle_api_call()
+    with api_lock:
+        yield
+
+
+# Tushare HTTP接口地址（与 tushare.pro_api 一致）
+TUSHARE_HTTP_URL = 'http://api.tushare.pro'
+# 异步请求遇到HTTP错误时的重试次数，第n次重试前等待 2**n 秒
+ASYNC_QUERY_RETRIES = 3
+
+
+class AsyncTushareClient:
+    """
+    异步Tushare客户端，调用方式与 pro_api 相同：await client.stk_factor_pro(ts_code=..., fields=[...])
+    请求通过连接池复用HTTP连接，与同步调用共享全局API限速
+    """
+
+    def __init__(self, token=TOKEN, http_url=TUSHARE_HTTP_URL, max_connections=32, timeout=30):
+        if aiohttp is None:
+            raise ImportError("异步Tushare客户端需要安装 aiohttp: pip install aiohttp")
+        self.token = token
+        self.http_url = http_url
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._session = None
+
+    async def __aenter__(self):
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_connections),
+            timeout=aiohttp.ClientTimeout(total=self.timeout)
+        )
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def query(self, api_name, fields='', **kwargs):
+        if self._session is None:
+            raise RuntimeError("请在 async with AsyncTushareClient() 中使用客户端")
+
+        request_params = {
+            'api_name': api_name,
+            'token': self.token,
+            'params': kwargs,
+            'fields': fields
+        }
+        for attempt in range(ASYNC_QUERY_RETRIES + 1):
+            if attempt > 0:
+                await asyncio.sleep(2 ** attempt)
+            delay = reserve_api_slot()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            async with self._session.post(self.http_url, json=request_params) as response:
+                if response.status < 400:
+                    result = json.loads(await response.text())
+                    break
+                print(f"⚠️ Tushare接口 {api_name} 返回HTTP {response.status}（第 {attempt + 1} 次请求）")
+        else:
+            raise Exception(f"Tushare接口 {api_name} 请求失败：HTTP {response.status}，已重试 {ASYNC_QUERY_RETRIES} 次")
+
+        if result['code'] != 0:
+            raise Exception(result['msg'])
+        data = result['data']
+        return pd.DataFrame(data['items'], columns=data['fields'])
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return partial(self.query, name)
+
 
 def check_trade_date(date_str):
     """检查输入的日期是否为交易日"""
-    with api_lock:
+    with rate_limited_api_call():
         trade_cal = pro.trade_cal(exchange='SSE', start_date=date_str, end_date=date_str)
     if len(trade_cal) > 0 and trade_cal.iloc[0]['is_open'] == 1:
         return True
@@ -51,7 +183,7 @@ def check_trade_date(date_str):
 def get_latest_trade_date():
     """获取最近的交易日（带缓存）"""
     today = datetime.now().strftime('%Y%m%d')
-    with api_lock:
+    with rate_limited_api_call():
         trade_cal = pro.trade_cal(exchange='SSE', end_date=today, is_open=1)
     trade_cal = trade_cal.sort_values('cal_date', ascending=False)
     return trade_cal.iloc[0]['cal_date']
@@ -59,7 +191,7 @@ def get_latest_trade_date():
 
 def get_previous_trade_date(date_str):
     """获取指定日期的前一个交易日"""
-    with api_lock:
+    with rate_limited_api_call():
         trade_cal = pro.trade_cal(exchange='SSE', end_date=date_str, is_open=1)
     trade_cal = trade_cal.sort_values('cal_date', ascending=False)
     if len(trade_cal) >= 2:
@@ -67,35 +199,202 @@ def get_previous_trade_date(date_str):
     return None
 
 
-def get_next_60_trade_dates(start_date):
-    """获取指定日期之后的60个交易日"""
-    try:
-        # 计算一个足够大的结束日期（大约3个月后）
-        start_dt = pd.to_datetime(start_date)
-        end_dt = start_dt + timedelta(days=120)  # 预留足够的天数
-        end_date = end_dt.strftime('%Y%m%d')
+@lru_cache(maxsize=256)
+def load_next_60_trade_dates(start_date):
+    """读取指定日期之后的60个交易日（带缓存，出错时抛出异常且不缓存）"""
+    # 计算一个足够大的结束日期（大约3个月后）
+    start_dt = pd.to_datetime(start_date)
+    end_dt = start_dt + timedelta(days=120)  # 预留足够的天数
+    end_date = end_dt.strftime('%Y%m%d')
 
-        # 获取交易日历
-        with api_lock:
-            trade_cal = pro.trade_cal(exchange='SSE', start_date=start_date, end_date=end_date, is_open=1)
-        trade_cal = trade_cal.sort_values('cal_date', ascending=True)
+    # 获取交易日历
+    with rate_limited_api_call():
+        trade_cal = pro.trade_cal(exchange='SSE', start_date=start_date, end_date=end_date, is_open=1)
+    trade_cal = trade_cal.sort_values('cal_date', ascending=True)
 
-        # 排除起始日期，取后面的60个交易日
-        future_dates = trade_cal[trade_cal['cal_date'] > start_date]
+    # 排除起始日期，取后面的60个交易日
+    future_dates = trade_cal[trade_cal['cal_date'] > start_date]
+    return tuple(future_dates.head(60)['cal_date'].tolist())
 
-        if len(future_dates) >= 60:
-            return future_dates.head(60)['cal_date'].tolist()
-        else:
-            return future_dates['cal_date'].tolist()
+
+def get_next_60_trade_dates(start_date):
+    """获取指定日期之后的60个交易日"""
+    try:
+        return list(load_next_60_trade_dates(start_date))
     except Exception as e:
         print(f"获取60个交易日出错: {e}")
         return []
 
 
+# 前瞻收益统计：最大盈利观察窗口（交易日数）和固定持有周期
+FORWARD_PROFIT_DAYS = 60
+FORWARD_RETURN_HORIZONS = (5, 10, 20, 60)
+# 分块计算时每块滑动窗口的元素上限，控制 argmax 产生的临时内存
+FORWARD_WINDOW_ELEMENTS = 20_000_000
+
+
+def build_calendar_panel(hist_data_by_code, trade_dates, fields):
+    """
+    将多只股票的历史数据按统一交易日历对齐为面板矩阵 (股票数 × 交易日)
+    停牌或缺失的交易日为NaN，返回 (股票代码列表, {字段: 矩阵})
+    """
+    trade_dates = np.asarray(sorted({str(date) for date in trade_dates}))
+    stock_codes = list(hist_data_by_code)
+    panel = {field: np.full((len(stock_codes), len(trade_dates)), np.nan) for field in fields}
+
+    for row, stock_code in enumerate(stock_codes):
+        hist_data = hist_data_by_code[stock_code]
+        if hist_data is None or len(hist_data) == 0 or len(trade_dates) == 0:
+            continue
+        dates = hist_data['trade_date'].astype(str).to_numpy()
+        positions = np.searchsorted(trade_dates, dates)
+        matched = trade_dates[np.minimum(positions, len(trade_dates) - 1)] == dates
+        for field in fields:
+            if field in hist_data.columns:
+                values = pd.to_numeric(hist_data[field], errors='coerce').to_numpy(dtype=float)
+                panel[field][row, positions[matched]] = values[matched]
+
+    return stock_codes, panel
+
+
+def calculate_forward_return_panel(close, high, low=None, max_days=FORWARD_PROFIT_DAYS,
+                                   horizons=FORWARD_RETURN_HORIZONS):
+    """
+    面板级前瞻收益引擎 - 使用前复权数据
+    close/high/low 为按同一交易日历对齐的 (股票数 × 交易日) 矩阵，以每个交易日收盘价为基准：
+    - max_profit_pct / max_profit_days：之后 max_days 个交易日内最高价的最大涨幅及其是第几个交易日（不盈利时为0）
+    - max_drawdown_pct：同一窗口内最低价相对基准的最大跌幅（不为正）
+    - return_{N}d：第N个交易日收盘价相对基准的收益率，停牌或超出数据范围时为NaN
+    窗口最大值/位置由末尾补齐后的滑动窗口（反向滚动）一次求出，按股票分块以控制内存
+    """
+    close = np.asarray(close, dtype=float)
+    high = np.asarray(high, dtype=float)
+    low = close if low is None else np.asarray(low, dtype=float)
+    stock_count, date_count = close.shape
+
+    forward_high = np.empty(close.shape)
+    forward_low = np.empty(close.shape)
+    high_offset = np.empty(close.shape, dtype=int)
+    chunk_rows = max(1, FORWARD_WINDOW_ELEMENTS // max(1, date_count * max_days))
+
+    for start in range(0, stock_count, chunk_rows):
+        rows = slice(start, start + chunk_rows)
+        # 补齐 max_days 列后去掉第一列，第t个窗口正好覆盖第 t+1 ~ t+max_days 个交易日
+        padded = np.full((close[rows].shape[0], date_count + max_days), -np.inf)
+        padded[:, :date_count] = np.where(np.isnan(high[rows]), -np.inf, high[rows])
+        windows = np.lib.stride_tricks.sliding_window_view(padded[:, 1:], max_days, axis=1)
+        forward_high[rows] = windows.max(axis=2)
+        high_offset[rows] = windows.argmax(axis=2) + 1  # 并列时取最早出现的交易日
+
+        padded[:, :date_count] = np.where(np.isnan(low[rows]), np.inf, low[rows])
+        padded[:, date_count:] = np.inf
+        forward_low[rows] = np.lib.stride_tricks.sliding_window_view(padded[:, 1:], max_days, axis=1).min(axis=2)
+
+    # 窗口内实际有数据的天数
+    traded = np.zeros((stock_count, date_count + 1), dtype=int)
+    traded[:, 1:] = np.cumsum(~(np.isnan(high) & np.isnan(close)), axis=1)
+    window_end = np.minimum(np.arange(date_count) + 1 + max_days, date_count)
+    actual_days = traded[:, window_end] - traded[:, 1:]
+
+    valid = np.isfinite(close) & (close > 0)
+    result = {'valid': valid, 'actual_days_count': actual_days, 'horizons': tuple(horizons)}
+    with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+        profit = (forward_high - close) / close * 100
+        profitable = valid & (actual_days > 0) & (profit > 0)
+        result['max_profit_pct'] = np.where(profitable, profit, 0.0)
+        result['max_profit_days'] = np.where(profitable, high_offset, 0)
+        drawdown = np.minimum((forward_low - close) / close * 100, 0)
+        result['max_drawdown_pct'] = np.where(valid & (actual_days > 0), drawdown, np.nan)
+
+        for horizon in horizons:
+            future_close = np.full(close.shape, np.nan)
+            if horizon < date_count:
+                future_close[:, :date_count - horizon] = close[:, horizon:]
+            result[f'return_{horizon}d'] = np.where(valid, (future_close - close) / close * 100, np.nan)
+
+    return result
+
+
+def get_forward_return_result(forward, row, col):
+    """取出单个 (股票, 交易日) 的前瞻收益，格式与 calculate_max_profit_after_target_date 的返回值一致"""
+    if not forward['valid'][row, col]:
+        return {'max_profit_pct': 0, 'max_profit_days': 0, 'status': '目标日期无数据'}
+    if forward['actual_days_count'][row, col] == 0:
+        return {'max_profit_pct': 0, 'max_profit_days': 0, 'status': '未来期间无数据'}
+
+    result = {
+        'max_profit_pct': round(float(forward['max_profit_pct'][row, col]), 2),
+        'max_profit_days': int(forward['max_profit_days'][row, col]),
+        'status': 'success',
+        'actual_days_count': int(forward['actual_days_count'][row, col]),
+        'max_drawdown_pct': round(float(forward['max_drawdown_pct'][row, col]), 2)
+    }
+    for horizon in forward['horizons']:
+        value = forward[f'return_{horizon}d'][row, col]
+        result[f'return_{horizon}d'] = round(float(value), 2) if np.isfinite(value) else None
+    return result
+
+
+def calculate_forward_returns(hist_data_by_code, trade_dates, evaluation_dates=None, max_days=FORWARD_PROFIT_DAYS,
+                              horizons=FORWARD_RETURN_HORIZONS):
+    """
+    全市场前瞻收益表 - 使用前复权数据
+    trade_dates 为交易日历（需覆盖最后一个评估日之后 max_days 个交易日），一次面板计算得到
+    每只股票每个评估日（默认全部交易日）的最大盈利、最大回撤和各周期收益，返回长表 DataFrame
+    """
+    stock_codes, panel = build_calendar_panel(hist_data_by_code, trade_dates, ['close_qfq', 'high_qfq', 'low_qfq'])
+    calendar = np.asarray(sorted({str(date) for date in trade_dates}))
+    forward = calculate_forward_return_panel(panel['close_qfq'], panel['high_qfq'], panel['low_qfq'],
+                                             max_days, horizons)
+
+    selected = forward['valid'].copy()
+    if evaluation_dates is not None:
+        selected &= np.isin(calendar, [str(date) for date in evaluation_dates])[np.newaxis, :]
+    rows, cols = np.nonzero(selected)
+
+    result = pd.DataFrame({
+        'ts_code': np.asarray(stock_codes, dtype=object)[rows],
+        'trade_date': calendar[cols],
+        'max_profit_pct': np.round(forward['max_profit_pct'][rows, cols], 2),
+        'max_profit_days': forward['max_profit_days'][rows, cols],
+        'max_drawdown_pct': np.round(forward['max_drawdown_pct'][rows, cols], 2),
+        'actual_days_count': forward['actual_days_count'][rows, cols]
+    })
+    for horizon in horizons:
+        result[f'return_{horizon}d'] = np.round(forward[f'return_{horizon}d'][rows, cols], 2)
+    return result
+
+
+def fetch_forward_price_data(stock_code, start_date, end_date):
+    """获取区间内的前复权最高/最低/收盘价，stk_factor_pro 无数据或出错时退回 daily 接口"""
+    try:
+        with rate_limited_api_call():
+            price_data = pro.stk_factor_pro(**{
+                "ts_code": stock_code,
+                "start_date": start_date,
+                "end_date": end_date,
+                "trade_date": "",
+                "limit": "",
+                "offset": ""
+            }, fields=["ts_code", "trade_date", "high_qfq", "low_qfq", "close_qfq"])
+        if len(price_data) > 0:
+            return price_data
+    except Exception:
+        pass
+
+    # 备用方案：使用普通接口
+    with rate_limited_api_call():
+        price_data = pro.daily(ts_code=stock_code, start_date=start_date, end_date=end_date)
+    if len(price_data) > 0:
+        for field in ('high', 'low', 'close'):
+            price_data[f'{field}_qfq'] = price_data[field]  # 简化处理
+    return price_data
+
+
 def calculate_max_profit_after_target_date(stock_code, target_date):
     """
-    计算目标日期之后60个交易日内的最大盈利百分比和天数
-    使用前复权数据计算
+    计算目标日期之后60个交易日内的最大盈利百分比和天数，附带最大回撤和各周期收益
+    使用前复权数据计算；开启历史数据缓存时直接从缓存切片，不再访问行情接口
     """
     try:
         # 获取目标日期之后的60个交易日
@@ -104,110 +403,348 @@ def calculate_max_profit_after_target_date(stock_code, target_date):
         if not future_trade_dates:
             return {'max_profit_pct': 0, 'max_profit_days': 0, 'status': '无未来数据'}
 
-        # 获取目标日期的前复权收盘价
-        try:
-            with api_lock:
-                target_data = pro.stk_factor_pro(**{
-                    "ts_code": stock_code,
-                    "start_date": target_date,
-                    "end_date": target_date,
-                    "trade_date": "",
-                    "limit": "",
-                    "offset": ""
-                }, fields=["ts_code", "trade_date", "close_qfq"])
+        price_data = get_cached_stock_history(stock_code, target_date, future_trade_dates[-1])
+        if price_data is None:
+            price_data = fetch_forward_price_data(stock_code, target_date, future_trade_dates[-1])
 
-            if len(target_data) == 0:
-                # 备用方案：使用普通接口
-                with api_lock:
-                    target_data = pro.daily(ts_code=stock_code, start_date=target_date, end_date=target_date)
-                target_data['close_qfq'] = target_data['close']  # 简化处理
-        except:
-            # 备用方案
-            with api_lock:
-                target_data = pro.daily(ts_code=stock_code, start_date=target_date, end_date=target_date)
-            target_data['close_qfq'] = target_data['close']
+        _, panel = build_calendar_panel({stock_code: price_data}, [target_date] + future_trade_dates,
+                                        ['close_qfq', 'high_qfq', 'low_qfq'])
+        forward = calculate_forward_return_panel(panel['close_qfq'], panel['high_qfq'], panel['low_qfq'],
+                                                 len(future_trade_dates))
+        return get_forward_return_result(forward, 0, 0)
 
-        if len(target_data) == 0:
-            return {'max_profit_pct': 0, 'max_profit_days': 0, 'status': '目标日期无数据'}
+    except Exception as e:
+        print(f"计算 {stock_code} 最大盈利时出错: {e}")
+        return {'max_profit_pct': 0, 'max_profit_days': 0, 'status': f'计算出错: {str(e)}'}
 
-        target_close_price = target_data.iloc[0]['close_qfq']
 
-        # 获取60个交易日的数据
-        start_future_date = future_trade_dates[0]
-        end_future_date = future_trade_dates[-1]
+# 情绪分析部分
+# 优化后的权重配置 - 确保总权重在±45分以内
+EMOTION_WEIGHTS = {
+    'RSI': {'positive': 10, 'negative': 10},  # 核心指标，权重最高
+    'CCI': {'positive': 6, 'negative': 6},  # 降低权重，避免与RSI重叠
+    'KDJ': {'positive': 5, 'negative': 5},  # 短期指标
+    'MACD': {'positive': 6, 'negative': 6},  # 趋势指标
+    'PSY': {'positive': 4, 'negative': 4},  # 心理指标
+    'VR': {'positive': 3, 'negative': 3},  # 成交量指标
+    'OBV': {'positive': 5, 'negative': 5},  # 资金流向
+    'MFI': {'positive': 3, 'negative': 3},  # 资金流量
+    'VOLUME': {'positive': 3, 'negative': 3}  # 新增：成交量确认
+}
+# 总权重：45分，确保基础分50±45 = 5-95分
+
+# 优化后的阈值配置
+INDICATOR_THRESHOLDS = {
+    'RSI': {'extreme_high': 85, 'high': 70, 'low': 30, 'extreme_low': 15},
+    'CCI': {'extreme_high': 200, 'high': 100, 'low': -100, 'extreme_low': -200},
+    'KDJ': {'high': 80, 'low': 20},
+    'PSY': {'extreme_high': 80, 'high': 65, 'low': 35, 'extreme_low': 20},
+    'VR': {'extreme_high': 350, 'high': 200, 'low': 80, 'extreme_low': 50},
+    'MFI': {'high': 80, 'low': 20}
+}
+
+# 情绪评分规则表：按顺序匹配 (比较方式, 阈值, 情绪标签, 得分影响, 提示类别, 提示模板)，
+# 都不满足时使用 default，指标缺失时使用 missing 标签
+EMOTION_SCORING_RULES = {
+    'RSI': {
+        'rules': [
+            ('>', INDICATOR_THRESHOLDS['RSI']['extreme_high'], "极度贪婪", -EMOTION_WEIGHTS['RSI']['negative'],
+             'warning', "RSI显示极度贪婪({value:.1f})，市场可能过热"),
+            ('>', INDICATOR_THRESHOLDS['RSI']['high'], "贪婪", -6,
+             'warning', "RSI显示贪婪情绪({value:.1f})，注意风险"),
+            ('<', INDICATOR_THRESHOLDS['RSI']['extreme_low'], "极度恐慌", EMOTION_WEIGHTS['RSI']['positive'],
+             'opportunity', "RSI显示极度恐慌({value:.1f})，可能存在超跌机会"),
+            ('<', INDICATOR_THRESHOLDS['RSI']['low'], "恐慌", 6,
+             'opportunity', "RSI显示恐慌情绪({value:.1f})，关注反弹机会"),
+        ],
+        'default': ("平衡", 0, 'signal', "RSI处于平衡区间({value:.1f})，情绪相对稳定"),
+        'missing': "数据缺失"
+    },
+    'CCI': {
+        'rules': [
+            ('>', INDICATOR_THRESHOLDS['CCI']['extreme_high'], "强烈看多", EMOTION_WEIGHTS['CCI']['positive'],
+             'signal', "CCI显示强烈看多情绪({value:.1f})"),
+            ('>', INDICATOR_THRESHOLDS['CCI']['high'], "偏多", 3,
+             'signal', "CCI显示偏多情绪({value:.1f})"),
+            ('<', INDICATOR_THRESHOLDS['CCI']['extreme_low'], "强烈看空", -EMOTION_WEIGHTS['CCI']['negative'],
+             'warning', "CCI显示强烈看空情绪({value:.1f})"),
+            ('<', INDICATOR_THRESHOLDS['CCI']['low'], "偏空", -3,
+             'warning', "CCI显示偏空情绪({value:.1f})"),
+        ],
+        'default': ("中性", 0, 'signal', "CCI显示中性情绪({value:.1f})"),
+        'missing': "CCI数据缺失"
+    },
+    'KDJ': {
+        'rules': [
+            ('>', INDICATOR_THRESHOLDS['KDJ']['high'], "超买", -EMOTION_WEIGHTS['KDJ']['negative'],
+             'warning', "KDJ显示超买状态({value:.1f})，注意回调风险"),
+            ('<', INDICATOR_THRESHOLDS['KDJ']['low'], "超卖", EMOTION_WEIGHTS['KDJ']['positive'],
+             'opportunity', "KDJ显示超卖状态({value:.1f})，关注反弹机会"),
+        ],
+        'default': ("正常", 0, 'signal', "KDJ处于正常区间({value:.1f})"),
+        'missing': "数据缺失"
+    },
+    # MACD指标值为状态：1=金叉且柱状图为正，-1=死叉且柱状图为负，0=转换中
+    'MACD': {
+        'rules': [
+            ('==', 1, "积极", EMOTION_WEIGHTS['MACD']['positive'],
+             'signal', "MACD显示积极情绪，趋势向好"),
+            ('==', -1, "消极", -EMOTION_WEIGHTS['MACD']['negative'],
+             'warning', "MACD显示消极情绪，趋势偏弱"),
+        ],
+        'default': ("转换中", 0, 'signal', "MACD显示情绪转换中"),
+        'missing': "数据缺失"
+    },
+    'PSY': {
+        'rules': [
+            ('>', INDICATOR_THRESHOLDS['PSY']['extreme_high'], "极度乐观", -EMOTION_WEIGHTS['PSY']['negative'],
+             'warning', "PSY显示极度乐观({value:.1f})，市场可能过热"),
+            ('>', INDICATOR_THRESHOLDS['PSY']['high'], "偏乐观", -2,
+             'warning', "PSY显示偏乐观({value:.1f})，注意风险"),
+            ('<', INDICATOR_THRESHOLDS['PSY']['extreme_low'], "极度悲观", EMOTION_WEIGHTS['PSY']['positive'],
+             'opportunity', "PSY显示极度悲观({value:.1f})，可能存在机会"),
+            ('<', INDICATOR_THRESHOLDS['PSY']['low'], "偏悲观", 2,
+             'opportunity', "PSY显示偏悲观({value:.1f})，关注反弹"),
+        ],
+        'default': ("理性", 0, 'signal', "PSY显示理性情绪({value:.1f})"),
+        'missing': "PSY数据缺失"
+    },
+    'VR': {
+        'rules': [
+            ('>', INDICATOR_THRESHOLDS['VR']['extreme_high'], "过度活跃", -EMOTION_WEIGHTS['VR']['negative'],
+             'warning', "VR显示成交过度活跃({value:.1f})，注意风险"),
+            ('>', INDICATOR_THRESHOLDS['VR']['high'], "较活跃", -1,
+             'signal', "VR显示成交较活跃({value:.1f})"),
+            ('<', INDICATOR_THRESHOLDS['VR']['extreme_low'], "过度低迷", EMOTION_WEIGHTS['VR']['positive'],
+             'opportunity', "VR显示成交低迷({value:.1f})，可能酝酿机会"),
+            ('<', INDICATOR_THRESHOLDS['VR']['low'], "偏低迷", 1,
+             'opportunity', "VR显示成交偏低迷({value:.1f})"),
+        ],
+        'default': ("正常", 0, 'signal', "VR显示成交量正常({value:.1f})"),
+        'missing': "VR数据缺失"
+    },
+    # OBV指标值为最新一日OBV变化百分比
+    'OBV': {
+        'rules': [
+            ('>', 15, "资金大幅流入", EMOTION_WEIGHTS['OBV']['positive'],
+             'signal', "OBV显示资金大幅流入({value:.1f}%)"),
+            ('>', 5, "资金流入积极", 3,
+             'signal', "OBV显示资金流入积极({value:.1f}%)"),
+            ('<', -15, "资金大幅流出", -EMOTION_WEIGHTS['OBV']['negative'],
+             'warning', "OBV显示资金大幅流出({value:.1f}%)"),
+            ('<', -5, "资金流出明显", -3,
+             'warning', "OBV显示资金流出明显({value:.1f}%)"),
+        ],
+        'default': ("资金流动平稳", 0, 'signal', "OBV显示资金流动平稳({value:.1f}%)"),
+        'missing': "数据缺失"
+    },
+    'MFI': {
+        'rules': [
+            ('>', INDICATOR_THRESHOLDS['MFI']['high'], "资金过度流入", -EMOTION_WEIGHTS['MFI']['negative'],
+             'warning', "MFI显示资金过度流入({value:.1f})，注意回调"),
+            ('<', INDICATOR_THRESHOLDS['MFI']['low'], "资金严重流出", EMOTION_WEIGHTS['MFI']['positive'],
+             'opportunity', "MFI显示资金严重流出({value:.1f})，关注底部"),
+        ],
+        'default': ("资金流动正常", 0, 'signal', "MFI显示资金流动正常({value:.1f})"),
+        'missing': "MFI数据缺失"
+    },
+    # 成交量确认：指标值为近10日均量与整体均量之比，只影响得分和提示，不单独给出情绪标签
+    'VOLUME': {
+        'rules': [
+            ('>', 2.0, None, EMOTION_WEIGHTS['VOLUME']['positive'],
+             'signal', "成交量大幅放大({value:.1f}倍)，情绪确认有效"),
+            ('>', 1.5, None, 2,
+             'signal', "成交量明显放大({value:.1f}倍)，情绪有所确认"),
+            ('<', 0.7, None, -1,
+             'warning', "成交量萎缩({value:.1f}倍)，情绪信号偏弱"),
+        ],
+        'default': (None, 0, None, None),
+        'missing': None
+    }
+}
+
+# 情绪指标矩阵的列顺序（同时也是提示信息的输出顺序）
+EMOTION_INDICATORS = ('RSI', 'CCI', 'KDJ', 'MACD', 'PSY', 'VR', 'OBV', 'MFI', 'VOLUME')
+
+# 参与数据完整性统计的指标
+EMOTION_COMPLETENESS_INDICATORS = ('RSI', 'CCI', 'KDJ', 'MACD', 'PSY', 'VR', 'OBV', 'MFI')
+
+# 情绪等级划分：得分下限 -> 等级
+EMOTION_LEVEL_BINS = [20, 32, 42, 58, 68, 80]
+EMOTION_LEVELS = ["极度悲观", "悲观", "偏悲观", "中性", "偏乐观", "乐观", "极度乐观"]
+
+# 趋势分析配置：指标 -> (数据列, 分析周期)
+EMOTION_TREND_SERIES = {
+    'RSI': ('rsi_qfq_12', 5),
+    'CCI': ('cci_qfq', 5),
+    'KDJ': ('kdj_k_qfq', 3),
+    'MACD': ('macd_qfq', 5),
+    'OBV': ('obv_qfq', 5)
+}
+
+# 情绪分析需要的数据列及数据列整体缺失时的默认值
+EMOTION_FIELD_DEFAULTS = {
+    'rsi_qfq_6': 50, 'rsi_qfq_12': 50, 'rsi_qfq_24': 50,
+    'cci_qfq': 0,
+    'kdj_k_qfq': 50, 'kdj_d_qfq': 50, 'kdj_qfq': 50,
+    'macd_dif_qfq': 0, 'macd_dea_qfq': 0, 'macd_qfq': 0,
+    'psy_qfq': 50, 'vr_qfq': 100, 'obv_qfq': 0, 'mfi_qfq': 50,
+    'vol': np.nan
+}
+
+
+def build_emotion_indicator_matrix(panel):
+    """
+    从面板数据提取情绪指标矩阵 (股票数 × 指标)，列顺序见 EMOTION_INDICATORS
+    不可用的指标记为NaN；同时计算各指标的趋势分析
+    """
+    lengths = panel['lengths']
+    present = panel['present']
+    stock_count = len(lengths)
+
+    def latest(field, offset=1):
+        values = panel[field][:, -offset] if panel[field].shape[1] >= offset else np.full(stock_count, np.nan)
+        return np.where(present[field], values, EMOTION_FIELD_DEFAULTS[field])
+
+    def nonzero(values):
+        return np.where(values == 0, np.nan, values)
+
+    def mean_of_valid(columns):
+        stacked = np.column_stack(columns)
+        valid_count = np.sum(~np.isnan(stacked), axis=1)
+        return np.where(valid_count > 0, np.nansum(stacked, axis=1) / np.maximum(valid_count, 1), np.nan)
+
+    matrix = np.full((stock_count, len(EMOTION_INDICATORS)), np.nan)
+    column = {name: idx for idx, name in enumerate(EMOTION_INDICATORS)}
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # RSI：三条RSI中有效值（非空且非0）的均值
+        matrix[:, column['RSI']] = mean_of_valid([nonzero(latest(f)) for f in ('rsi_qfq_6', 'rsi_qfq_12', 'rsi_qfq_24')])
+
+        # CCI/PSY/VR/MFI：为空或为0视为缺失
+        matrix[:, column['CCI']] = nonzero(latest('cci_qfq'))
+        matrix[:, column['PSY']] = nonzero(latest('psy_qfq'))
+        matrix[:, column['VR']] = nonzero(latest('vr_qfq'))
+        matrix[:, column['MFI']] = nonzero(latest('mfi_qfq'))
+
+        # KDJ：K/D/J中非空值的均值
+        matrix[:, column['KDJ']] = mean_of_valid([latest(f) for f in ('kdj_k_qfq', 'kdj_d_qfq', 'kdj_qfq')])
+
+        # MACD：金叉死叉结合柱状图的状态
+        dif, dea, hist = latest('macd_dif_qfq'), latest('macd_dea_qfq'), latest('macd_qfq')
+        macd_state = np.select([(dif > dea) & (hist > 0), (dif < dea) & (hist < 0)], [1.0, -1.0], default=0.0)
+        matrix[:, column['MACD']] = np.where(np.isnan(dif) | np.isnan(dea) | np.isnan(hist), np.nan, macd_state)
+
+        # OBV：最新一日相对前一日的变化百分比
+        obv_current, obv_previous = latest('obv_qfq'), latest('obv_qfq', 2)
+        obv_change = (obv_current - obv_previous) / np.abs(obv_previous) * 100
+        obv_missing = np.isnan(obv_current) | np.isnan(obv_previous) | (obv_previous == 0) | (lengths < 2)
+        matrix[:, column['OBV']] = np.where(obv_missing, np.nan, obv_change)
+
+        # 成交量确认：近10日均量 / 整体均量
+        vol = panel['vol']
+        vol_count = np.sum(~np.isnan(vol), axis=1)
+        recent_count = np.sum(~np.isnan(vol[:, -10:]), axis=1)
+        overall_vol = np.where(vol_count > 0, np.nansum(vol, axis=1) / np.maximum(vol_count, 1), np.nan)
+        recent_vol = np.where(recent_count > 0, np.nansum(vol[:, -10:], axis=1) / np.maximum(recent_count, 1), np.nan)
+        volume_ratio = np.where(overall_vol > 0, recent_vol / overall_vol, 1.0)
+        matrix[:, column['VOLUME']] = np.where(present['vol'] & (lengths >= 10), volume_ratio, np.nan)
+
+    # 指标趋势分析（最近N个值的首尾变化率）
+    trends = {}
+    for name, (field, periods) in EMOTION_TREND_SERIES.items():
+        window = panel[field][:, -periods:]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            strength = (window[:, -1] - window[:, 0]) / window[:, 0] * 100
+        has_missing = np.isnan(window).any(axis=1)
+        trend = np.select(
+            [has_missing, np.abs(strength) < 2, strength > 5, strength > 0, strength < -5],
+            ['data_missing', 'stable', 'strong_rising', 'rising', 'strong_falling'],
+            default='falling'
+        )
+        trends[name] = {
+            'trend': np.where(lengths < periods, 'insufficient_data', trend),
+            'strength': np.where(has_missing | (lengths < periods), 0, strength),
+            # 原逻辑只在该指标可用且数据列存在时做趋势分析
+            'enabled': present[field] & ~np.isnan(matrix[:, column[name]])
+        }
 
-        try:
-            with api_lock:
-                future_data = pro.stk_factor_pro(**{
-                    "ts_code": stock_code,
-                    "start_date": start_future_date,
-                    "end_date": end_future_date,
-                    "trade_date": "",
-                    "limit": "",
-                    "offset": ""
-                }, fields=["ts_code", "trade_date", "high_qfq", "close_qfq"])
-
-            if len(future_data) == 0:
-                # 备用方案
-                with api_lock:
-                    future_data = pro.daily(ts_code=stock_code, start_date=start_future_date, end_date=end_future_date)
-                future_data['high_qfq'] = future_data['high']
-                future_data['close_qfq'] = future_data['close']
-        except:
-            # 备用方案
-            with api_lock:
-                future_data = pro.daily(ts_code=stock_code, start_date=start_future_date, end_date=end_future_date)
-            future_data['high_qfq'] = future_data['high']
-            future_data['close_qfq'] = future_data['close']
+    return {'matrix': matrix, 'trends': trends, 'lengths': lengths}
 
-        if len(future_data) == 0:
-            return {'max_profit_pct': 0, 'max_profit_days': 0, 'status': '未来期间无数据'}
 
-        # 按日期排序
-        future_data = future_data.sort_values('trade_date')
+def score_emotion_matrix(indicators, rules=None):
+    """
+    表驱动的情绪评分引擎：对 (股票数 × 指标) 矩阵一次性应用全部阈值规则，
+    得到全部股票的情绪得分、情绪等级和各指标情绪标签（不生成文字提示）
+    rules 默认为 EMOTION_SCORING_RULES，可传入调整后的规则重新评分
+    """
+    rules = EMOTION_SCORING_RULES if rules is None else rules
+    matrix = indicators['matrix']
+    stock_count = len(matrix)
+    sufficient = indicators['lengths'] >= 20
 
-        # 计算每日的最大盈利
-        max_profit_pct = 0
-        max_profit_days = 0
+    emotion_score = np.full(stock_count, 50, dtype=int)
+    rule_hits = {}
+    labels = {}
 
-        for idx, row in future_data.iterrows():
-            # 使用当日最高价计算盈利
-            current_profit = (row['high_qfq'] - target_close_price) / target_close_price * 100
+    for idx, name in enumerate(EMOTION_INDICATORS):
+        config = rules[name]
+        values = matrix[:, idx]
+        missing = np.isnan(values)
 
-            if current_profit > max_profit_pct:
-                max_profit_pct = current_profit
-                # 计算是第几个交易日（从1开始）
-                current_date = row['trade_date']
-                if current_date in future_trade_dates:
-                    max_profit_days = future_trade_dates.index(current_date) + 1
+        with np.errstate(invalid='ignore'):
+            conditions = [values > threshold if op == '>' else values < threshold if op == '<' else values == threshold
+                          for op, threshold, *_ in config['rules']]
 
-        return {
-            'max_profit_pct': round(max_profit_pct, 2),
-            'max_profit_days': max_profit_days,
-            'status': 'success',
-            'actual_days_count': len(future_data)
-        }
+        # 命中的规则序号：规则数量表示default，-1表示指标缺失
+        hit = np.select(conditions, np.arange(len(config['rules'])), default=len(config['rules']))
+        hit = np.where(missing, -1, hit)
+        rule_hits[name] = hit
 
-    except Exception as e:
-        print(f"计算 {stock_code} 最大盈利时出错: {e}")
-        return {'max_profit_pct': 0, 'max_profit_days': 0, 'status': f'计算出错: {str(e)}'}
+        impacts = np.array([rule[3] for rule in config['rules']] + [config['default'][1], 0])
+        emotion_score += impacts[hit]
 
+        if config['missing'] is not None:
+            label_table = np.array([rule[2] for rule in config['rules']] + [config['default'][0], config['missing']],
+                                   dtype=object)
+            labels[name] = np.where(sufficient, label_table[hit], '数据不足')
 
-# 情绪分析部分
-# 优化后的情绪分析部分
-def calculate_emotion_analysis(hist_data):
+    # 应用得分范围限制 - 严格限制在5-95范围
+    emotion_score = np.clip(emotion_score, 5, 95)
+    emotion_score = np.where(sufficient, emotion_score, 50)
+
+    # 综合情绪等级评定
+    emotion_level = np.array(EMOTION_LEVELS, dtype=object)[np.digitize(emotion_score, EMOTION_LEVEL_BINS)]
+    emotion_level = np.where(sufficient, emotion_level, '中性')
+
+    # 计算数据完整性
+    available = np.column_stack([rule_hits[name] >= 0 for name in EMOTION_COMPLETENESS_INDICATORS])
+    data_completeness = np.where(sufficient, available.sum(axis=1) / len(EMOTION_COMPLETENESS_INDICATORS) * 100, 0)
+
+    return {
+        'emotion_score': emotion_score,
+        'emotion_level': emotion_level,
+        'labels': labels,
+        'data_completeness': data_completeness,
+        'rule_hits': rule_hits,
+        'sufficient': sufficient,
+        'indicators': indicators
+    }
+
+
+def calculate_emotion_analysis_batch(hist_data_list):
     """
-    专业情绪分析 - 基于前复权数据 (优化版本)
-    综合多个情绪指标：RSI、CCI、KDJ、MACD、PSY、VR等
-    优化内容：
-    1. 添加得分范围限制
-    2. 优化权重分配
-    3. 增加趋势分析
-    4. 改进数据完整性检查
+    全市场横截面情绪评分：一次向量化计算全部股票的情绪得分、等级和各指标标签
+    文字提示和报告需要时再通过 render_emotion_analysis 逐只生成
     """
-    df = hist_data.copy().sort_values('trade_date')
+    max_length = max([len(hist_data) for hist_data in hist_data_list if hist_data is not None] + [1])
+    panel = build_price_panel(hist_data_list, list(EMOTION_FIELD_DEFAULTS), bars=max_length)
+    return score_emotion_matrix(build_emotion_indicator_matrix(panel))
+
 
-    if len(df) < 20:
+def render_emotion_analysis(scores, row):
+    """为单只股票生成情绪分析结果（含文字提示和报告），输出格式与 calculate_emotion_analysis 一致"""
+    if not scores['sufficient'][row]:
         return {
             'emotion_score': 50,  # 中性
             'emotion_level': '中性',
@@ -227,391 +764,71 @@ def calculate_emotion_analysis(hist_data):
             'trend_analysis': {}
         }
 
-    latest = df.iloc[-1]
-    recent_5 = df.tail(5)
-    recent_10 = df.tail(10)
-
-    # 优化后的权重配置 - 确保总权重在±45分以内
-    EMOTION_WEIGHTS = {
-        'RSI': {'positive': 10, 'negative': 10},  # 核心指标，权重最高
-        'CCI': {'positive': 6, 'negative': 6},  # 降低权重，避免与RSI重叠
-        'KDJ': {'positive': 5, 'negative': 5},  # 短期指标
-        'MACD': {'positive': 6, 'negative': 6},  # 趋势指标
-        'PSY': {'positive': 4, 'negative': 4},  # 心理指标
-        'VR': {'positive': 3, 'negative': 3},  # 成交量指标
-        'OBV': {'positive': 5, 'negative': 5},  # 资金流向
-        'MFI': {'positive': 3, 'negative': 3},  # 资金流量
-        'VOLUME': {'positive': 3, 'negative': 3}  # 新增：成交量确认
-    }
-    # 总权重：45分，确保基础分50±45 = 5-95分
-
-    # 优化后的阈值配置
-    INDICATOR_THRESHOLDS = {
-        'RSI': {'extreme_high': 85, 'high': 70, 'low': 30, 'extreme_low': 15},
-        'CCI': {'extreme_high': 200, 'high': 100, 'low': -100, 'extreme_low': -200},
-        'KDJ': {'high': 80, 'low': 20},
-        'PSY': {'extreme_high': 80, 'high': 65, 'low': 35, 'extreme_low': 20},
-        'VR': {'extreme_high': 350, 'high': 200, 'low': 80, 'extreme_low': 50},
-        'MFI': {'high': 80, 'low': 20}
-    }
-
-    # 情绪得分累积器
-    emotion_score = 50  # 基础分数（中性）
-    emotion_signals = []
-    emotion_warnings = []
-    emotion_opportunities = []
-    trend_analysis = {}
+    indicators = scores['indicators']
+    messages = {'signal': [], 'warning': [], 'opportunity': []}
 
-    # 数据完整性检查
-    def check_data_availability(indicator_name, value):
-        """检查指标数据可用性"""
-        if pd.isna(value) or value == 0:
-            return False, f"{indicator_name}数据缺失"
-        return True, ""
-
-    def analyze_indicator_trend(values, indicator_name, periods=3):
-        """分析指标趋势"""
-        if len(values) < periods:
-            return 'insufficient_data', 0
-
-        recent_values = values.tail(periods)
-        if recent_values.isna().any():
-            return 'data_missing', 0
-
-        trend_strength = (recent_values.iloc[-1] - recent_values.iloc[0]) / recent_values.iloc[0] * 100
-
-        if abs(trend_strength) < 2:
-            return 'stable', trend_strength
-        elif trend_strength > 5:
-            return 'strong_rising', trend_strength
-        elif trend_strength > 0:
-            return 'rising', trend_strength
-        elif trend_strength < -5:
-            return 'strong_falling', trend_strength
-        else:
-            return 'falling', trend_strength
-
-    def apply_emotion_impact(base_score, impact_type, weight_config):
-        """应用情绪影响，确保得分在合理范围"""
-        if impact_type == 'positive':
-            return base_score + weight_config['positive']
-        elif impact_type == 'negative':
-            return base_score - weight_config['negative']
-        return base_score
-
-    # 1. RSI情绪分析（使用前复权数据） - 优化版
-    rsi_values = {
-        'rsi_6': latest.get('rsi_qfq_6', 50),
-        'rsi_12': latest.get('rsi_qfq_12', 50),
-        'rsi_24': latest.get('rsi_qfq_24', 50)
-    }
+    for idx, name in enumerate(EMOTION_INDICATORS):
+        config = EMOTION_SCORING_RULES[name]
+        hit = scores['rule_hits'][name][row]
+        if hit < 0:
+            continue
+        rule = config['rules'][hit][2:] if hit < len(config['rules']) else config['default']
+        category, template = rule[2], rule[3]
+        if category is not None:
+            messages[category].append(template.format(value=indicators['matrix'][row, idx]))
 
-    # RSI数据可用性检查
-    valid_rsi = [v for v in rsi_values.values() if pd.notna(v) and v != 0]
-    if valid_rsi:
-        rsi_avg = sum(valid_rsi) / len(valid_rsi)
-
-        # RSI趋势分析
-        if 'rsi_qfq_12' in df.columns:
-            rsi_trend, rsi_trend_strength = analyze_indicator_trend(df['rsi_qfq_12'], 'RSI', 5)
-            trend_analysis['RSI'] = {'trend': rsi_trend, 'strength': rsi_trend_strength}
-
-        # RSI情绪判断 - 使用优化阈值
-        if rsi_avg > INDICATOR_THRESHOLDS['RSI']['extreme_high']:
-            rsi_emotion = "极度贪婪"
-            emotion_score = apply_emotion_impact(emotion_score, 'negative', EMOTION_WEIGHTS['RSI'])
-            emotion_warnings.append(f"RSI显示极度贪婪({rsi_avg:.1f})，市场可能过热")
-        elif rsi_avg > INDICATOR_THRESHOLDS['RSI']['high']:
-            rsi_emotion = "贪婪"
-            emotion_score = apply_emotion_impact(emotion_score, 'negative', {'positive': 6, 'negative': 6})
-            emotion_warnings.append(f"RSI显示贪婪情绪({rsi_avg:.1f})，注意风险")
-        elif rsi_avg < INDICATOR_THRESHOLDS['RSI']['extreme_low']:
-            rsi_emotion = "极度恐慌"
-            emotion_score = apply_emotion_impact(emotion_score, 'positive', EMOTION_WEIGHTS['RSI'])
-            emotion_opportunities.append(f"RSI显示极度恐慌({rsi_avg:.1f})，可能存在超跌机会")
-        elif rsi_avg < INDICATOR_THRESHOLDS['RSI']['low']:
-            rsi_emotion = "恐慌"
-            emotion_score = apply_emotion_impact(emotion_score, 'positive', {'positive': 6, 'negative': 6})
-            emotion_opportunities.append(f"RSI显示恐慌情绪({rsi_avg:.1f})，关注反弹机会")
-        else:
-            rsi_emotion = "平衡"
-            emotion_signals.append(f"RSI处于平衡区间({rsi_avg:.1f})，情绪相对稳定")
-    else:
-        rsi_emotion = "数据缺失"
-
-    # 2. CCI情绪分析（顺势指标） - 优化版
-    cci = latest.get('cci_qfq', 0)
-    cci_available, cci_error = check_data_availability('CCI', cci)
-
-    if cci_available:
-        # CCI趋势分析
-        if 'cci_qfq' in df.columns:
-            cci_trend, cci_trend_strength = analyze_indicator_trend(df['cci_qfq'], 'CCI', 5)
-            trend_analysis['CCI'] = {'trend': cci_trend, 'strength': cci_trend_strength}
-
-        if cci > INDICATOR_THRESHOLDS['CCI']['extreme_high']:
-            cci_emotion = "强烈看多"
-            emotion_score = apply_emotion_impact(emotion_score, 'positive', EMOTION_WEIGHTS['CCI'])
-            emotion_signals.append(f"CCI显示强烈看多情绪({cci:.1f})")
-        elif cci > INDICATOR_THRESHOLDS['CCI']['high']:
-            cci_emotion = "偏多"
-            emotion_score = apply_emotion_impact(emotion_score, 'positive', {'positive': 3, 'negative': 3})
-            emotion_signals.append(f"CCI显示偏多情绪({cci:.1f})")
-        elif cci < INDICATOR_THRESHOLDS['CCI']['extreme_low']:
-            cci_emotion = "强烈看空"
-            emotion_score = apply_emotion_impact(emotion_score, 'negative', EMOTION_WEIGHTS['CCI'])
-            emotion_warnings.append(f"CCI显示强烈看空情绪({cci:.1f})")
-        elif cci < INDICATOR_THRESHOLDS['CCI']['low']:
-            cci_emotion = "偏空"
-            emotion_score = apply_emotion_impact(emotion_score, 'negative', {'positive': 3, 'negative': 3})
-            emotion_warnings.append(f"CCI显示偏空情绪({cci:.1f})")
-        else:
-            cci_emotion = "中性"
-            emotion_signals.append(f"CCI显示中性情绪({cci:.1f})")
-    else:
-        cci_emotion = cci_error
-
-    # 3. KDJ情绪分析 - 优化版
-    kdj_k = latest.get('kdj_k_qfq', 50)
-    kdj_d = latest.get('kdj_d_qfq', 50)
-    kdj_j = latest.get('kdj_qfq', 50)
-
-    kdj_values = [v for v in [kdj_k, kdj_d, kdj_j] if pd.notna(v)]
-    if kdj_values:
-        kdj_avg = sum(kdj_values) / len(kdj_values)
-
-        # KDJ趋势分析
-        if 'kdj_k_qfq' in df.columns:
-            kdj_trend, kdj_trend_strength = analyze_indicator_trend(df['kdj_k_qfq'], 'KDJ', 3)
-            trend_analysis['KDJ'] = {'trend': kdj_trend, 'strength': kdj_trend_strength}
-
-        if kdj_avg > INDICATOR_THRESHOLDS['KDJ']['high']:
-            kdj_emotion = "超买"
-            emotion_score = apply_emotion_impact(emotion_score, 'negative', EMOTION_WEIGHTS['KDJ'])
-            emotion_warnings.append(f"KDJ显示超买状态({kdj_avg:.1f})，注意回调风险")
-        elif kdj_avg < INDICATOR_THRESHOLDS['KDJ']['low']:
-            kdj_emotion = "超卖"
-            emotion_score = apply_emotion_impact(emotion_score, 'positive', EMOTION_WEIGHTS['KDJ'])
-            emotion_opportunities.append(f"KDJ显示超卖状态({kdj_avg:.1f})，关注反弹机会")
-        else:
-            kdj_emotion = "正常"
-            emotion_signals.append(f"KDJ处于正常区间({kdj_avg:.1f})")
-    else:
-        kdj_emotion = "数据缺失"
-
-    # 4. MACD情绪分析 - 优化版
-    macd_dif = latest.get('macd_dif_qfq', 0)
-    macd_dea = latest.get('macd_dea_qfq', 0)
-    macd_hist = latest.get('macd_qfq', 0)
-
-    if all(pd.notna([macd_dif, macd_dea, macd_hist])):
-        # MACD趋势分析
-        if 'macd_qfq' in df.columns:
-            macd_trend, macd_trend_strength = analyze_indicator_trend(df['macd_qfq'], 'MACD', 5)
-            trend_analysis['MACD'] = {'trend': macd_trend, 'strength': macd_trend_strength}
-
-        # 结合金叉死叉和柱状图分析
-        if macd_dif > macd_dea and macd_hist > 0:
-            macd_emotion = "积极"
-            emotion_score = apply_emotion_impact(emotion_score, 'positive', EMOTION_WEIGHTS['MACD'])
-            emotion_signals.append(f"MACD显示积极情绪，趋势向好")
-        elif macd_dif < macd_dea and macd_hist < 0:
-            macd_emotion = "消极"
-            emotion_score = apply_emotion_impact(emotion_score, 'negative', EMOTION_WEIGHTS['MACD'])
-            emotion_warnings.append(f"MACD显示消极情绪，趋势偏弱")
-        else:
-            macd_emotion = "转换中"
-            emotion_signals.append(f"MACD显示情绪转换中")
-    else:
-        macd_emotion = "数据缺失"
-
-    # 5. PSY心理线分析 - 优化版
-    psy = latest.get('psy_qfq', 50)
-    psy_available, psy_error = check_data_availability('PSY', psy)
-
-    if psy_available:
-        if psy > INDICATOR_THRESHOLDS['PSY']['extreme_high']:
-            psy_emotion = "极度乐观"
-            emotion_score = apply_emotion_impact(emotion_score, 'negative', EMOTION_WEIGHTS['PSY'])
-            emotion_warnings.append(f"PSY显示极度乐观({psy:.1f})，市场可能过热")
-        elif psy > INDICATOR_THRESHOLDS['PSY']['high']:
-            psy_emotion = "偏乐观"
-            emotion_score = apply_emotion_impact(emotion_score, 'negative', {'positive': 2, 'negative': 2})
-            emotion_warnings.append(f"PSY显示偏乐观({psy:.1f})，注意风险")
-        elif psy < INDICATOR_THRESHOLDS['PSY']['extreme_low']:
-            psy_emotion = "极度悲观"
-            emotion_score = apply_emotion_impact(emotion_score, 'positive', EMOTION_WEIGHTS['PSY'])
-            emotion_opportunities.append(f"PSY显示极度悲观({psy:.1f})，可能存在机会")
-        elif psy < INDICATOR_THRESHOLDS['PSY']['low']:
-            psy_emotion = "偏悲观"
-            emotion_score = apply_emotion_impact(emotion_score, 'positive', {'positive': 2, 'negative': 2})
-            emotion_opportunities.append(f"PSY显示偏悲观({psy:.1f})，关注反弹")
-        else:
-            psy_emotion = "理性"
-            emotion_signals.append(f"PSY显示理性情绪({psy:.1f})")
-    else:
-        psy_emotion = psy_error
-
-    # 6. VR成交量比率分析 - 优化版
-    vr = latest.get('vr_qfq', 100)
-    vr_available, vr_error = check_data_availability('VR', vr)
-
-    if vr_available:
-        if vr > INDICATOR_THRESHOLDS['VR']['extreme_high']:
-            vr_emotion = "过度活跃"
-            emotion_score = apply_emotion_impact(emotion_score, 'negative', EMOTION_WEIGHTS['VR'])
-            emotion_warnings.append(f"VR显示成交过度活跃({vr:.1f})，注意风险")
-        elif vr > INDICATOR_THRESHOLDS['VR']['high']:
-            vr_emotion = "较活跃"
-            emotion_score = apply_emotion_impact(emotion_score, 'negative', {'positive': 1, 'negative': 1})
-            emotion_signals.append(f"VR显示成交较活跃({vr:.1f})")
-        elif vr < INDICATOR_THRESHOLDS['VR']['extreme_low']:
-            vr_emotion = "过度低迷"
-            emotion_score = apply_emotion_impact(emotion_score, 'positive', EMOTION_WEIGHTS['VR'])
-            emotion_opportunities.append(f"VR显示成交低迷({vr:.1f})，可能酝酿机会")
-        elif vr < INDICATOR_THRESHOLDS['VR']['low']:
-            vr_emotion = "偏低迷"
-            emotion_score = apply_emotion_impact(emotion_score, 'positive', {'positive': 1, 'negative': 1})
-            emotion_opportunities.append(f"VR显示成交偏低迷({vr:.1f})")
-        else:
-            vr_emotion = "正常"
-            emotion_signals.append(f"VR显示成交量正常({vr:.1f})")
-    else:
-        vr_emotion = vr_error
-
-    # 7. OBV能量潮分析 - 优化版
-    if len(df) >= 2:
-        obv_current = latest.get('obv_qfq', 0)
-        obv_previous = df.iloc[-2].get('obv_qfq', 0)
-
-        if pd.notna(obv_current) and pd.notna(obv_previous) and obv_previous != 0:
-            obv_change = (obv_current - obv_previous) / abs(obv_previous) * 100
-
-            # OBV趋势分析
-            if 'obv_qfq' in df.columns:
-                obv_trend, obv_trend_strength = analyze_indicator_trend(df['obv_qfq'], 'OBV', 5)
-                trend_analysis['OBV'] = {'trend': obv_trend, 'strength': obv_trend_strength}
-
-            if obv_change > 15:
-                obv_emotion = "资金大幅流入"
-                emotion_score = apply_emotion_impact(emotion_score, 'positive', EMOTION_WEIGHTS['OBV'])
-                emotion_signals.append(f"OBV显示资金大幅流入({obv_change:.1f}%)")
-            elif obv_change > 5:
-                obv_emotion = "资金流入积极"
-                emotion_score = apply_emotion_impact(emotion_score, 'positive', {'positive': 3, 'negative': 3})
-                emotion_signals.append(f"OBV显示资金流入积极({obv_change:.1f}%)")
-            elif obv_change < -15:
-                obv_emotion = "资金大幅流出"
-                emotion_score = apply_emotion_impact(emotion_score, 'negative', EMOTION_WEIGHTS['OBV'])
-                emotion_warnings.append(f"OBV显示资金大幅流出({obv_change:.1f}%)")
-            elif obv_change < -5:
-                obv_emotion = "资金流出明显"
-                emotion_score = apply_emotion_impact(emotion_score, 'negative', {'positive': 3, 'negative': 3})
-                emotion_warnings.append(f"OBV显示资金流出明显({obv_change:.1f}%)")
-            else:
-                obv_emotion = "资金流动平稳"
-                emotion_signals.append(f"OBV显示资金流动平稳({obv_change:.1f}%)")
-        else:
-            obv_emotion = "数据缺失"
-    else:
-        obv_emotion = "数据不足"
-
-    # 8. MFI资金流量指标分析 - 优化版
-    mfi = latest.get('mfi_qfq', 50)
-    mfi_available, mfi_error = check_data_availability('MFI', mfi)
-
-    if mfi_available:
-        if mfi > INDICATOR_THRESHOLDS['MFI']['high']:
-            mfi_emotion = "资金过度流入"
-            emotion_score = apply_emotion_impact(emotion_score, 'negative', EMOTION_WEIGHTS['MFI'])
-            emotion_warnings.append(f"MFI显示资金过度流入({mfi:.1f})，注意回调")
-        elif mfi < INDICATOR_THRESHOLDS['MFI']['low']:
-            mfi_emotion = "资金严重流出"
-            emotion_score = apply_emotion_impact(emotion_score, 'positive', EMOTION_WEIGHTS['MFI'])
-            emotion_opportunities.append(f"MFI显示资金严重流出({mfi:.1f})，关注底部")
-        else:
-            mfi_emotion = "资金流动正常"
-            emotion_signals.append(f"MFI显示资金流动正常({mfi:.1f})")
-    else:
-        mfi_emotion = mfi_error
-
-    # 9. 成交量确认分析 - 新增
-    if 'vol' in df.columns and len(df) >= 10:
-        recent_vol = recent_10['vol'].mean()
-        overall_vol = df['vol'].mean()
-        volume_ratio = recent_vol / overall_vol if overall_vol > 0 else 1
-
-        if volume_ratio > 2.0:
-            emotion_score = apply_emotion_impact(emotion_score, 'positive', EMOTION_WEIGHTS['VOLUME'])
-            emotion_signals.append(f"成交量大幅放大({volume_ratio:.1f}倍)，情绪确认有效")
-        elif volume_ratio > 1.5:
-            emotion_score = apply_emotion_impact(emotion_score, 'positive', {'positive': 2, 'negative': 2})
-            emotion_signals.append(f"成交量明显放大({volume_ratio:.1f}倍)，情绪有所确认")
-        elif volume_ratio < 0.7:
-            emotion_score = apply_emotion_impact(emotion_score, 'negative', {'positive': 1, 'negative': 1})
-            emotion_warnings.append(f"成交量萎缩({volume_ratio:.1f}倍)，情绪信号偏弱")
-
-    # 应用得分范围限制 - 关键优化
-    emotion_score = max(5, min(95, emotion_score))  # 严格限制在5-95范围
-
-    # 综合情绪等级评定 - 优化后阈值
-    if emotion_score >= 80:
-        emotion_level = "极度乐观"
-    elif emotion_score >= 68:
-        emotion_level = "乐观"
-    elif emotion_score >= 58:
-        emotion_level = "偏乐观"
-    elif emotion_score >= 42:
-        emotion_level = "中性"
-    elif emotion_score >= 32:
-        emotion_level = "偏悲观"
-    elif emotion_score >= 20:
-        emotion_level = "悲观"
-    else:
-        emotion_level = "极度悲观"
+    trend_analysis = {}
+    for name, trend in indicators['trends'].items():
+        if trend['enabled'][row]:
+            trend_analysis[name] = {'trend': str(trend['trend'][row]), 'strength': float(trend['strength'][row])}
 
-    # 计算数据完整性
-    total_indicators = 8
-    available_indicators = sum([
-        1 if valid_rsi else 0,
-        1 if cci_available else 0,
-        1 if kdj_values else 0,
-        1 if all(pd.notna([macd_dif, macd_dea, macd_hist])) else 0,
-        1 if psy_available else 0,
-        1 if vr_available else 0,
-        1 if obv_emotion != "数据缺失" and obv_emotion != "数据不足" else 0,
-        1 if mfi_available else 0
-    ])
-    data_completeness = available_indicators / total_indicators * 100
+    labels = {name: scores['labels'][name][row] for name in scores['labels']}
+    emotion_score = int(scores['emotion_score'][row])
+    emotion_level = scores['emotion_level'][row]
+    data_completeness = float(scores['data_completeness'][row])
 
     # 生成专业情绪分析报告 - 增强版
     emotion_analysis = generate_enhanced_emotion_analysis_report(
         emotion_level, emotion_score, data_completeness, trend_analysis,
-        rsi_emotion, cci_emotion, kdj_emotion, macd_emotion,
-        psy_emotion, vr_emotion, obv_emotion, mfi_emotion,
-        emotion_signals, emotion_warnings, emotion_opportunities
+        labels['RSI'], labels['CCI'], labels['KDJ'], labels['MACD'],
+        labels['PSY'], labels['VR'], labels['OBV'], labels['MFI'],
+        messages['signal'], messages['warning'], messages['opportunity']
     )
 
     return {
         'emotion_score': emotion_score,
         'emotion_level': emotion_level,
-        'rsi_emotion': rsi_emotion,
-        'cci_emotion': cci_emotion,
-        'kdj_emotion': kdj_emotion,
-        'macd_emotion': macd_emotion,
-        'psy_emotion': psy_emotion,
-        'vr_emotion': vr_emotion,
-        'obv_emotion': obv_emotion,
-        'mfi_emotion': mfi_emotion,
+        'rsi_emotion': labels['RSI'],
+        'cci_emotion': labels['CCI'],
+        'kdj_emotion': labels['KDJ'],
+        'macd_emotion': labels['MACD'],
+        'psy_emotion': labels['PSY'],
+        'vr_emotion': labels['VR'],
+        'obv_emotion': labels['OBV'],
+        'mfi_emotion': labels['MFI'],
         'emotion_analysis': emotion_analysis,
-        'emotion_signals': emotion_signals,
-        'emotion_warnings': emotion_warnings,
-        'emotion_opportunities': emotion_opportunities,
+        'emotion_signals': messages['signal'],
+        'emotion_warnings': messages['warning'],
+        'emotion_opportunities': messages['opportunity'],
         'data_completeness': data_completeness,
         'trend_analysis': trend_analysis
     }
 
 
+def calculate_emotion_analysis(hist_data):
+    """
+    专业情绪分析 - 基于前复权数据 (优化版本)
+    综合多个情绪指标：RSI、CCI、KDJ、MACD、PSY、VR等
+    优化内容：
+    1. 添加得分范围限制
+    2. 优化权重分配
+    3. 增加趋势分析
+    4. 改进数据完整性检查
+    5. 表驱动评分，与批量版本 calculate_emotion_analysis_batch 共用同一套规则
+    """
+    return render_emotion_analysis(calculate_emotion_analysis_batch([hist_data]), 0)
+
+
 def generate_enhanced_emotion_analysis_report(emotion_level, emotion_score, data_completeness, trend_analysis,
                                               rsi_emotion, cci_emotion, kdj_emotion, macd_emotion,
                                               psy_emotion, vr_emotion, obv_emotion, mfi_emotion,
@@ -692,12 +909,28 @@ def generate_enhanced_emotion_analysis_report(emotion_level, emotion_score, data
     return report
 
 
+# 增强版个股数据字段（stk_factor_pro）
+ENHANCED_STOCK_FIELDS = [
+    # 基础数据
+    "ts_code", "trade_date", "open", "open_qfq", "high", "high_qfq",
+    "low", "low_qfq", "close", "close_qfq", "pre_close", "change",
+    "pct_chg", "vol", "amount", "turnover_rate", "total_mv",
+    # 情绪相关指标（前复权）
+    "rsi_qfq_6", "rsi_qfq_12", "rsi_qfq_24",
+    "cci_qfq", "kdj_k_qfq", "kdj_d_qfq", "kdj_qfq",
+    "macd_dif_qfq", "macd_dea_qfq", "macd_qfq",
+    "psy_qfq", "vr_qfq", "obv_qfq", "mfi_qfq",
+    # 其他技术指标
+    "ma_qfq_5", "ma_qfq_10", "ma_qfq_20", "ma_qfq_60"
+]
+
+
 def get_enhanced_stock_data_with_emotion(stock_code, start_date, end_date):
     """
     获取增强版股票数据（包含情绪指标）- 使用前复权数据
     """
     try:
-        with api_lock:
+        with rate_limited_api_call():
             hist_data = pro.stk_factor_pro(**{
                 "ts_code": stock_code,
                 "start_date": start_date,
@@ -705,23 +938,11 @@ def get_enhanced_stock_data_with_emotion(stock_code, start_date, end_date):
                 "trade_date": "",
                 "limit": "",
                 "offset": ""
-            }, fields=[
-                # 基础数据
-                "ts_code", "trade_date", "open", "open_qfq", "high", "high_qfq",
-                "low", "low_qfq", "close", "close_qfq", "pre_close", "change",
-                "pct_chg", "vol", "amount", "turnover_rate", "total_mv",
-                # 情绪相关指标（前复权）
-                "rsi_qfq_6", "rsi_qfq_12", "rsi_qfq_24",
-                "cci_qfq", "kdj_k_qfq", "kdj_d_qfq", "kdj_qfq",
-                "macd_dif_qfq", "macd_dea_qfq", "macd_qfq",
-                "psy_qfq", "vr_qfq", "obv_qfq", "mfi_qfq",
-                # 其他技术指标
-                "ma_qfq_5", "ma_qfq_10", "ma_qfq_20", "ma_qfq_60"
-            ])
+            }, fields=ENHANCED_STOCK_FIELDS)
 
         if len(hist_data) == 0:
             # 备用方案：使用原接口
-            with api_lock:
+            with rate_limited_api_call():
                 hist_data = pro.daily(ts_code=stock_code, start_date=start_date, end_date=end_date)
             # 简化处理，添加前复权字段
             for col in ['open', 'high', 'low', 'close']:
@@ -733,7 +954,7 @@ def get_enhanced_stock_data_with_emotion(stock_code, start_date, end_date):
         print(f"获取情绪数据失败 {stock_code}: {e}")
         # 返回基础数据
         try:
-            with api_lock:
+            with rate_limited_api_call():
                 hist_data = pro.daily(ts_code=stock_code, start_date=start_date, end_date=end_date)
             for col in ['open', 'high', 'low', 'close']:
                 hist_data[f'{col}_qfq'] = hist_data[col]
@@ -743,6 +964,80 @@ def get_enhanced_stock_data_with_emotion(stock_code, start_date, end_date):
         # 情绪分析部分结束
 
 
+async def get_enhanced_stock_data_with_emotion_async(client, stock_code, start_date, end_date):
+    """get_enhanced_stock_data_with_emotion 的异步版本，client 为 AsyncTushareClient"""
+    try:
+        hist_data = await client.stk_factor_pro(ts_code=stock_code, start_date=start_date, end_date=end_date,
+                                                trade_date="", limit="", offset="", fields=ENHANCED_STOCK_FIELDS)
+
+        if len(hist_data) == 0:
+            # 备用方案：使用原接口
+            hist_data = await client.daily(ts_code=stock_code, start_date=start_date, end_date=end_date)
+            for col in ['open', 'high', 'low', 'close']:
+                if col in hist_data.columns:
+                    hist_data[f'{col}_qfq'] = hist_data[col]
+
+        return hist_data
+
+    except Exception as e:
+        print(f"获取情绪数据失败 {stock_code}: {e}")
+        try:
+            hist_data = await client.daily(ts_code=stock_code, start_date=start_date, end_date=end_date)
+            for col in ['open', 'high', 'low', 'close']:
+                if col in hist_data.columns:
+                    hist_data[f'{col}_qfq'] = hist_data[col]
+            return hist_data
+        except Exception:
+            return pd.DataFrame()
+
+
+async def fetch_stock_histories_async(stock_codes, start_date, end_date, max_connections=32):
+    """并发获取多只股票的增强版历史数据，返回 {股票代码: DataFrame}"""
+    async with AsyncTushareClient(max_connections=max_connections) as client:
+        results = await asyncio.gather(*[
+            get_enhanced_stock_data_with_emotion_async(client, code, start_date, end_date)
+            for code in stock_codes
+        ])
+    return dict(zip(stock_codes, results))
+
+
+def fetch_stock_histories(stock_codes, start_date, end_date, max_connections=32):
+    """同步入口：在新的事件循环中并发获取多只股票历史数据"""
+    return asyncio.run(fetch_stock_histories_async(stock_codes, start_date, end_date, max_connections))
+
+
+def build_price_panel(hist_data_list, fields, bars=60):
+    """
+    将多只股票的历史数据对齐为面板矩阵 (股票数 × K线数)
+    每只股票取按交易日排序后的最近bars根K线，靠右对齐，不足部分在左侧填充NaN；
+    'lengths' 记录每只股票的实际K线数量，'present' 记录每只股票是否包含该数据列
+    """
+    stock_count = len(hist_data_list)
+    panel = {field: np.full((stock_count, bars), np.nan) for field in fields}
+    present = {field: np.zeros(stock_count, dtype=bool) for field in fields}
+    lengths = np.zeros(stock_count, dtype=int)
+
+    for row, hist_data in enumerate(hist_data_list):
+        if hist_data is None or len(hist_data) == 0:
+            continue
+        df = hist_data
+        if not df['trade_date'].is_monotonic_increasing:
+            df = df.sort_values('trade_date')
+        available = [field for field in fields if field in df.columns]
+        try:
+            values = df[available].to_numpy(dtype=float)[-bars:]
+        except (TypeError, ValueError):
+            values = df[available].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)[-bars:]
+        lengths[row] = len(values)
+        for col, field in enumerate(available):
+            panel[field][row, bars - len(values):] = values[:, col]
+            present[field][row] = True
+
+    panel['lengths'] = lengths
+    panel['present'] = present
+    return panel
+
+
 def calculate_atr(hist_data, period=14):
     """计算ATR（平均真实波幅）用于动态止损 - 使用前复权数据"""
     df = hist_data.copy().sort_values('trade_date')
@@ -786,459 +1081,362 @@ def calculate_four_dimensional_analysis(hist_data):
     """
     专业四维结构分析法 - 使用前复权数据
     四个维度：时间、价格、成交量、空间
+    单只股票按全部K线组成一行面板，与批量版本 calculate_four_dimensional_analysis_batch 共用同一套计算
     """
-    df = hist_data.copy().sort_values('trade_date')
+    panel = build_price_panel([hist_data], FOUR_DIMENSION_FIELDS, bars=max(len(hist_data), 60))
+    return render_four_dimensional_analysis(calculate_four_dimensional_analysis_batch(panel), 0)
 
-    if len(df) < 60:
-        return {
-            'time_dimension': {'trend': '数据不足', 'cycle_analysis': '无法分析'},
-            'price_dimension': {'structure': '数据不足', 'key_levels': []},
-            'volume_dimension': {'distribution': '数据不足', 'anomaly': '无法检测'},
-            'space_dimension': {'volatility': '数据不足', 'range_analysis': '无法分析'},
-            'comprehensive_score': 0,
-            'structure_type': '无法确定',
-            'structure_strength': '弱'
-        }
-
-    # 第一维度：时间维度分析
-    time_analysis = analyze_time_dimension(df)
-
-    # 第二维度：价格维度分析
-    price_analysis = analyze_price_dimension(df)
-
-    # 第三维度：成交量维度分析
-    volume_analysis = analyze_volume_dimension(df)
 
-    # 第四维度：空间维度分析
-    space_analysis = analyze_space_dimension(df)
+# 四维分析综合得分权重
+FOUR_DIMENSION_WEIGHTS = {'time': 0.30, 'price': 0.30, 'volume': 0.25, 'space': 0.15}
+# 四维结构分析批量引擎需要的数据列
+FOUR_DIMENSION_FIELDS = ['high_qfq', 'low_qfq', 'close_qfq', 'vol']
 
-    # 综合评分计算
-    comprehensive_score = calculate_comprehensive_score(
-        time_analysis, price_analysis, volume_analysis, space_analysis
-    )
 
-    # 结构类型判断
-    structure_type = determine_structure_type(
-        time_analysis, price_analysis, volume_analysis, space_analysis
-    )
+def find_panel_extrema(values, order, lengths, find_peaks=True):
+    """
+    面板版局部极值检测，结果与逐只股票调用 argrelextrema(..., order=order) 一致
+    values 为靠右对齐的 (股票数 × K线数) 面板，lengths 为每只股票的实际K线数，左侧填充部分视为不存在
+    """
+    values = np.asarray(values, dtype=float)
+    bars = values.shape[1]
+    positions = np.arange(bars)[np.newaxis, :]
+    first_real = bars - np.asarray(lengths)[:, np.newaxis]
+    is_real = positions >= first_real
+    compare = np.greater if find_peaks else np.less
 
-    return {
-        'time_dimension': time_analysis,
-        'price_dimension': price_analysis,
-        'volume_dimension': volume_analysis,
-        'space_dimension': space_analysis,
-        'comprehensive_score': comprehensive_score,
-        'structure_type': structure_type,
-        'structure_strength': get_structure_strength(comprehensive_score)
-    }
+    # argrelextrema 的边界按clip处理：第一根和最后一根K线永远不是极值点
+    extrema = is_real & (positions > first_real) & (positions < bars - 1)
 
+    with np.errstate(invalid='ignore'):
+        for shift in range(1, order + 1):
+            left = np.full_like(values, np.nan)
+            left[:, shift:] = values[:, :-shift]
+            left_real = np.zeros_like(is_real)
+            left_real[:, shift:] = is_real[:, :-shift]
+            extrema &= np.where(left_real, compare(values, left), True)
 
-def analyze_time_dimension(df):
-    """时间维度分析：趋势持续性、周期性 - 使用前复权数据"""
-    recent_60 = df.tail(60)
-    recent_20 = df.tail(20)
-    recent_5 = df.tail(5)
-
-    # 多周期趋势分析 - 使用前复权收盘价
-    trend_5d = "上升" if recent_5['close_qfq'].iloc[-1] > recent_5['close_qfq'].iloc[0] else "下降"
-    trend_20d = "上升" if recent_20['close_qfq'].iloc[-1] > recent_20['close_qfq'].iloc[0] else "下降"
-    trend_60d = "上升" if recent_60['close_qfq'].iloc[-1] > recent_60['close_qfq'].iloc[0] else "下降"
-
-    # 趋势一致性分析
-    trend_consistency = 0
-    if trend_5d == trend_20d == trend_60d:
-        trend_consistency = 90  # 高度一致
-    elif (trend_5d == trend_20d) or (trend_20d == trend_60d):
-        trend_consistency = 60  # 中等一致
-    else:
-        trend_consistency = 30  # 低一致性
+            right = np.full_like(values, np.nan)
+            right[:, :-shift] = values[:, shift:]
+            extrema &= np.where(positions < bars - shift, compare(values, right), True)
 
-    # 价格动能分析 - 使用前复权数据
-    momentum_5d = (recent_5['close_qfq'].iloc[-1] / recent_5['close_qfq'].iloc[0] - 1) * 100
-    momentum_20d = (recent_20['close_qfq'].iloc[-1] / recent_20['close_qfq'].iloc[0] - 1) * 100
+    return extrema
 
-    # 周期性分析（基于波峰波谷）- 使用前复权数据
-    highs = df['high_qfq'].values
-    lows = df['low_qfq'].values
 
-    # 寻找局部极值
-    high_peaks = argrelextrema(highs, np.greater, order=5)[0] if len(highs) > 10 else []
-    low_valleys = argrelextrema(lows, np.less, order=5)[0] if len(lows) > 10 else []
+def last_extrema_positions(extrema, count):
+    """每只股票最近count个极值点的位置（从近到远），不足的位置为-1"""
+    positions = np.where(extrema, np.arange(extrema.shape[1]), -1)
+    return -np.sort(-positions, axis=1)[:, :count]
 
-    # 计算平均周期
-    if len(high_peaks) > 2:
-        avg_peak_cycle = np.mean(np.diff(high_peaks))
-    else:
-        avg_peak_cycle = 0
 
-    if len(low_valleys) > 2:
-        avg_valley_cycle = np.mean(np.diff(low_valleys))
-    else:
-        avg_valley_cycle = 0
-
-    # 当前位置判断
-    current_position = "中性"
-    if len(high_peaks) > 0 and len(low_valleys) > 0:
-        last_high_idx = high_peaks[-1] if len(high_peaks) > 0 else 0
-        last_low_idx = low_valleys[-1] if len(low_valleys) > 0 else 0
-        current_idx = len(df) - 1
-
-        if last_high_idx > last_low_idx:
-            days_from_high = current_idx - last_high_idx
-            if days_from_high < 5:
-                current_position = "高位附近"
-            elif days_from_high < 15:
-                current_position = "高位回落"
-            else:
-                current_position = "下降通道"
-        else:
-            days_from_low = current_idx - last_low_idx
-            if days_from_low < 5:
-                current_position = "低位附近"
-            elif days_from_low < 15:
-                current_position = "低位反弹"
-            else:
-                current_position = "上升通道"
-
-    return {
-        'short_trend': trend_5d,
-        'medium_trend': trend_20d,
-        'long_trend': trend_60d,
-        'trend_consistency': trend_consistency,
-        'momentum_5d': momentum_5d,
-        'momentum_20d': momentum_20d,
-        'avg_cycle': (avg_peak_cycle + avg_valley_cycle) / 2 if avg_peak_cycle > 0 and avg_valley_cycle > 0 else 0,
-        'current_position': current_position,
-        'time_score': min(trend_consistency + abs(momentum_20d) * 2, 100)
-    }
+def calculate_four_dimensional_analysis_batch(panel):
+    """
+    批量四维结构分析引擎 - 使用前复权数据
+    panel 为 build_price_panel 生成的对齐面板（至少60根K线，包含 FOUR_DIMENSION_FIELDS），
+    沿时间轴一次性计算全部股票的时间、价格、成交量、空间维度指标和综合评分；
+    面板宽度超过60根时，周期分析使用全部K线
+    """
+    lengths = np.asarray(panel['lengths'])
+    high, low, close = panel['high_qfq'], panel['low_qfq'], panel['close_qfq']
+    stock_count, bars = close.shape
+
+    def take(values, positions):
+        return np.take_along_axis(values, np.maximum(positions, 0), axis=1)
+
+    def row_mean(values):
+        return np.nanmean(values, axis=1) if values.size else np.full(len(values), np.nan)
+
+    def forward_fill(values):
+        # 与 pandas pct_change 默认的 pad 填充一致：缺失值沿用前一根K线
+        filled_positions = np.where(np.isnan(values), 0, np.arange(values.shape[1]))
+        return np.take_along_axis(values, np.maximum.accumulate(filled_positions, axis=1), axis=1)
+
+    metrics = {'sufficient': (lengths >= 60) & (bars >= 60), 'has_volume': panel['present']['vol']}
+
+    with np.errstate(divide='ignore', invalid='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+
+        # 第一维度：时间维度
+        current_close = close[:, -1]
+        trend_5d = current_close > close[:, -5]
+        trend_20d = current_close > close[:, -20]
+        trend_60d = current_close > close[:, -60]
+        metrics['short_trend'] = np.where(trend_5d, "上升", "下降")
+        metrics['medium_trend'] = np.where(trend_20d, "上升", "下降")
+        metrics['long_trend'] = np.where(trend_60d, "上升", "下降")
+        metrics['trend_consistency'] = np.select(
+            [(trend_5d == trend_20d) & (trend_20d == trend_60d), (trend_5d == trend_20d) | (trend_20d == trend_60d)],
+            [90, 60], default=30
+        )
+        metrics['momentum_5d'] = (current_close / close[:, -5] - 1) * 100
+        metrics['momentum_20d'] = (current_close / close[:, -20] - 1) * 100
+
+        # 周期性分析（基于波峰波谷）
+        peaks = find_panel_extrema(high, 5, lengths, find_peaks=True)
+        valleys = find_panel_extrema(low, 5, lengths, find_peaks=False)
+        peak_count, valley_count = peaks.sum(axis=1), valleys.sum(axis=1)
+        positions = np.arange(bars)
+        first_peak = np.where(peaks, positions, bars).min(axis=1)
+        last_peak = np.where(peaks, positions, -1).max(axis=1)
+        first_valley = np.where(valleys, positions, bars).min(axis=1)
+        last_valley = np.where(valleys, positions, -1).max(axis=1)
+
+        avg_peak_cycle = np.where(peak_count > 2, (last_peak - first_peak) / np.maximum(peak_count - 1, 1), 0)
+        avg_valley_cycle = np.where(valley_count > 2, (last_valley - first_valley) / np.maximum(valley_count - 1, 1), 0)
+        metrics['avg_cycle'] = np.where((avg_peak_cycle > 0) & (avg_valley_cycle > 0),
+                                        (avg_peak_cycle + avg_valley_cycle) / 2, 0)
+
+        days_from_high = bars - 1 - last_peak
+        days_from_low = bars - 1 - last_valley
+        metrics['current_position'] = np.select(
+            [(peak_count == 0) | (valley_count == 0),
+             (last_peak > last_valley) & (days_from_high < 5),
+             (last_peak > last_valley) & (days_from_high < 15),
+             last_peak > last_valley,
+             days_from_low < 5,
+             days_from_low < 15],
+            ["中性", "高位附近", "高位回落", "下降通道", "低位附近", "低位反弹"],
+            default="上升通道"
+        )
+        metrics['time_score'] = np.minimum(metrics['trend_consistency'] + np.abs(metrics['momentum_20d']) * 2, 100)
+
+        # 第二维度：价格维度（最近60根K线）
+        high_60, low_60, close_60 = high[:, -60:], low[:, -60:], close[:, -60:]
+        period_high = np.nanmax(high_60, axis=1)
+        period_low = np.nanmin(low_60, axis=1)
+        price_range = period_high - period_low
+        price_position = (current_close - period_low) / price_range * 100
+        metrics['current_position_pct'] = price_position
+
+        # 关键价位：与 np.linspace(period_low, period_high, 20) 第16-18个分位点一致
+        metrics['key_levels'] = (np.array([16.0, 17.0, 18.0])[np.newaxis, :] * (price_range / 19)[:, np.newaxis]
+                                 + period_low[:, np.newaxis])
+        metrics['fibonacci_levels'] = (period_high[:, np.newaxis]
+                                       - price_range[:, np.newaxis] * np.array([0.236, 0.382, 0.5, 0.618, 0.786]))
+
+        close_60_filled = forward_fill(close_60)
+        returns = close_60_filled[:, 1:] / close_60_filled[:, :-1] - 1
+        metrics['volatility'] = np.nanstd(returns, axis=1, ddof=1) * np.sqrt(252) * 100
+        metrics['price_score'] = np.minimum(np.abs(price_position - 50) + (100 - metrics['volatility']), 100)
+
+        # 价格形态识别（最近20根K线）
+        high_20, low_20, close_20 = high[:, -20:], low[:, -20:], close[:, -20:]
+        lengths_20 = np.minimum(lengths, 20)
+        pattern_peaks = last_extrema_positions(find_panel_extrema(high_20, 3, lengths_20, True), 3)
+        pattern_valleys = last_extrema_positions(find_panel_extrema(low_20, 3, lengths_20, False), 3)
+        peak_heights = take(high_20, pattern_peaks)
+        valley_depths = take(low_20, pattern_valleys)
+        has_peaks = pattern_peaks >= 0
+        has_valleys = pattern_valleys >= 0
+
+        double_top = has_peaks[:, 1] & (np.abs(peak_heights[:, 0] / peak_heights[:, 1] - 1) < 0.03)
+        double_bottom = has_valleys[:, 1] & (np.abs(valley_depths[:, 0] / valley_depths[:, 1] - 1) < 0.03)
+        head_shoulders_top = (has_peaks[:, 2] & (peak_heights[:, 1] > peak_heights[:, 2]) &
+                              (peak_heights[:, 1] > peak_heights[:, 0]) &
+                              (np.abs(peak_heights[:, 2] / peak_heights[:, 0] - 1) < 0.05))
+        head_shoulders_bottom = (has_valleys[:, 2] & (valley_depths[:, 1] < valley_depths[:, 2]) &
+                                 (valley_depths[:, 1] < valley_depths[:, 0]) &
+                                 (np.abs(valley_depths[:, 2] / valley_depths[:, 0] - 1) < 0.05))
+        pattern_trend = (close_20[:, -1] / close_20[:, 0] - 1) * 100
+        metrics['price_pattern'] = np.array([
+            f"上升趋势 (+{strength:.1f}%)" if strength > 5 else f"下降趋势 ({strength:.1f}%)" if strength < -5 else base
+            for strength, base in zip(pattern_trend, np.select(
+                [head_shoulders_bottom, head_shoulders_top, double_bottom, double_top],
+                ["头肩底形态", "头肩顶形态", "双底形态", "双顶形态"], default="震荡整理"))
+        ], dtype=object)
+
+        # 第三维度：成交量维度
+        vol_60 = panel['vol'][:, -60:]
+        recent_volume = vol_60[:, -1]
+        volume_ma20 = np.mean(vol_60[:, -20:], axis=1)
+        volume_ratio = recent_volume / volume_ma20
+        metrics['volume_ratio'] = volume_ratio
+        metrics['volume_trend'] = np.select(
+            [volume_ratio > 3, volume_ratio > 2, volume_ratio > 1.5, volume_ratio < 0.5],
+            ["爆量", "巨量", "放量", "缩量"], default="正常"
+        )
 
+        # 量价相关性：只用价格和成交量变化都有效的K线，有效K线不超过5根时记为0
+        vol_60_filled = forward_fill(vol_60)
+        volume_changes = vol_60_filled[:, 1:] / vol_60_filled[:, :-1] - 1
+        paired = ~np.isnan(returns) & ~np.isnan(volume_changes)
+        paired_returns = np.where(paired, returns, np.nan)
+        paired_volume_changes = np.where(paired, volume_changes, np.nan)
+        price_dev = np.where(paired, paired_returns - row_mean(paired_returns)[:, np.newaxis], 0)
+        volume_dev = np.where(paired, paired_volume_changes - row_mean(paired_volume_changes)[:, np.newaxis], 0)
+        correlation = (np.sum(price_dev * volume_dev, axis=1) /
+                       np.sqrt(np.sum(price_dev ** 2, axis=1) * np.sum(volume_dev ** 2, axis=1)))
+        metrics['price_volume_correlation'] = np.where(np.isnan(correlation) | (paired.sum(axis=1) <= 5),
+                                                       0, correlation)
+
+        # 异常量能检测
+        volume_mean = np.nanmean(vol_60, axis=1)
+        volume_std = np.nanstd(vol_60, axis=1, ddof=1)
+        z_score = np.where(volume_std > 0, (recent_volume - volume_mean) / volume_std, 0)
+        metrics['volume_z_score'] = z_score
+        metrics['volume_anomaly'] = np.select(
+            [z_score > 3, z_score < -3, z_score > 2, z_score < -2, z_score > 1, z_score < -1],
+            ["极异常", "极缩量", "异常", "明显缩量", "偏高", "偏低"], default="正常"
+        )
 
-def analyze_price_dimension(df):
-    """价格维度分析：结构形态、关键价位 - 使用前复权数据"""
-    recent_data = df.tail(60)
+        # 成交量分布分析
+        volume_quartiles = np.nanquantile(vol_60, [0.25, 0.5, 0.75], axis=1)
+        metrics['volume_quartiles'] = volume_quartiles.T
+        metrics['volume_distribution'] = np.select(
+            [recent_volume > volume_quartiles[2], recent_volume > volume_quartiles[1],
+             recent_volume > volume_quartiles[0]],
+            ["高量区", "中高量区", "中低量区"], default="低量区"
+        )
+        metrics['volume_score'] = np.minimum(np.abs(metrics['price_volume_correlation']) * 50 +
+                                             np.minimum(volume_ratio, 3) * 20, 100)
+
+        # 第四维度：空间维度
+        metrics['total_range_pct'] = price_range / current_close * 100
+        daily_ranges = (high_60 - low_60) / close_60 * 100
+        metrics['avg_daily_range'] = np.nanmean(daily_ranges, axis=1)
+        metrics['current_daily_range'] = daily_ranges[:, -1]
+
+        # 支撑阻力强度：触及关键位后的反弹/回落比例
+        next_up = np.zeros_like(close_60, dtype=bool)
+        next_down = np.zeros_like(close_60, dtype=bool)
+        next_up[:, :-1] = close_60[:, 1:] > close_60[:, :-1]
+        next_down[:, :-1] = close_60[:, 1:] < close_60[:, :-1]
+        tolerance = 0.02
+
+        def level_strength(prices, level, bounce):
+            touched = ((prices <= (level * (1 + tolerance))[:, np.newaxis]) &
+                       (prices >= (level * (1 - tolerance))[:, np.newaxis]))
+            touched[:, 0] = False
+            touches = touched.sum(axis=1)
+            bounces = (touched & bounce).sum(axis=1)
+            return np.minimum(np.where(touches > 0, bounces / np.maximum(touches, 1), 0), 1.0)
+
+        support_strength = level_strength(low_60, period_low, next_up)
+        resistance_strength = level_strength(high_60, period_high, next_down)
+        metrics['support_strength'] = support_strength
+        metrics['resistance_strength'] = resistance_strength
+
+        metrics['space_utilization'] = 100 - np.abs(price_position - 50)
+        metrics['breakthrough_probability'] = np.select(
+            [price_position > 80, price_position < 20],
+            [30 + resistance_strength * 20, 30 + support_strength * 20], default=50
+        )
+        metrics['space_score'] = np.minimum(metrics['space_utilization'] + metrics['avg_daily_range'] * 2, 100)
+
+    # 成交量数据缺失时成交量维度记0分
+    has_volume = metrics['has_volume']
+    metrics['volume_score'] = np.where(has_volume, metrics['volume_score'], 0)
+    metrics['price_volume_correlation'] = np.where(has_volume, metrics['price_volume_correlation'], 0)
+    metrics['volume_trend'] = np.where(has_volume, metrics['volume_trend'], '数据缺失')
+
+    # 综合评分：时间30%，价格30%，成交量25%，空间15%
+    weights = FOUR_DIMENSION_WEIGHTS
+    metrics['comprehensive_score'] = np.minimum(
+        metrics['time_score'] * weights['time'] + metrics['price_score'] * weights['price'] +
+        metrics['volume_score'] * weights['volume'] + metrics['space_score'] * weights['space'], 100
+    )
 
-    # 价格结构分析 - 使用前复权数据
-    current_price = recent_data['close_qfq'].iloc[-1]
-    period_high = recent_data['high_qfq'].max()
-    period_low = recent_data['low_qfq'].min()
+    # 结构类型判断
+    strong_volume = np.isin(metrics['volume_trend'], ['放量', '巨量', '爆量'])
+    consistency = metrics['trend_consistency']
+    metrics['structure_type'] = np.select(
+        [(consistency > 70) & (price_position > 70) & strong_volume,
+         (consistency > 70) & (price_position < 30) & strong_volume,
+         (consistency > 70) & (consistency > 85),
+         consistency > 70,
+         (price_position > 40) & (price_position < 60),
+         (price_position > 80) | (price_position < 20)],
+        ["强势突破结构", "强势反转结构", "趋势延续结构", "健康调整结构", "平衡震荡结构", "极值反转结构"],
+        default="不明确结构"
+    )
+    metrics['structure_strength'] = np.array(["弱", "偏弱", "中等", "强", "极强"], dtype=object)[
+        np.digitize(np.nan_to_num(metrics['comprehensive_score'], nan=0), [35, 50, 65, 80])]
 
-    # 价格位置
-    price_position = (current_price - period_low) / (period_high - period_low) * 100
+    return metrics
 
-    # 关键价位识别
-    key_levels = []
 
-    # 支撑阻力位（基于密集成交区域）
-    price_ranges = np.linspace(period_low, period_high, 20)
-    volume_at_price = []
-
-    for i in range(len(price_ranges) - 1):
-        range_low = price_ranges[i]
-        range_high = price_ranges[i + 1]
-        volume_in_range = recent_data[
-            (recent_data['low_qfq'] <= range_high) & (recent_data['high_qfq'] >= range_low)
-            ]['vol'].sum()
-        volume_at_price.append((range_low + range_high) / 2)
-
-    # 找出成交量最大的价位区间作为关键位
-    if len(volume_at_price) > 0:
-        sorted_indices = np.argsort(volume_at_price)[-3:]  # 取前3个
-        key_levels = [price_ranges[i] for i in sorted_indices]
-
-    # 斐波那契回调位
-    fib_levels = []
-    if period_high != period_low:
-        fib_ratios = [0.236, 0.382, 0.5, 0.618, 0.786]
-        for ratio in fib_ratios:
-            fib_level = period_high - (period_high - period_low) * ratio
-            fib_levels.append(fib_level)
-
-    # 价格形态识别
-    price_pattern = identify_price_pattern(recent_data)
-
-    # 波动率分析 - 使用前复权数据
-    returns = recent_data['close_qfq'].pct_change().dropna()
-    volatility = returns.std() * np.sqrt(252) * 100  # 年化波动率
+def render_four_dimensional_analysis(metrics, row):
+    """将批量引擎的结果还原为单只股票的四维分析字典，格式与 calculate_four_dimensional_analysis 一致"""
+    if not metrics['sufficient'][row]:
+        return {
+            'time_dimension': {'trend': '数据不足', 'cycle_analysis': '无法分析'},
+            'price_dimension': {'structure': '数据不足', 'key_levels': []},
+            'volume_dimension': {'distribution': '数据不足', 'anomaly': '无法检测'},
+            'space_dimension': {'volatility': '数据不足', 'range_analysis': '无法分析'},
+            'comprehensive_score': 0,
+            'structure_type': '无法确定',
+            'structure_strength': '弱'
+        }
 
-    return {
-        'current_position_pct': price_position,
-        'key_support_levels': key_levels[:2] if len(key_levels) >= 2 else key_levels,
-        'key_resistance_levels': key_levels[2:] if len(key_levels) > 2 else [],
-        'fibonacci_levels': fib_levels,
-        'price_pattern': price_pattern,
-        'volatility': volatility,
-        'price_score': min(abs(price_position - 50) + (100 - volatility), 100)
+    def value(name):
+        item = metrics[name][row]
+        return item.item() if isinstance(item, np.generic) else item
+
+    key_levels = metrics['key_levels'][row].tolist()
+    price_range = metrics['fibonacci_levels'][row][0] != metrics['fibonacci_levels'][row][-1]
+
+    time_analysis = {
+        'short_trend': value('short_trend'),
+        'medium_trend': value('medium_trend'),
+        'long_trend': value('long_trend'),
+        'trend_consistency': value('trend_consistency'),
+        'momentum_5d': value('momentum_5d'),
+        'momentum_20d': value('momentum_20d'),
+        'avg_cycle': value('avg_cycle'),
+        'current_position': value('current_position'),
+        'time_score': value('time_score')
     }
-
-
-def analyze_volume_dimension(df):
-    """成交量维度分析：量价关系、异常量能"""
-    recent_data = df.tail(60)
-
-    if 'vol' not in recent_data.columns:
-        return {
+    price_analysis = {
+        'current_position_pct': value('current_position_pct'),
+        'key_support_levels': key_levels[:2],
+        'key_resistance_levels': key_levels[2:],
+        'fibonacci_levels': metrics['fibonacci_levels'][row].tolist() if price_range else [],
+        'price_pattern': value('price_pattern'),
+        'volatility': value('volatility'),
+        'price_score': value('price_score')
+    }
+    if metrics['has_volume'][row]:
+        volume_analysis = {
+            'volume_trend': value('volume_trend'),
+            'price_volume_correlation': value('price_volume_correlation'),
+            'volume_anomaly': value('volume_anomaly'),
+            'volume_distribution': value('volume_distribution'),
+            'volume_ratio': value('volume_ratio'),
+            'volume_score': value('volume_score')
+        }
+    else:
+        volume_analysis = {
             'volume_trend': '数据缺失',
             'price_volume_correlation': 0,
             'volume_anomaly': '无法检测',
             'volume_distribution': '数据缺失',
             'volume_score': 0
         }
-
-    # 成交量趋势分析
-    volume_ma5 = recent_data['vol'].rolling(5).mean()
-    volume_ma20 = recent_data['vol'].rolling(20).mean()
-
-    current_vol_ratio = recent_data['vol'].iloc[-1] / volume_ma20.iloc[-1]
-
-    volume_trend = "正常"
-    if current_vol_ratio > 3:
-        volume_trend = "爆量"
-    elif current_vol_ratio > 2:
-        volume_trend = "巨量"
-    elif current_vol_ratio > 1.5:
-        volume_trend = "放量"
-    elif current_vol_ratio < 0.5:
-        volume_trend = "缩量"
-
-    # 量价相关性分析 - 使用前复权数据
-    price_changes = recent_data['close_qfq'].pct_change().dropna()
-    volume_changes = recent_data['vol'].pct_change().dropna()
-
-    if len(price_changes) > 5 and len(volume_changes) > 5:
-        min_len = min(len(price_changes), len(volume_changes))
-        correlation = np.corrcoef(
-            price_changes.iloc[-min_len:],
-            volume_changes.iloc[-min_len:]
-        )[0, 1]
-        correlation = correlation if not np.isnan(correlation) else 0
-    else:
-        correlation = 0
-
-    # 异常量能检测
-    volume_std = recent_data['vol'].std()
-    volume_mean = recent_data['vol'].mean()
-    recent_volume = recent_data['vol'].iloc[-1]
-
-    z_score = (recent_volume - volume_mean) / volume_std if volume_std > 0 else 0
-
-    volume_anomaly = "正常"
-    if abs(z_score) > 3:
-        volume_anomaly = "极异常" if z_score > 0 else "极缩量"
-    elif abs(z_score) > 2:
-        volume_anomaly = "异常" if z_score > 0 else "明显缩量"
-    elif abs(z_score) > 1:
-        volume_anomaly = "偏高" if z_score > 0 else "偏低"
-
-    # 成交量分布分析
-    volume_quartiles = recent_data['vol'].quantile([0.25, 0.5, 0.75])
-    current_vol_position = "低量区"
-    if recent_volume > volume_quartiles[0.75]:
-        current_vol_position = "高量区"
-    elif recent_volume > volume_quartiles[0.5]:
-        current_vol_position = "中高量区"
-    elif recent_volume > volume_quartiles[0.25]:
-        current_vol_position = "中低量区"
-
-    return {
-        'volume_trend': volume_trend,
-        'price_volume_correlation': correlation,
-        'volume_anomaly': volume_anomaly,
-        'volume_distribution': current_vol_position,
-        'volume_ratio': current_vol_ratio,
-        'volume_score': min(abs(correlation) * 50 + min(current_vol_ratio, 3) * 20, 100)
+    space_analysis = {
+        'current_position_pct': value('current_position_pct'),
+        'total_range_pct': value('total_range_pct'),
+        'avg_daily_range': value('avg_daily_range'),
+        'current_daily_range': value('current_daily_range'),
+        'support_strength': value('support_strength'),
+        'resistance_strength': value('resistance_strength'),
+        'space_utilization': value('space_utilization'),
+        'breakthrough_probability': value('breakthrough_probability'),
+        'space_score': value('space_score')
     }
 
-
-def analyze_space_dimension(df):
-    """空间维度分析：波动空间、支撑阻力强度 - 使用前复权数据"""
-    recent_data = df.tail(60)
-
-    # 波动空间分析 - 使用前复权数据
-    current_price = recent_data['close_qfq'].iloc[-1]
-    period_high = recent_data['high_qfq'].max()
-    period_low = recent_data['low_qfq'].min()
-
-    total_range = period_high - period_low
-    current_position = (current_price - period_low) / total_range * 100
-
-    # 日内波动分析 - 使用前复权数据
-    daily_ranges = (recent_data['high_qfq'] - recent_data['low_qfq']) / recent_data['close_qfq'] * 100
-    avg_daily_range = daily_ranges.mean()
-    current_daily_range = daily_ranges.iloc[-1]
-
-    # 支撑阻力强度分析
-    # 计算价格在各个水平的停留时间和反弹次数
-    support_strength = calculate_level_strength(recent_data, period_low, is_support=True)
-    resistance_strength = calculate_level_strength(recent_data, period_high, is_support=False)
-
-    # 空间利用率
-    space_utilization = 100 - abs(current_position - 50)  # 越接近中间，利用率越低
-
-    # 突破概率评估
-    breakthrough_probability = 50  # 基础概率
-
-    if current_position > 80:  # 高位
-        breakthrough_probability = 30 + resistance_strength * 20
-    elif current_position < 20:  # 低位
-        breakthrough_probability = 30 + support_strength * 20
-    else:  # 中位
-        breakthrough_probability = 50
-
     return {
-        'current_position_pct': current_position,
-        'total_range_pct': total_range / current_price * 100,
-        'avg_daily_range': avg_daily_range,
-        'current_daily_range': current_daily_range,
-        'support_strength': support_strength,
-        'resistance_strength': resistance_strength,
-        'space_utilization': space_utilization,
-        'breakthrough_probability': breakthrough_probability,
-        'space_score': min(space_utilization + avg_daily_range * 2, 100)
+        'time_dimension': time_analysis,
+        'price_dimension': price_analysis,
+        'volume_dimension': volume_analysis,
+        'space_dimension': space_analysis,
+        'comprehensive_score': value('comprehensive_score'),
+        'structure_type': value('structure_type'),
+        'structure_strength': value('structure_strength')
     }
 
 
-def calculate_level_strength(df, level, is_support=True, tolerance=0.02):
-    """计算支撑或阻力位的强度 - 使用前复权数据"""
-    touches = 0
-    bounces = 0
-
-    level_range_low = level * (1 - tolerance)
-    level_range_high = level * (1 + tolerance)
-
-    for i in range(1, len(df)):
-        if is_support:
-            # 检查是否触及支撑位 - 使用前复权数据
-            if df.iloc[i]['low_qfq'] <= level_range_high and df.iloc[i]['low_qfq'] >= level_range_low:
-                touches += 1
-                # 检查是否反弹
-                if i < len(df) - 1 and df.iloc[i + 1]['close_qfq'] > df.iloc[i]['close_qfq']:
-                    bounces += 1
-        else:
-            # 检查是否触及阻力位 - 使用前复权数据
-            if df.iloc[i]['high_qfq'] <= level_range_high and df.iloc[i]['high_qfq'] >= level_range_low:
-                touches += 1
-                # 检查是否回落
-                if i < len(df) - 1 and df.iloc[i + 1]['close_qfq'] < df.iloc[i]['close_qfq']:
-                    bounces += 1
-
-    strength = bounces / touches if touches > 0 else 0
-    return min(strength, 1.0)
-
-
-def identify_price_pattern(df):
-    """识别价格形态 - 使用前复权数据"""
-    if len(df) < 20:
-        return "数据不足"
-
-    recent_20 = df.tail(20)
-    highs = recent_20['high_qfq'].values
-    lows = recent_20['low_qfq'].values
-    closes = recent_20['close_qfq'].values
-
-    # 寻找局部极值
-    high_peaks_idx = argrelextrema(highs, np.greater, order=3)[0]
-    low_valleys_idx = argrelextrema(lows, np.less, order=3)[0]
-
-    pattern = "震荡整理"
-
-    # 双顶形态检测
-    if len(high_peaks_idx) >= 2:
-        last_two_peaks = high_peaks_idx[-2:]
-        peak_heights = highs[last_two_peaks]
-        if abs(peak_heights[1] / peak_heights[0] - 1) < 0.03:  # 高度相近
-            pattern = "双顶形态"
-
-    # 双底形态检测
-    if len(low_valleys_idx) >= 2:
-        last_two_valleys = low_valleys_idx[-2:]
-        valley_depths = lows[last_two_valleys]
-        if abs(valley_depths[1] / valley_depths[0] - 1) < 0.03:  # 深度相近
-            pattern = "双底形态"
-
-    # 头肩形态检测（简化版）
-    if len(high_peaks_idx) >= 3:
-        last_three_peaks = high_peaks_idx[-3:]
-        peak_heights = highs[last_three_peaks]
-        if (peak_heights[1] > peak_heights[0] and
-                peak_heights[1] > peak_heights[2] and
-                abs(peak_heights[0] / peak_heights[2] - 1) < 0.05):
-            pattern = "头肩顶形态"
-
-    if len(low_valleys_idx) >= 3:
-        last_three_valleys = low_valleys_idx[-3:]
-        valley_depths = lows[last_three_valleys]
-        if (valley_depths[1] < valley_depths[0] and
-                valley_depths[1] < valley_depths[2] and
-                abs(valley_depths[0] / valley_depths[2] - 1) < 0.05):
-            pattern = "头肩底形态"
-
-    # 趋势形态检测
-    first_close = closes[0]
-    last_close = closes[-1]
-    trend_strength = (last_close / first_close - 1) * 100
-
-    if trend_strength > 5:
-        pattern = f"上升趋势 (+{trend_strength:.1f}%)"
-    elif trend_strength < -5:
-        pattern = f"下降趋势 ({trend_strength:.1f}%)"
-
-    return pattern
-
-
-def calculate_comprehensive_score(time_analysis, price_analysis, volume_analysis, space_analysis):
-    """计算四维分析综合得分"""
-    time_score = time_analysis.get('time_score', 0)
-    price_score = price_analysis.get('price_score', 0)
-    volume_score = volume_analysis.get('volume_score', 0)
-    space_score = space_analysis.get('space_score', 0)
-
-    # 权重分配：时间30%，价格30%，成交量25%，空间15%
-    comprehensive_score = (
-            time_score * 0.30 +
-            price_score * 0.30 +
-            volume_score * 0.25 +
-            space_score * 0.15
-    )
-
-    return min(comprehensive_score, 100)
-
-
-def determine_structure_type(time_analysis, price_analysis, volume_analysis, space_analysis):
-    """确定结构类型"""
-    trend_consistency = time_analysis.get('trend_consistency', 0)
-    price_position = price_analysis.get('current_position_pct', 50)
-    volume_trend = volume_analysis.get('volume_trend', '正常')
-    space_position = space_analysis.get('current_position_pct', 50)
-
-    if trend_consistency > 70:
-        if price_position > 70 and volume_trend in ['放量', '巨量', '爆量']:
-            return "强势突破结构"
-        elif price_position < 30 and volume_trend in ['放量', '巨量', '爆量']:
-            return "强势反转结构"
-        elif trend_consistency > 85:
-            return "趋势延续结构"
-        else:
-            return "健康调整结构"
-    elif 40 < price_position < 60:
-        return "平衡震荡结构"
-    elif price_position > 80 or price_position < 20:
-        return "极值反转结构"
-    else:
-        return "不明确结构"
-
-
-def get_structure_strength(score):
-    """根据综合得分评估结构强度"""
-    if score >= 80:
-        return "极强"
-    elif score >= 65:
-        return "强"
-    elif score >= 50:
-        return "中等"
-    elif score >= 35:
-        return "偏弱"
-    else:
-        return "弱"
+# 顶底结构分析周期：(K线数量, 周期标签)，按从长到短排列
+STRUCTURE_PERIODS = ((60, "60日"), (30, "30日"), (15, "15日"))
 
 
 def analyze_top_bottom_structure(hist_data):
@@ -1259,16 +1457,13 @@ def analyze_top_bottom_structure(hist_data):
             'structure_analysis': '历史数据不足，无法进行有效的顶底结构分析'
         }
 
-    # 分析不同时间跨度的结构
-    structures_60d = analyze_structure_period(df.tail(60), "60日")
-    structures_30d = analyze_structure_period(df.tail(30), "30日")
-    structures_15d = analyze_structure_period(df.tail(15), "15日")
+    # 楔形趋势线斜率：三个周期的最近15根K线相同，只计算一次
+    wedge_slopes = calculate_trend_line_slopes(df['high_qfq'].values, df['low_qfq'].values)
 
-    # 合并所有结构
-    all_top_structures = (structures_60d['tops'] + structures_30d['tops'] +
-                          structures_15d['tops'])
-    all_bottom_structures = (structures_60d['bottoms'] + structures_30d['bottoms'] +
-                             structures_15d['bottoms'])
+    # 多周期结构扫描：60/30/15日窗口相互嵌套，每个形态只识别一次并标注所属周期
+    structures = analyze_structure_multi_period(df, STRUCTURE_PERIODS, wedge_slopes)
+    all_top_structures = structures['tops']
+    all_bottom_structures = structures['bottoms']
 
     # 当前结构判断
     current_structure = determine_current_structure(df, all_top_structures, all_bottom_structures)
@@ -1298,7 +1493,40 @@ def analyze_top_bottom_structure(hist_data):
     }
 
 
-def analyze_structure_period(df, period_name):
+def analyze_structure_multi_period(df, periods=None, wedge_slopes=None):
+    """
+    多周期顶底结构扫描 - 使用前复权数据
+    各周期窗口都是最近N根K线，短周期嵌套在长周期内，因此只在最长窗口上扫描一次，
+    再按形态起始位置标注它所属的全部周期，避免同一形态被重复识别和重复计分
+    """
+    if periods is None:
+        periods = STRUCTURE_PERIODS
+
+    max_window = max(window for window, _ in periods)
+    scan_df = df.tail(max_window)
+    scanned = analyze_structure_period(scan_df, "", wedge_slopes)
+
+    # 交易日 -> 扫描窗口内位置
+    date_positions = {date: pos for pos, date in enumerate(scan_df['trade_date'].values)}
+    scan_len = len(scan_df)
+
+    def label_periods(structure_list):
+        labeled = []
+        for structure in structure_list:
+            start_pos = date_positions.get(structure['formation_dates'][0], 0)
+            member_periods = [name for window, name in periods
+                              if min(window, scan_len) >= 10 and start_pos >= scan_len - min(window, scan_len)]
+            if not member_periods:
+                continue
+            structure['periods'] = member_periods
+            structure['period'] = '/'.join(member_periods)
+            labeled.append(structure)
+        return labeled
+
+    return {'tops': label_periods(scanned['tops']), 'bottoms': label_periods(scanned['bottoms'])}
+
+
+def analyze_structure_period(df, period_name, wedge_slopes=None):
     """分析特定周期的结构形态 - 使用前复权数据"""
     if len(df) < 10:
         return {'tops': [], 'bottoms': []}
@@ -1319,13 +1547,13 @@ def analyze_structure_period(df, period_name):
     top_structures.extend(detect_double_top(df, high_peaks_idx, period_name))
     top_structures.extend(detect_triple_top(df, high_peaks_idx, period_name))
     top_structures.extend(detect_head_shoulders_top(df, high_peaks_idx, period_name))
-    top_structures.extend(detect_rising_wedge(df, period_name))
+    top_structures.extend(detect_rising_wedge(df, period_name, wedge_slopes))
 
     # 分析底部结构
     bottom_structures.extend(detect_double_bottom(df, low_valleys_idx, period_name))
     bottom_structures.extend(detect_triple_bottom(df, low_valleys_idx, period_name))
     bottom_structures.extend(detect_head_shoulders_bottom(df, low_valleys_idx, period_name))
-    bottom_structures.extend(detect_falling_wedge(df, period_name))
+    bottom_structures.extend(detect_falling_wedge(df, period_name, wedge_slopes))
 
     return {'tops': top_structures, 'bottoms': bottom_structures}
 
@@ -1604,20 +1832,97 @@ def detect_head_shoulders_bottom(df, valleys_idx, period):
     return structures
 
 
-def detect_rising_wedge(df, period):
+@lru_cache(maxsize=8)
+def get_trend_line_x_moments(window):
+    """趋势线x轴矩（预计算）：中心化x序列及其平方和"""
+    x_centered = np.arange(window, dtype=float) - (window - 1) / 2
+    sxx = window * (window ** 2 - 1) / 12
+    return x_centered, sxx
+
+
+def calculate_trend_line_slopes(highs, lows, window=15):
+    """
+    最近window根K线高低点的最小二乘趋势线斜率（闭式解）- 使用前复权数据
+    highs/lows 可以是单只股票的一维数组，也可以是 (股票数 × K线数) 的二维矩阵，
+    二维时一次矩阵运算得到全部股票的斜率
+    """
+    x_centered, sxx = get_trend_line_x_moments(window)
+    highs = np.asarray(highs, dtype=float)[..., -window:]
+    lows = np.asarray(lows, dtype=float)[..., -window:]
+
+    if highs.shape[-1] < window:
+        nan_shape = highs.shape[:-1]
+        return np.full(nan_shape, np.nan), np.full(nan_shape, np.nan)
+
+    # slope = Σ(x - x̄)·y / Σ(x - x̄)²，x中心化后无需减去y均值
+    high_slope = highs @ x_centered / sxx
+    low_slope = lows @ x_centered / sxx
+    return high_slope, low_slope
+
+
+def calculate_rolling_trend_line_slopes(highs, lows, window=15):
+    """
+    滚动趋势线斜率：每个历史日期以其为终点的window根K线斜率
+    前window-1个位置为NaN；支持一维序列或 (股票数 × K线数) 矩阵
+    """
+    x_centered, sxx = get_trend_line_x_moments(window)
+    highs = np.asarray(highs, dtype=float)
+    lows = np.asarray(lows, dtype=float)
+
+    high_slope = np.full(highs.shape, np.nan)
+    low_slope = np.full(lows.shape, np.nan)
+    if highs.shape[-1] < window:
+        return high_slope, low_slope
+
+    high_windows = np.lib.stride_tricks.sliding_window_view(highs, window, axis=-1)
+    low_windows = np.lib.stride_tricks.sliding_window_view(lows, window, axis=-1)
+    high_slope[..., window - 1:] = high_windows @ x_centered / sxx
+    low_slope[..., window - 1:] = low_windows @ x_centered / sxx
+    return high_slope, low_slope
+
+
+def classify_wedge_state(high_slope, low_slope):
+    """
+    根据趋势线斜率判断楔形状态：1=上升楔形，-1=下降楔形，0=无楔形
+    判断条件与 detect_rising_wedge / detect_falling_wedge 一致
+    """
+    high_slope = np.asarray(high_slope, dtype=float)
+    low_slope = np.asarray(low_slope, dtype=float)
+
+    with np.errstate(invalid='ignore'):
+        rising = (high_slope > 0) & (low_slope > 0) & (low_slope > high_slope * 1.2)
+        falling = (high_slope < 0) & (low_slope < 0) & (np.abs(low_slope) < np.abs(high_slope) * 0.8)
+
+    return np.where(rising, 1, np.where(falling, -1, 0))
+
+
+def calculate_rolling_wedge_state(hist_data, window=15):
+    """一次性计算每个历史日期的楔形状态 - 使用前复权数据"""
+    df = hist_data.sort_values('trade_date')
+    high_slope, low_slope = calculate_rolling_trend_line_slopes(
+        df['high_qfq'].values, df['low_qfq'].values, window
+    )
+
+    return pd.DataFrame({
+        'trade_date': df['trade_date'].values,
+        'high_slope': high_slope,
+        'low_slope': low_slope,
+        'wedge_state': classify_wedge_state(high_slope, low_slope)
+    })
+
+
+def detect_rising_wedge(df, period, slopes=None):
     """检测上升楔形 - 使用前复权数据"""
     if len(df) < 15:
         return []
 
     # 简化的楔形检测：寻找收敛的上升趋势线
     recent_data = df.tail(15)
-    highs = recent_data['high_qfq'].values
-    lows = recent_data['low_qfq'].values
 
-    # 计算趋势线斜率
-    x = range(len(highs))
-    high_slope = np.polyfit(x, highs, 1)[0]
-    low_slope = np.polyfit(x, lows, 1)[0]
+    # 计算趋势线斜率（可直接使用预先计算好的斜率）
+    if slopes is None:
+        slopes = calculate_trend_line_slopes(recent_data['high_qfq'].values, recent_data['low_qfq'].values)
+    high_slope, low_slope = float(slopes[0]), float(slopes[1])
 
     # 上升楔形：上升趋势但高点上升斜率 < 低点上升斜率，且都在上升
     if (high_slope > 0 and low_slope > 0 and low_slope > high_slope * 1.2):
@@ -1637,19 +1942,17 @@ def detect_rising_wedge(df, period):
     return []
 
 
-def detect_falling_wedge(df, period):
+def detect_falling_wedge(df, period, slopes=None):
     """检测下降楔形 - 使用前复权数据"""
     if len(df) < 15:
         return []
 
     recent_data = df.tail(15)
-    highs = recent_data['high_qfq'].values
-    lows = recent_data['low_qfq'].values
 
-    # 计算趋势线斜率
-    x = range(len(highs))
-    high_slope = np.polyfit(x, highs, 1)[0]
-    low_slope = np.polyfit(x, lows, 1)[0]
+    # 计算趋势线斜率（可直接使用预先计算好的斜率）
+    if slopes is None:
+        slopes = calculate_trend_line_slopes(recent_data['high_qfq'].values, recent_data['low_qfq'].values)
+    high_slope, low_slope = float(slopes[0]), float(slopes[1])
 
     # 下降楔形：下降趋势但低点下降斜率 < 高点下降斜率，且都在下降
     if (high_slope < 0 and low_slope < 0 and abs(low_slope) < abs(high_slope) * 0.8):
@@ -1913,221 +2216,426 @@ def generate_structure_analysis_report(current_structure, top_structures, bottom
     return report
 
 
-def calculate_td_sequential_enhanced(hist_data):
-    """增强版TD序列计算 - 使用前复权数据"""
-    df = hist_data.copy()
-    df = df.sort_values('trade_date')
+# TD序列状态机输出的数据列
+TD_OUTPUT_COLUMNS = ['td_setup', 'td_countdown', 'td_perfected', 'td_combo', 'td_flip_price', 'tdst_resistance',
+                     'tdst_support', 'td_risk_level', 'td_sequential_13', 'td_pressure', 'td_momentum']
+
+
+def run_td_state_machine(close, high, low, origin=0, stop=None, reference_states=None, record_states=False):
+    """
+    TD序列状态机（Setup、Countdown、Combo、TDST、压力、动量和风险等级）- 使用前复权数据
+    close、high、low 为浮点数列表（由调用方转换一次，逐日回放时各窗口共用）；
+    处理绝对位置 [origin, stop) 的K线，origin 相当于数据窗口的第一根K线；
+    record_states=True 时记录每根K线处理后的状态，供逐日回放比对；
+    提供 reference_states 时，一旦状态与参照一致（且已越过与窗口起点相关的判断），即停止计算
+    返回 (输出列字典, 状态列表或None, 收敛位置或None)，输出列长度为实际处理的K线数
+    """
+    c, h, l = close, high, low
+    stop = len(c) if stop is None else stop
+    n = max(stop - origin, 0)
+
+    td_setup = [0] * n
+    td_countdown = [0] * n
+    td_perfected = [False] * n
+    td_combo = [0] * n
+    td_flip_price = [0.0] * n
+    tdst_resistance = [0.0] * n
+    tdst_support = [0.0] * n
+    td_risk_level = [0] * n
+    td_sequential_13 = [False] * n
+    td_pressure = [0] * n
+    td_momentum = [0.0] * n
+    states = [None] * n if record_states else None
 
-    # 初始化TD指标列
-    df['td_setup'] = 0
-    df['td_countdown'] = 0
-    df['td_perfected'] = False
-    df['td_combo'] = 0
-    df['td_flip_price'] = 0.0
-    df['tdst_resistance'] = 0.0
-    df['tdst_support'] = 0.0
-    df['td_risk_level'] = 0
-    df['td_sequential_13'] = False
-    df['td_pressure'] = 0
-    df['td_momentum'] = 0
-
-    # TD Setup计算
     buy_setup_count = 0
     sell_setup_count = 0
-    setup_direction = 0
-    setup_start_idx = 0
-
-    # TD Countdown计算
+    setup_start_idx = origin
     countdown_active = False
     countdown_type = 0
     countdown_count = 0
-    countdown_start_idx = 0
-
-    # TD Combo计算
+    countdown_start_idx = origin
     combo_count = 0
     combo_type = 0
+    converged_at = None
 
-    for i in range(4, len(df)):
-        # 获取翻转价格（4天前的收盘价）- 使用前复权数据
-        flip_price = df.iloc[i - 4]['close_qfq']
-        df.iloc[i, df.columns.get_loc('td_flip_price')] = flip_price
+    def nan_min(values):
+        values = [value for value in values if value == value]
+        return min(values) if values else np.nan
 
-        current_close = df.iloc[i]['close_qfq']
-        current_low = df.iloc[i]['low_qfq']
-        current_high = df.iloc[i]['high_qfq']
+    def nan_max(values):
+        values = [value for value in values if value == value]
+        return max(values) if values else np.nan
 
-        # TD Buy Setup
-        if current_close < flip_price:
-            if buy_setup_count >= 0:
-                buy_setup_count += 1
-                sell_setup_count = 0
-                df.iloc[i, df.columns.get_loc('td_setup')] = buy_setup_count
-                setup_direction = 1
-
-                if buy_setup_count == 1:
-                    setup_start_idx = i
-
-                # 检查完美设置
-                if buy_setup_count == 8 or buy_setup_count == 9:
-                    if i >= 7:
-                        low_6 = df.iloc[i - 2]['low_qfq']
-                        low_7 = df.iloc[i - 1]['low_qfq']
-                        if current_low < min(low_6, low_7):
-                            df.iloc[i, df.columns.get_loc('td_perfected')] = True
-
-                # Setup 9完成
-                if buy_setup_count == 9:
-                    countdown_active = True
-                    countdown_type = 1
-                    countdown_count = 0
-                    countdown_start_idx = i
-
-                    # 计算TDST支撑线
-                    setup_data = df.iloc[setup_start_idx:i + 1]
-                    tdst_support = setup_data['low_qfq'].min()
-                    df.iloc[i, df.columns.get_loc('tdst_support')] = tdst_support
-
-                    # 开始Combo计数
-                    combo_count = 1
-                    combo_type = 1
+    for i in range(origin + 4, stop):
+        w = i - origin
+        flip_price = c[i - 4]
+        td_flip_price[w] = flip_price
+        current_close = c[i]
 
-            else:
-                buy_setup_count = 1
-                sell_setup_count = 0
-                df.iloc[i, df.columns.get_loc('td_setup')] = buy_setup_count
-                setup_direction = 1
+        # TD Setup
+        if current_close < flip_price:
+            buy_setup_count += 1
+            sell_setup_count = 0
+            td_setup[w] = buy_setup_count
+            if buy_setup_count == 1:
                 setup_start_idx = i
-
-        # TD Sell Setup
+            if (buy_setup_count == 8 or buy_setup_count == 9) and w >= 7:
+                if l[i] < min(l[i - 2], l[i - 1]):
+                    td_perfected[w] = True
+            if buy_setup_count == 9:
+                countdown_active = True
+                countdown_type = 1
+                countdown_count = 0
+                countdown_start_idx = i
+                tdst_support[w] = nan_min(l[setup_start_idx:i + 1])
+                combo_count = 1
+                combo_type = 1
         elif current_close > flip_price:
-            if sell_setup_count <= 0:
-                sell_setup_count -= 1
-                buy_setup_count = 0
-                df.iloc[i, df.columns.get_loc('td_setup')] = sell_setup_count
-                setup_direction = -1
-
-                if sell_setup_count == -1:
-                    setup_start_idx = i
-
-                # 检查完美设置
-                if sell_setup_count == -8 or sell_setup_count == -9:
-                    if i >= 7:
-                        high_6 = df.iloc[i - 2]['high_qfq']
-                        high_7 = df.iloc[i - 1]['high_qfq']
-                        if current_high > max(high_6, high_7):
-                            df.iloc[i, df.columns.get_loc('td_perfected')] = True
-
-                # Setup -9完成
-                if sell_setup_count == -9:
-                    countdown_active = True
-                    countdown_type = -1
-                    countdown_count = 0
-                    countdown_start_idx = i
-
-                    # 计算TDST阻力线
-                    setup_data = df.iloc[setup_start_idx:i + 1]
-                    tdst_resistance = setup_data['high_qfq'].max()
-                    df.iloc[i, df.columns.get_loc('tdst_resistance')] = tdst_resistance
-
-                    # 开始Combo计数
-                    combo_count = -1
-                    combo_type = -1
-
-            else:
-                sell_setup_count = -1
-                buy_setup_count = 0
-                df.iloc[i, df.columns.get_loc('td_setup')] = sell_setup_count
-                setup_direction = -1
+            sell_setup_count -= 1
+            buy_setup_count = 0
+            td_setup[w] = sell_setup_count
+            if sell_setup_count == -1:
                 setup_start_idx = i
+            if (sell_setup_count == -8 or sell_setup_count == -9) and w >= 7:
+                if h[i] > max(h[i - 2], h[i - 1]):
+                    td_perfected[w] = True
+            if sell_setup_count == -9:
+                countdown_active = True
+                countdown_type = -1
+                countdown_count = 0
+                countdown_start_idx = i
+                tdst_resistance[w] = nan_max(h[setup_start_idx:i + 1])
+                combo_count = -1
+                combo_type = -1
         else:
             # 价格等于翻转价格，Setup中断
             buy_setup_count = 0
             sell_setup_count = 0
             combo_count = 0
 
-        # TD Countdown计算 - 使用前复权数据
-        if countdown_active and i > countdown_start_idx and i >= 2:
-            if countdown_type == 1:  # 买入倒计时
-                if current_close <= df.iloc[i - 2]['low_qfq']:
-                    countdown_count += 1
-                    df.iloc[i, df.columns.get_loc('td_countdown')] = countdown_count
+        # TD Countdown
+        if countdown_active and i > countdown_start_idx:
+            if countdown_type == 1 and current_close <= l[i - 2]:
+                countdown_count += 1
+                td_countdown[w] = countdown_count
+                if countdown_count == 13:
+                    td_sequential_13[w] = True
+            elif countdown_type == -1 and current_close >= h[i - 2]:
+                countdown_count -= 1
+                td_countdown[w] = countdown_count
+                if countdown_count == -13:
+                    td_sequential_13[w] = True
+            if abs(countdown_count) >= 13:
+                countdown_active = False
+                countdown_count = 0
+
+        # TD Combo
+        if combo_type != 0 and i > setup_start_idx:
+            if combo_type == 1 and current_close < c[i - 1]:
+                combo_count += 1
+                td_combo[w] = combo_count
+            elif combo_type == -1 and current_close > c[i - 1]:
+                combo_count -= 1
+                td_combo[w] = combo_count
+            if abs(combo_count) >= 13:
+                combo_count = 0
+                combo_type = 0
+
+        # TD压力指标
+        pressure = 0
+        if w >= 9:
+            recent_highs = nan_max(h[i - 9:i + 1])
+            recent_lows = nan_min(l[i - 9:i + 1])
+            if recent_highs > recent_lows:
+                price_position = (current_close - recent_lows) / (recent_highs - recent_lows)
+                pressure = int((1 - price_position) * 10)
+        td_pressure[w] = pressure
+
+        # TD动量指标
+        if c[i - 4] != 0:
+            price_change = (current_close - c[i - 4]) / c[i - 4]
+        else:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                price_change = float(np.float64(current_close - c[i - 4]) / c[i - 4])
+        momentum = min(max(price_change * 100, -10), 10)
+        td_momentum[w] = momentum
+
+        # 综合TD风险等级
+        risk_level = 0
+        setup_value, countdown_value, combo_value = td_setup[w], td_countdown[w], td_combo[w]
+        if abs(setup_value) >= 7:
+            risk_level += 1 * np.sign(setup_value)
+        if abs(setup_value) == 9:
+            risk_level += 2 * np.sign(setup_value)
+        if abs(countdown_value) >= 10:
+            risk_level += 1 * np.sign(countdown_value)
+        if abs(countdown_value) == 13:
+            risk_level += 3 * np.sign(countdown_value)
+        if abs(combo_value) >= 10:
+            risk_level += 1 * np.sign(combo_value)
+        if pressure >= 8:
+            risk_level -= 1
+        if momentum > 5:
+            risk_level += 1
+        elif momentum < -5:
+            risk_level -= 1
+        td_risk_level[w] = int(max(min(risk_level, 5), -5))
+
+        # 状态中不含起点位置：连续计数确定了Setup起点，Countdown起点只影响启动当根K线
+        if record_states or reference_states is not None:
+            state = (buy_setup_count, sell_setup_count, countdown_active,
+                     countdown_type if countdown_active else 0, countdown_count, combo_count, combo_type)
+            if record_states:
+                states[w] = state
+            if reference_states is not None and w >= 9 and reference_states[i] == state:
+                converged_at = i
+                n = w + 1
+                break
+
+    outputs = {
+        'td_setup': np.array(td_setup[:n], dtype=np.int64),
+        'td_countdown': np.array(td_countdown[:n], dtype=np.int64),
+        'td_perfected': np.array(td_perfected[:n], dtype=bool),
+        'td_combo': np.array(td_combo[:n], dtype=np.int64),
+        'td_flip_price': np.array(td_flip_price[:n], dtype=float),
+        'tdst_resistance': np.array(tdst_resistance[:n], dtype=float),
+        'tdst_support': np.array(tdst_support[:n], dtype=float),
+        'td_risk_level': np.array(td_risk_level[:n], dtype=np.int64),
+        'td_sequential_13': np.array(td_sequential_13[:n], dtype=bool),
+        'td_pressure': np.array(td_pressure[:n], dtype=np.int64),
+        'td_momentum': np.array(td_momentum[:n], dtype=float) if n > 4 else np.zeros(n, dtype=np.int64)
+    }
+    return outputs, states, converged_at
+
 
-                    if countdown_count == 13:
-                        df.iloc[i, df.columns.get_loc('td_sequential_13')] = True
+def calculate_td_sequential_enhanced(hist_data):
+    """增强版TD序列计算 - 使用前复权数据"""
+    df = hist_data.copy()
+    df = df.sort_values('trade_date')
 
-            elif countdown_type == -1:  # 卖出倒计时
-                if current_close >= df.iloc[i - 2]['high_qfq']:
-                    countdown_count -= 1
-                    df.iloc[i, df.columns.get_loc('td_countdown')] = countdown_count
+    outputs, _, _ = run_td_state_machine(df['close_qfq'].to_numpy(dtype=float).tolist(),
+                                         df['high_qfq'].to_numpy(dtype=float).tolist(),
+                                         df['low_qfq'].to_numpy(dtype=float).tolist())
+    for column in TD_OUTPUT_COLUMNS:
+        df[column] = outputs[column]
+
+    return df
+
+
+# 逐日回放时各评估日窗口内统计的TD信号次数（与 perform_td_analysis_enhanced 的 td_stats 一致）
+TD_WINDOW_COUNTS = {
+    'setup_9_count': lambda outputs: np.abs(outputs['td_setup']) == 9,
+    'perfected_count': lambda outputs: outputs['td_perfected'],
+    'countdown_13_count': lambda outputs: np.abs(outputs['td_countdown']) == 13,
+    'sequential_13_count': lambda outputs: outputs['td_sequential_13'],
+    'combo_13_count': lambda outputs: np.abs(outputs['td_combo']) == 13
+}
+
+
+def get_evaluation_windows(trade_dates, evaluation_dates, window_days=180):
+    """
+    计算每个评估日的数据窗口：[评估日前window_days天, 评估日] 内的交易日位置
+    trade_dates 为升序的 YYYYMMDD 字符串数组；返回 (起点位置, 终点位置) 数组，评估日之前没有数据时终点为-1
+    """
+    trade_dates = np.asarray(trade_dates, dtype=str)
+    evaluation_dates = np.asarray(evaluation_dates, dtype=str)
+    window_starts = (pd.to_datetime(evaluation_dates) - timedelta(days=window_days)).strftime('%Y%m%d')
+    origins = np.searchsorted(trade_dates, np.asarray(window_starts, dtype=str), side='left')
+    ends = np.searchsorted(trade_dates, evaluation_dates, side='right') - 1
+    ends = np.where(ends >= origins, ends, -1)
+    return origins, ends
+
+
+def calculate_walk_forward_td(hist_data, evaluation_dates, window_days=180):
+    """
+    TD序列逐日回放 - 使用前复权数据
+    全区间只运行一次TD状态机；每个评估日从窗口起点重新计算，状态与全区间一致后直接沿用全区间结果，
+    因此结果与按 [评估日前window_days天, 评估日] 窗口调用 calculate_td_sequential_enhanced 的最后一行一致；
+    'td_warmup_effect' 标记窗口起点使当日TD状态不同于全区间计算结果的评估日
+    返回每个评估日一行的DataFrame（按评估日当天或之前最近的交易日取值，没有数据的评估日不输出）
+    """
+    df = hist_data.sort_values('trade_date')
+    trade_dates = df['trade_date'].astype(str).to_numpy()
+    close = df['close_qfq'].to_numpy(dtype=float).tolist()
+    high = df['high_qfq'].to_numpy(dtype=float).tolist()
+    low = df['low_qfq'].to_numpy(dtype=float).tolist()
+
+    full_outputs, full_states, _ = run_td_state_machine(close, high, low, record_states=True)
+    full_counts = {name: np.concatenate([[0], np.cumsum(rule(full_outputs))]) for name, rule in TD_WINDOW_COUNTS.items()}
+
+    origins, ends = get_evaluation_windows(trade_dates, evaluation_dates, window_days)
+    rows = []
+    for evaluation_date, origin, end in zip(evaluation_dates, origins, ends):
+        if end < 0:
+            continue
 
-                    if countdown_count == -13:
-                        df.iloc[i, df.columns.get_loc('td_sequential_13')] = True
+        window_outputs, _, converged_at = run_td_state_machine(close, high, low, origin, end + 1,
+                                                               reference_states=full_states)
+        row = {'eval_date': evaluation_date, 'trade_date': trade_dates[end], 'window_bars': int(end - origin + 1)}
+
+        if converged_at is None or converged_at >= end:
+            # 评估日之前状态未与全区间一致：当日结果取窗口计算值
+            for column in TD_OUTPUT_COLUMNS:
+                row[column] = window_outputs[column][-1].item()
+            for name, rule in TD_WINDOW_COUNTS.items():
+                row[name] = int(rule(window_outputs).sum())
+            row['td_warmup_effect'] = any(row[column] != full_outputs[column][end].item()
+                                          for column in TD_OUTPUT_COLUMNS)
+        else:
+            for column in TD_OUTPUT_COLUMNS:
+                row[column] = full_outputs[column][end].item()
+            for name, rule in TD_WINDOW_COUNTS.items():
+                row[name] = int(rule(window_outputs).sum() +
+                                full_counts[name][end + 1] - full_counts[name][converged_at + 1])
+            row['td_warmup_effect'] = False
+        rows.append(row)
 
-            # 倒计时完成
-            if abs(countdown_count) >= 13:
-                countdown_active = False
-                countdown_count = 0
+    return pd.DataFrame(rows)
 
-        # TD Combo计算 - 使用前复权数据
-        if combo_type != 0 and i > setup_start_idx:
-            if combo_type == 1 and current_close < df.iloc[i - 1]['close_qfq']:
-                combo_count += 1
-                df.iloc[i, df.columns.get_loc('td_combo')] = combo_count
-            elif combo_type == -1 and current_close > df.iloc[i - 1]['close_qfq']:
-                combo_count -= 1
-                df.iloc[i, df.columns.get_loc('td_combo')] = combo_count
 
-            if abs(combo_count) >= 13:
-                combo_count = 0
-                combo_type = 0
+# 逐日快照中保留的四维分项得分和情绪指标取值，供特征库重新评分使用
+FOUR_DIMENSION_SCORE_COLUMNS = ['time_score', 'price_score', 'volume_score', 'space_score']
+EMOTION_INDICATOR_COLUMNS = [f'emotion_{name.lower()}' for name in EMOTION_INDICATORS]
 
-        # 计算TD压力指标（新增）- 使用前复权数据
-        pressure = 0
-        if i >= 9:
-            recent_highs = df.iloc[i - 9:i + 1]['high_qfq'].max()
-            recent_lows = df.iloc[i - 9:i + 1]['low_qfq'].min()
-            if recent_highs > recent_lows:
-                price_position = (current_close - recent_lows) / (recent_highs - recent_lows)
-                pressure = int((1 - price_position) * 10)  # 0-10的压力级别
-        df.iloc[i, df.columns.get_loc('td_pressure')] = pressure
 
-        # 计算TD动量指标（新增）- 使用前复权数据
-        momentum = 0
-        if i >= 4:
-            price_change = (current_close - df.iloc[i - 4]['close_qfq']) / df.iloc[i - 4]['close_qfq']
-            momentum = min(max(price_change * 100, -10), 10)  # -10到+10的动量
-        df.iloc[i, df.columns.get_loc('td_momentum')] = momentum
+def build_window_panel(series_list, stock_rows, origins, ends, fields, bars):
+    """
+    由各股票全区间数据按 (起点, 终点) 位置切出窗口，组成靠右对齐的面板 (窗口数 × K线数)
+    series_list 为每只股票 {字段: 全区间数组}；格式与 build_price_panel 一致，可直接用于批量四维和情绪引擎
+    """
+    stock_rows = np.asarray(stock_rows)
+    origins = np.asarray(origins)
+    ends = np.asarray(ends)
+    sizes = np.array([len(next(iter(series.values()))) for series in series_list])
+    offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]])
 
-        # 计算综合TD风险等级（增强版）
-        risk_level = 0
+    positions = ends[:, np.newaxis] - (bars - 1) + np.arange(bars)[np.newaxis, :]
+    valid = positions >= origins[:, np.newaxis]
+    flat_positions = offsets[stock_rows][:, np.newaxis] + np.maximum(positions, 0)
 
-        # Setup风险
-        if abs(df.iloc[i]['td_setup']) >= 7:
-            risk_level += 1 * np.sign(df.iloc[i]['td_setup'])
-        if abs(df.iloc[i]['td_setup']) == 9:
-            risk_level += 2 * np.sign(df.iloc[i]['td_setup'])
+    panel = {}
+    for field in fields:
+        flat = np.concatenate([series.get(field, np.full(size, np.nan)) for series, size in zip(series_list, sizes)])
+        panel[field] = np.where(valid, flat[flat_positions], np.nan)
 
-        # Countdown风险
-        if abs(df.iloc[i]['td_countdown']) >= 10:
-            risk_level += 1 * np.sign(df.iloc[i]['td_countdown'])
-        if abs(df.iloc[i]['td_countdown']) == 13:
-            risk_level += 3 * np.sign(df.iloc[i]['td_countdown'])
+    panel['lengths'] = np.minimum(ends - origins + 1, bars)
+    panel['present'] = {field: np.array([field in series_list[row] for row in stock_rows], dtype=bool)
+                        for field in fields}
+    return panel
 
-        # Combo风险
-        if abs(df.iloc[i]['td_combo']) >= 10:
-            risk_level += 1 * np.sign(df.iloc[i]['td_combo'])
 
-        # 压力和动量调整
-        if pressure >= 8:
-            risk_level -= 1
-        if momentum > 5:
-            risk_level += 1
-        elif momentum < -5:
-            risk_level -= 1
+def calculate_walk_forward_snapshots(hist_data_by_code, evaluation_dates, window_days=180, chunk_size=20000):
+    """
+    全市场逐日回放快照 - 使用前复权数据
+    对每只股票每个评估日输出与按窗口单独分析一致的 TD序列状态、均线、ATR、市场强度、量比、
+    四维结构评分（含四个分项得分）、情绪评分（含各情绪指标取值）和TD信号等级；TD部分来自 calculate_walk_forward_td，其余指标由 build_window_panel
+    切出的窗口面板批量计算，每次处理 chunk_size 个窗口以控制内存
+    """
+    evaluation_dates = sorted({str(date) for date in evaluation_dates})
+    fields = list(dict.fromkeys(FOUR_DIMENSION_FIELDS + list(EMOTION_FIELD_DEFAULTS) + ['pct_chg']))
+
+    frames = []
+    series_list = []
+    stock_rows, origins, ends = [], [], []
+    for stock_code, hist_data in hist_data_by_code.items():
+        if hist_data is None or len(hist_data) == 0:
+            continue
+        df = hist_data.sort_values('trade_date')
+        td_rows = calculate_walk_forward_td(df, evaluation_dates, window_days)
+        if len(td_rows) == 0:
+            continue
 
-        df.iloc[i, df.columns.get_loc('td_risk_level')] = max(min(risk_level, 5), -5)
+        series = {field: pd.to_numeric(df[field], errors='coerce').to_numpy(dtype=float)
+                  for field in fields if field in df.columns}
+        stock_origins, stock_ends = get_evaluation_windows(df['trade_date'].astype(str).to_numpy(),
+                                                           td_rows['eval_date'].to_numpy(), window_days)
+
+        # 均线：窗口内K线数不足时为空值
+        for period in (5, 10, 20, 60):
+            rolling = pd.Series(series['close_qfq']).rolling(window=period).mean().to_numpy()
+            td_rows[f'ma{period}'] = np.where(stock_ends - stock_origins + 1 >= period, rolling[stock_ends], np.nan)
+
+        # ATR用的真实波幅（全区间，窗口第一根K线在下面单独处理）
+        previous_close = np.concatenate([[np.nan], series['close_qfq'][:-1]])
+        series['true_range'] = np.fmax(series['high_qfq'] - series['low_qfq'],
+                                       np.fmax(np.abs(series['high_qfq'] - previous_close),
+                                               np.abs(series['low_qfq'] - previous_close)))
+
+        td_rows.insert(0, 'ts_code', stock_code)
+        frames.append(td_rows)
+        series_list.append(series)
+        stock_rows.extend([len(series_list) - 1] * len(td_rows))
+        origins.extend(stock_origins)
+        ends.extend(stock_ends)
+
+    if not frames:
+        return pd.DataFrame()
 
-    return df
+    snapshots = pd.concat(frames, ignore_index=True)
+    stock_rows, origins, ends = np.asarray(stock_rows), np.asarray(origins), np.asarray(ends)
+    bars = int(max(ends - origins + 1))
+    columns = {name: [] for name in ['atr_value', 'strength_ratio', 'avg_change', 'volatility', 'volume_ratio',
+                                     'volume_surge', 'comprehensive_score', 'structure_type', 'structure_strength',
+                                     'emotion_score', 'emotion_level'] + FOUR_DIMENSION_SCORE_COLUMNS +
+               EMOTION_INDICATOR_COLUMNS}
+
+    for start in range(0, len(snapshots), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        chunk_args = (series_list, stock_rows[chunk], origins[chunk], ends[chunk])
+
+        # ATR：窗口第一根K线没有前收盘价，真实波幅取当日振幅；不足14根时按收盘价的2%
+        recent = build_window_panel(*chunk_args, ['true_range', 'high_qfq', 'low_qfq', 'close_qfq'], 14)
+        true_range = recent['true_range']
+        first_bar = ends[chunk] - origins[chunk] + 1 == 14
+        true_range[first_bar, 0] = recent['high_qfq'][first_bar, 0] - recent['low_qfq'][first_bar, 0]
+        atr = np.where(ends[chunk] - origins[chunk] + 1 >= 14, true_range.mean(axis=1), np.nan)
+        columns['atr_value'].append(np.where(np.isnan(atr), recent['close_qfq'][:, -1] * 0.02, atr))
+
+        # 市场强度：窗口内最近20根K线
+        strength = build_window_panel(*chunk_args, ['pct_chg'], 20)
+        pct_chg = strength['pct_chg']
+        with np.errstate(invalid='ignore', divide='ignore'), warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            columns['strength_ratio'].append(np.where(strength['present']['pct_chg'],
+                                                      (pct_chg > 0).sum(axis=1) / strength['lengths'], np.nan))
+            columns['avg_change'].append(np.nanmean(pct_chg, axis=1))
+            columns['volatility'].append(np.nanstd(pct_chg, axis=1, ddof=1))
+
+        # 成交量确认：窗口内最近20根K线，无成交量数据时量比为0
+        volume = build_window_panel(*chunk_args, ['vol', 'pct_chg'], 20)
+        volume_pattern = analyze_volume_pattern_batch(volume['vol'], volume['pct_chg'])
+        columns['volume_ratio'].append(np.where(volume['present']['vol'], volume_pattern['volume_ratio'], 0))
+        columns['volume_surge'].append(volume['present']['vol'] & volume_pattern['volume_surge'])
+
+        # 四维结构和情绪评分
+        panel = build_window_panel(*chunk_args, FOUR_DIMENSION_FIELDS, max(bars, 60))
+        four_dimensional = calculate_four_dimensional_analysis_batch(panel)
+        sufficient = four_dimensional['sufficient']
+        columns['comprehensive_score'].append(np.where(sufficient, four_dimensional['comprehensive_score'], 0))
+        columns['structure_type'].append(np.where(sufficient, four_dimensional['structure_type'], '无法确定'))
+        columns['structure_strength'].append(np.where(sufficient, four_dimensional['structure_strength'], '弱'))
+        for column in FOUR_DIMENSION_SCORE_COLUMNS:
+            columns[column].append(np.where(sufficient, four_dimensional[column], np.nan))
+
+        emotion_panel = build_window_panel(*chunk_args, list(EMOTION_FIELD_DEFAULTS), bars)
+        indicators = build_emotion_indicator_matrix(emotion_panel)
+        emotion = score_emotion_matrix(indicators)
+        for idx, column in enumerate(EMOTION_INDICATOR_COLUMNS):
+            columns[column].append(indicators['matrix'][:, idx])
+        columns['emotion_score'].append(np.where(emotion['sufficient'], emotion['emotion_score'], 50))
+        columns['emotion_level'].append(np.where(emotion['sufficient'], emotion['emotion_level'], '中性'))
+
+    for name, parts in columns.items():
+        snapshots[name] = np.concatenate(parts)
+
+    # 均线排列和TD综合信号等级（与单只股票分析的 generate_enhanced_td_strategy 标准一致）
+    ma5, ma10, ma20 = (snapshots[f'ma{period}'].to_numpy() for period in (5, 10, 20))
+    snapshots['ma_trend'] = np.select([(ma5 > ma10) & (ma10 > ma20), (ma5 < ma10) & (ma10 < ma20)],
+                                      ["多头排列", "空头排列"], "均线粘合")
+    snapshots['td_signal_score'], snapshots['td_signal_grade'] = calculate_td_signal_score_batch(
+        snapshots['td_setup'], snapshots['td_countdown'], snapshots['td_combo'], snapshots['td_perfected'],
+        snapshots['volume_surge'], snapshots['volume_ratio'], snapshots['ma_trend'], snapshots['strength_ratio'])
+    return snapshots
 
 
 def calculate_support_resistance_enhanced(hist_data, periods=20):
@@ -2161,9 +2669,7 @@ def calculate_support_resistance_enhanced(hist_data, periods=20):
 
 def analyze_volume_pattern_enhanced(hist_data):
     """增强版成交量分析"""
-    df = hist_data.copy().sort_values('trade_date')
-    recent = df.tail(20)
-    latest = recent.iloc[-1]
+    df = hist_data.sort_values('trade_date')
 
     volume_col = 'vol'
 
@@ -2176,59 +2682,68 @@ def analyze_volume_pattern_enhanced(hist_data):
             'volume_consistency': 0
         }
 
-    # 基础量比分析
-    avg_volume = recent[volume_col].mean()
-    recent_volume = latest[volume_col]
-    volume_ratio = recent_volume / avg_volume if avg_volume > 0 else 0
+    recent = df.tail(20)
+    vol = recent[volume_col].to_numpy(dtype=float)[np.newaxis, :]
+    pct_chg = recent['pct_chg'].to_numpy(dtype=float)[np.newaxis, :] if 'pct_chg' in recent.columns else None
+
+    result = analyze_volume_pattern_batch(vol, pct_chg)
+
+    return {
+        'volume_trend': result['volume_trend'][0],
+        'volume_ratio': result['volume_ratio'][0],
+        'volume_price_match': result['volume_price_match'][0],
+        'volume_surge': bool(result['volume_surge'][0]),
+        'volume_consistency': int(result['volume_consistency'][0])
+    }
+
+
+def analyze_volume_pattern_batch(vol, pct_chg=None):
+    """
+    批量成交量形态分析：一次向量化计算全部股票
+    vol/pct_chg 为 (股票数 × K线数) 面板，靠右对齐，取最近20根；缺失位置为NaN
+    """
+    vol = np.atleast_2d(np.asarray(vol, dtype=float))[:, -20:]
+    latest_vol = vol[:, -1]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # 基础量比分析
+        valid_count = np.sum(~np.isnan(vol), axis=1)
+        avg_volume = np.where(valid_count > 0, np.nansum(vol, axis=1) / np.maximum(valid_count, 1), np.nan)
+        volume_ratio = np.where(avg_volume > 0, latest_vol / avg_volume, 0.0)
+
+        # 成交量一致性（前5根K线与当前量比同向的数量）
+        prev_ratio = vol[:, -6:-1] / avg_volume[:, np.newaxis]
+        both_high = (prev_ratio > 1.2) & (volume_ratio[:, np.newaxis] > 1.2)
+        both_low = (prev_ratio < 0.8) & (volume_ratio[:, np.newaxis] < 0.8)
+        volume_consistency = np.sum(both_high | both_low, axis=1)
 
     # 成交量趋势
-    volume_trend = "平稳"
-    volume_surge = False
-
-    if volume_ratio > 3.0:
-        volume_trend = "爆量"
-        volume_surge = True
-    elif volume_ratio > 2.0:
-        volume_trend = "巨量"
-        volume_surge = True
-    elif volume_ratio > 1.5:
-        volume_trend = "显著放量"
-    elif volume_ratio > 1.2:
-        volume_trend = "温和放量"
-    elif volume_ratio < 0.5:
-        volume_trend = "极度缩量"
-    elif volume_ratio < 0.8:
-        volume_trend = "缩量"
-
-    # 成交量一致性（连续性）
-    volume_consistency = 0
-    for i in range(1, min(6, len(recent))):
-        prev_ratio = recent.iloc[-i - 1][volume_col] / avg_volume
-        if prev_ratio > 1.2 and volume_ratio > 1.2:
-            volume_consistency += 1
-        elif prev_ratio < 0.8 and volume_ratio < 0.8:
-            volume_consistency += 1
+    volume_trend = np.select(
+        [volume_ratio > 3.0, volume_ratio > 2.0, volume_ratio > 1.5, volume_ratio > 1.2,
+         volume_ratio < 0.5, volume_ratio < 0.8],
+        ["爆量", "巨量", "显著放量", "温和放量", "极度缩量", "缩量"],
+        default="平稳"
+    )
+    volume_surge = volume_ratio > 2.0
 
     # 增强版价量配合分析
-    price_change = latest['pct_chg'] if 'pct_chg' in recent.columns else 0
-    volume_price_match = ""
-
-    if price_change > 5 and volume_ratio > 2.0:
-        volume_price_match = "涨停放量，强烈信号"
-    elif price_change > 3 and volume_ratio > 1.5:
-        volume_price_match = "放量大涨，趋势确认"
-    elif price_change > 0 and volume_ratio > 1.2:
-        volume_price_match = "价涨量增，趋势健康"
-    elif price_change > 0 and volume_ratio < 0.8:
-        volume_price_match = "价涨量缩，缺乏后劲"
-    elif price_change < -5 and volume_ratio > 2.0:
-        volume_price_match = "放量暴跌，恐慌杀跌"
-    elif price_change < -3 and volume_ratio > 1.5:
-        volume_price_match = "放量下跌，压力较大"
-    elif price_change < 0 and volume_ratio < 0.8:
-        volume_price_match = "缩量下跌，可能见底"
+    if pct_chg is None:
+        price_change = np.zeros(len(vol))
     else:
-        volume_price_match = "价量配合正常"
+        price_change = np.atleast_2d(np.asarray(pct_chg, dtype=float))[:, -1]
+
+    volume_price_match = np.select(
+        [(price_change > 5) & (volume_ratio > 2.0),
+         (price_change > 3) & (volume_ratio > 1.5),
+         (price_change > 0) & (volume_ratio > 1.2),
+         (price_change > 0) & (volume_ratio < 0.8),
+         (price_change < -5) & (volume_ratio > 2.0),
+         (price_change < -3) & (volume_ratio > 1.5),
+         (price_change < 0) & (volume_ratio < 0.8)],
+        ["涨停放量，强烈信号", "放量大涨，趋势确认", "价涨量增，趋势健康", "价涨量缩，缺乏后劲",
+         "放量暴跌，恐慌杀跌", "放量下跌，压力较大", "缩量下跌，可能见底"],
+        default="价量配合正常"
+    )
 
     return {
         'volume_trend': volume_trend,
@@ -2242,69 +2757,164 @@ def analyze_volume_pattern_enhanced(hist_data):
 def analyze_pattern_enhanced(hist_data):
     """增强版K线形态分析 - 使用前复权数据"""
     recent = hist_data.tail(10)
-    latest = recent.iloc[-1]
 
     if len(recent) < 3:
         return "数据不足"
 
-    last3 = recent.tail(3)
+    def field(name):
+        return recent[name].to_numpy(dtype=float)[np.newaxis, :]
+
+    pct_chg = field('pct_chg') if 'pct_chg' in hist_data.columns else None
+
+    return analyze_pattern_batch(field('open_qfq'), field('high_qfq'), field('low_qfq'), field('close_qfq'),
+                                 pct_chg, lengths=[len(recent)])[0]
+
+
+def analyze_pattern_batch(open_qfq, high_qfq, low_qfq, close_qfq, pct_chg=None, lengths=None):
+    """
+    批量K线形态分析：一次向量化计算全部股票 - 使用前复权数据
+    输入为 (股票数 × K线数) 面板，靠右对齐，取最近10根；
+    lengths 为每只股票的实际K线数，缺省时按收盘价非NaN的数量计算
+    """
+    def last10(values):
+        return np.atleast_2d(np.asarray(values, dtype=float))[:, -10:]
+
+    open_qfq, high_qfq, low_qfq, close_qfq = map(last10, (open_qfq, high_qfq, low_qfq, close_qfq))
+
+    if lengths is None:
+        lengths = np.sum(~np.isnan(close_qfq), axis=1)
+    lengths = np.minimum(np.asarray(lengths), 10)
+
+    latest_open, latest_high = open_qfq[:, -1], high_qfq[:, -1]
+    latest_low, latest_close = low_qfq[:, -1], close_qfq[:, -1]
 
     # 基础趋势判断 - 使用前复权数据
-    if all(last3.iloc[i]['close_qfq'] > last3.iloc[i - 1]['close_qfq'] for i in range(1, 3)):
-        trend = "连续上涨"
-    elif all(last3.iloc[i]['close_qfq'] < last3.iloc[i - 1]['close_qfq'] for i in range(1, 3)):
-        trend = "连续下跌"
-    else:
-        trend = "震荡整理"
+    c1, c2, c3 = close_qfq[:, -3], close_qfq[:, -2], close_qfq[:, -1]
+    pattern = np.select(
+        [(c2 > c1) & (c3 > c2), (c2 < c1) & (c3 < c2)],
+        ["连续上涨", "连续下跌"],
+        default="震荡整理"
+    ).astype(object)
 
     # K线形态分析 - 使用前复权数据
-    body_ratio = abs(latest['close_qfq'] - latest['open_qfq']) / (latest['high_qfq'] - latest['low_qfq'] + 0.0001)
-    upper_shadow = (latest['high_qfq'] - max(latest['close_qfq'], latest['open_qfq'])) / (
-            latest['high_qfq'] - latest['low_qfq'] + 0.0001)
-    lower_shadow = (min(latest['close_qfq'], latest['open_qfq']) - latest['low_qfq']) / (
-            latest['high_qfq'] - latest['low_qfq'] + 0.0001)
-
-    pattern = trend
+    candle_range = latest_high - latest_low + 0.0001
+    body_ratio = np.abs(latest_close - latest_open) / candle_range
+    upper_shadow = (latest_high - np.maximum(latest_close, latest_open)) / candle_range
+    lower_shadow = (np.minimum(latest_close, latest_open) - latest_low) / candle_range
 
     # 特殊K线形态
-    if body_ratio < 0.1:
-        pattern += "，十字星（变盘信号）"
-    elif upper_shadow > 0.6:
-        pattern += "，长上影线（上方压力大）"
-    elif lower_shadow > 0.6:
-        pattern += "，长下影线（下方支撑强）"
-    elif latest['close_qfq'] > latest['open_qfq'] and body_ratio > 0.7:
-        pattern += "，大阳线（多头强势）"
-    elif latest['close_qfq'] < latest['open_qfq'] and body_ratio > 0.7:
-        pattern += "，大阴线（空头强势）"
+    pattern = pattern + np.select(
+        [body_ratio < 0.1,
+         upper_shadow > 0.6,
+         lower_shadow > 0.6,
+         (latest_close > latest_open) & (body_ratio > 0.7),
+         (latest_close < latest_open) & (body_ratio > 0.7)],
+        ["，十字星（变盘信号）", "，长上影线（上方压力大）", "，长下影线（下方支撑强）",
+         "，大阳线（多头强势）", "，大阴线（空头强势）"],
+        default=""
+    ).astype(object)
 
     # 根据涨幅判断强势
-    if 'pct_chg' in hist_data.columns:
-        pct_chg = latest['pct_chg']
-        if pct_chg > 0:
-            if pct_chg > 7:
-                pattern += "，涨停强势"
-            elif pct_chg > 5:
-                pattern += "，强势上涨"
-            elif pct_chg > 2:
-                pattern += "，温和上涨"
-        elif pct_chg < -7:
-            pattern += "，跌停弱势"
-        elif pct_chg < -5:
-            pattern += "，急跌"
+    if pct_chg is not None:
+        pct_chg = last10(pct_chg)
+        latest_pct = pct_chg[:, -1]
+
+        pattern = pattern + np.select(
+            [latest_pct > 7, latest_pct > 5, latest_pct > 2, latest_pct > 0,
+             latest_pct < -7, latest_pct < -5],
+            ["，涨停强势", "，强势上涨", "，温和上涨", "",
+             "，跌停弱势", "，急跌"],
+            default=""
+        ).astype(object)
 
         # 判断中期趋势强度
-        if len(recent) >= 5:
-            recent_5 = recent.tail(5)
-            up_days = sum(1 for _, row in recent_5.iterrows() if row.get('pct_chg', 0) > 0)
-            total_change = recent_5['pct_chg'].sum()
-
-            if up_days >= 4 and total_change > 5:
-                pattern += "，中期强势"
-            elif up_days <= 1 and total_change < -5:
-                pattern += "，中期弱势"
-
-    return pattern
+        recent_5 = pct_chg[:, -5:]
+        up_days = np.sum(recent_5 > 0, axis=1)
+        total_change = np.nansum(recent_5, axis=1)
+        has_5 = lengths >= 5
+
+        pattern = pattern + np.select(
+            [has_5 & (up_days >= 4) & (total_change > 5),
+             has_5 & (up_days <= 1) & (total_change < -5)],
+            ["，中期强势", "，中期弱势"],
+            default=""
+        ).astype(object)
+
+    return np.where(lengths < 3, "数据不足", pattern).tolist()
+
+
+# 信号等级判定（大幅优化标准）：(最低信号分, 等级)，低于最后一档为 C级（弱）
+TD_SIGNAL_GRADES = ((70, "S级（极强）"), (50, "A级（强）"), (25, "B级（中等）"), (10, "C+级（偏弱）"))
+
+# 各信号等级的信心度曲线 (基础值, 系数, 上限)，依次对应 S/A/B/C+ 级和 C级
+TD_CONFIDENCE_CURVES = ((80, 0.15, 95), (65, 0.25, 85), (45, 0.4, 70), (35, 0.6, 55), (25, 0.8, 45))
+
+# TD综合信号评分权重；*_tiers 为 (阈值, 分值) 档位，从高到低取第一个满足的档位
+TD_SIGNAL_WEIGHTS = {
+    'setup_9': 35,  # Setup恰好为9
+    'setup_tiers': ((7, 20), (4, 12), (1, 5)),  # |Setup| ≥ 阈值
+    'countdown_tiers': ((13, 45), (10, 30), (7, 20), (3, 10)),  # |Countdown| ≥ 阈值
+    'combo_tiers': ((10, 18), (5, 8)),  # |Combo| ≥ 阈值
+    'perfected': 20,
+    'volume_surge': 18,
+    'volume_tiers': ((1.5, 12), (1.2, 8)),  # 量比 > 阈值
+    'volume_shrink': (0.8, -3),  # 量比 < 阈值
+    'ma_bull': 12,
+    'ma_bear': -8,
+    'market_strong': (0.65, 8),  # 上涨天数占比 > 阈值
+    'market_weak': (0.35, -8)  # 上涨天数占比 < 阈值
+}
+# 排序用的 td_score 不计缩量和市场强度
+TD_SCORE_WEIGHTS = dict(TD_SIGNAL_WEIGHTS, volume_shrink=(0.8, 0), market_strong=(0.65, 0), market_weak=(0.35, 0))
+
+
+def calculate_td_signal_score_batch(td_setup, td_countdown, td_combo, td_perfected, volume_surge, volume_ratio,
+                                    ma_trend, strength_ratio, weights=None, grades=None):
+    """
+    批量计算TD综合信号分和信号等级，参数均为等长数组（或标量）
+    评分项：Setup/Countdown/Combo进度、完美设置、成交量确认、均线排列和市场强度，
+    权重默认 TD_SIGNAL_WEIGHTS，等级默认 TD_SIGNAL_GRADES；返回 (信号分数组, 等级数组)
+    """
+    weights = TD_SIGNAL_WEIGHTS if weights is None else weights
+    grades = TD_SIGNAL_GRADES if grades is None else grades
+    setup = np.abs(np.atleast_1d(np.asarray(td_setup, dtype=float)))
+    countdown = np.abs(np.atleast_1d(np.asarray(td_countdown, dtype=float)))
+    combo = np.abs(np.atleast_1d(np.asarray(td_combo, dtype=float)))
+    volume_ratio = np.atleast_1d(np.asarray(volume_ratio, dtype=float))
+    ma_trend = np.atleast_1d(np.asarray(ma_trend, dtype=object))
+    strength_ratio = np.atleast_1d(np.asarray(strength_ratio, dtype=float))
+
+    def tier_points(values, tiers, above=True):
+        conditions = [values >= threshold if above else values > threshold for threshold, _ in tiers]
+        return np.select(conditions, [points for _, points in tiers], 0)
+
+    with np.errstate(invalid='ignore'):
+        score = np.where(setup == 9, weights['setup_9'], tier_points(setup, weights['setup_tiers']))
+        score = score + tier_points(countdown, weights['countdown_tiers'])
+        score = score + tier_points(combo, weights['combo_tiers'])
+        score = score + np.where(np.atleast_1d(np.asarray(td_perfected, dtype=bool)), weights['perfected'], 0)
+        shrink_threshold, shrink_points = weights['volume_shrink']
+        score = score + np.where(np.atleast_1d(np.asarray(volume_surge, dtype=bool)), weights['volume_surge'],
+                                 np.where(volume_ratio < shrink_threshold, shrink_points,
+                                          tier_points(volume_ratio, weights['volume_tiers'], above=False)))
+        score = score + np.select([ma_trend == "多头排列", ma_trend == "空头排列"],
+                                  [weights['ma_bull'], weights['ma_bear']], 0)
+        (strong_threshold, strong_points), (weak_threshold, weak_points) = weights['market_strong'], weights['market_weak']
+        score = score + np.select([strength_ratio > strong_threshold, strength_ratio < weak_threshold],
+                                  [strong_points, weak_points], 0)
+
+    grade_labels = np.select([score >= threshold for threshold, _ in grades],
+                             [grade for _, grade in grades], "C级（弱）")
+    return score, grade_labels
+
+
+def calculate_td_confidence_batch(signal_score, grades=None):
+    """按信号等级分档计算信心度：min(基础值 + 信号分 × 系数, 上限)，分档门槛与信号等级一致"""
+    grades = TD_SIGNAL_GRADES if grades is None else grades
+    signal_score = np.atleast_1d(np.asarray(signal_score, dtype=float))
+    tier = np.select([signal_score >= threshold for threshold, _ in grades], np.arange(len(grades)), len(grades))
+    base, slope, cap = (np.array(values)[tier] for values in zip(*TD_CONFIDENCE_CURVES))
+    return np.minimum(base + signal_score * slope, cap)
 
 
 def generate_enhanced_td_strategy(latest_data, sr_levels, td_setup, td_countdown,
@@ -2330,96 +2940,12 @@ def generate_enhanced_td_strategy(latest_data, sr_levels, td_setup, td_countdown
     atr_stop_distance = atr_value * 2.5 if atr_value > 0 else price * 0.05
 
     # 综合信号强度评估（优化后标准）
-    signal_score = 0
-    confidence_factors = []
-
-    # TD Setup评分（降低门槛）
-    if abs(td_setup) == 9:
-        signal_score += 35
-        confidence_factors.append("Setup 9完成")
-    elif abs(td_setup) >= 7:
-        signal_score += 20
-        confidence_factors.append(f"Setup {abs(td_setup)}接近完成")
-    elif abs(td_setup) >= 4:
-        signal_score += 12  # 提高中期Setup权重
-        confidence_factors.append(f"Setup {abs(td_setup)}进行中")
-    elif abs(td_setup) >= 1:
-        signal_score += 5
-        confidence_factors.append(f"Setup {abs(td_setup)}初期")
-
-    # TD Countdown评分
-    if abs(td_countdown) == 13:
-        signal_score += 45
-        confidence_factors.append("Countdown 13完成")
-    elif abs(td_countdown) >= 10:
-        signal_score += 30
-        confidence_factors.append(f"Countdown {abs(td_countdown)}接近完成")
-    elif abs(td_countdown) >= 7:
-        signal_score += 20
-        confidence_factors.append(f"Countdown {abs(td_countdown)}中后期")
-    elif abs(td_countdown) >= 3:
-        signal_score += 10
-        confidence_factors.append(f"Countdown {abs(td_countdown)}进行中")
-
-    # TD Combo评分
-    if abs(td_combo) >= 10:
-        signal_score += 18
-        confidence_factors.append(f"Combo {abs(td_combo)}高级别")
-    elif abs(td_combo) >= 5:
-        signal_score += 8
-        confidence_factors.append(f"Combo {abs(td_combo)}中级别")
-
-    # 完美设置加分
-    if td_perfected:
-        signal_score += 20
-        confidence_factors.append("完美设置确认")
-
-    # 成交量确认（提高权重）
-    if volume_analysis['volume_surge']:
-        signal_score += 18
-        confidence_factors.append("爆量确认")
-    elif volume_analysis['volume_ratio'] > 1.5:
-        signal_score += 12
-        confidence_factors.append("显著放量")
-    elif volume_analysis['volume_ratio'] > 1.2:
-        signal_score += 8
-        confidence_factors.append("温和放量")
-    elif volume_analysis['volume_ratio'] < 0.8:
-        signal_score -= 3
-        confidence_factors.append("量能不足")
-
-    # 均线位置加分
-    if ma_trend == "多头排列":
-        signal_score += 12
-        confidence_factors.append("均线多头")
-    elif ma_trend == "空头排列":
-        signal_score -= 8
-        confidence_factors.append("均线空头")
-
-    # 市场强度调整
-    if market_strength['strength_ratio'] > 0.65:
-        signal_score += 8
-        confidence_factors.append("市场强势")
-    elif market_strength['strength_ratio'] < 0.35:
-        signal_score -= 8
-        confidence_factors.append("市场弱势")
-
-    # 信号等级判定（大幅优化标准）
-    if signal_score >= 70:
-        strategy['signal_strength'] = "S级（极强）"
-        strategy['confidence'] = min(80 + signal_score * 0.15, 95)
-    elif signal_score >= 50:  # 降低门槛
-        strategy['signal_strength'] = "A级（强）"
-        strategy['confidence'] = min(65 + signal_score * 0.25, 85)
-    elif signal_score >= 25:  # 大幅降低门槛
-        strategy['signal_strength'] = "B级（中等）"
-        strategy['confidence'] = min(45 + signal_score * 0.4, 70)
-    elif signal_score >= 10:  # 降低门槛
-        strategy['signal_strength'] = "C+级（偏弱）"
-        strategy['confidence'] = min(35 + signal_score * 0.6, 55)
-    else:
-        strategy['signal_strength'] = "C级（弱）"
-        strategy['confidence'] = min(25 + signal_score * 0.8, 45)
+    signal_scores, signal_grades = calculate_td_signal_score_batch(
+        td_setup, td_countdown, td_combo, td_perfected, volume_analysis['volume_surge'],
+        volume_analysis['volume_ratio'], ma_trend, market_strength['strength_ratio'])
+    signal_score = int(signal_scores[0])
+    strategy['signal_strength'] = str(signal_grades[0])
+    strategy['confidence'] = float(calculate_td_confidence_batch(signal_scores)[0])
 
     # 交易方向判断（更灵活的标准）
     is_bullish_signal = (td_setup > 0 and td_setup >= 3) or (td_countdown > 0 and abs(td_countdown) >= 3)
@@ -2591,15 +3117,104 @@ def generate_enhanced_td_strategy(latest_data, sr_levels, td_setup, td_countdown
     return strategy
 
 
+def add_moving_averages(hist_data):
+    """计算均线（使用前复权数据）"""
+    hist_data['ma5'] = hist_data['close_qfq'].rolling(window=5).mean()
+    hist_data['ma10'] = hist_data['close_qfq'].rolling(window=10).mean()
+    hist_data['ma20'] = hist_data['close_qfq'].rolling(window=20).mean()
+    hist_data['ma60'] = hist_data['close_qfq'].rolling(window=60).mean()
+    return hist_data
+
+
+# 多日期批量分析共享的个股历史数据缓存：每只股票只获取一次覆盖整个区间的数据，各交易日按需切片
+_history_cache = {}
+_history_cache_window = None
+_history_cache_lock = threading.Lock()
+# 缓存只保留分析、前瞻收益和绘图用到的列（前复权K线、涨跌幅、成交量和情绪指标），其余接口字段不常驻内存
+HISTORY_CACHE_COLUMNS = list(dict.fromkeys(['trade_date', 'open_qfq', 'high_qfq', 'low_qfq', 'close_qfq', 'pct_chg',
+                                            'vol', *EMOTION_FIELD_DEFAULTS]))
+
+
+def enable_history_cache(start_date, end_date):
+    """开启个股历史数据缓存，覆盖 [start_date前180天, end_date后120天]，之后的部分用于60日前瞻收益"""
+    global _history_cache_window
+    with _history_cache_lock:
+        _history_cache.clear()
+        _history_cache_window = ((pd.to_datetime(start_date) - timedelta(days=180)).strftime('%Y%m%d'),
+                                 (pd.to_datetime(end_date) + timedelta(days=120)).strftime('%Y%m%d'))
+
+
+def disable_history_cache():
+    """关闭并清空个股历史数据缓存"""
+    global _history_cache_window
+    with _history_cache_lock:
+        _history_cache.clear()
+        _history_cache_window = None
+
+
+def get_cached_stock_history(stock_code, start_date, end_date):
+    """从历史数据缓存中取出 [start_date, end_date] 区间；缓存未开启或不覆盖该区间时返回None"""
+    window = _history_cache_window
+    if window is None or start_date < window[0] or end_date > window[1]:
+        return None
+
+    with _history_cache_lock:
+        # 按访问顺序排列，内存紧张时从最久未使用的股票开始淘汰
+        entry = _history_cache.pop(stock_code, None) or {'lock': threading.Lock(), 'data': None}
+        _history_cache[stock_code] = entry
+    with entry['lock']:
+        cached = entry['data']
+        if cached is None:
+            cached = get_enhanced_stock_data_with_emotion(stock_code, window[0], window[1])
+            if len(cached) > 0:  # 获取失败不缓存，下一个交易日重试
+                cached = cached[[column for column in HISTORY_CACHE_COLUMNS if column in cached.columns]].copy()
+                entry['data'] = cached
+
+    if len(cached) == 0:
+        return cached.copy()
+    in_range = (cached['trade_date'] >= start_date) & (cached['trade_date'] <= end_date)
+    return cached[in_range].reset_index(drop=True)
+
+
+def fetch_td_analysis_data(stock_code, target_date):
+    """获取TD分析所需的前复权历史数据（目标日期前180天，包含情绪指标）"""
+    end_date = target_date
+    start_date = (pd.to_datetime(target_date) - timedelta(days=180)).strftime('%Y%m%d')
+
+    cached = get_cached_stock_history(stock_code, start_date, end_date)
+    if cached is None:
+        return get_enhanced_stock_data_with_emotion(stock_code, start_date, end_date)
+    return cached
+
+
 def perform_td_analysis_enhanced(stock_code, stock_name, target_date):
     """增强版TD技术分析（使用新接口和前复权数据）- 并行优化版本"""
     try:
-        end_date = target_date
-        start_date = (pd.to_datetime(target_date) - timedelta(days=180)).strftime('%Y%m%d')
-
         # 使用增强版接口获取前复权数据（包含情绪指标）
-        hist_data = get_enhanced_stock_data_with_emotion(stock_code, start_date, end_date)
+        hist_data = fetch_td_analysis_data(stock_code, target_date)
+
+        # 【新增】计算目标日期之后60个交易日内的最大盈利
+        max_profit_result = None
+        if len(hist_data) >= 30:
+            max_profit_result = calculate_max_profit_after_target_date(stock_code, target_date)
+
+        return AnalysisRecord.from_analysis(
+            compute_td_analysis(stock_code, stock_name, hist_data, max_profit_result), target_date)
+
+    except Exception as e:
+        return {
+            'code': stock_code,
+            'name': stock_name,
+            'analysis': f"TD分析过程出错: {str(e)}"
+        }
+
 
+def compute_td_analysis(stock_code, stock_name, hist_data, max_profit_result):
+    """
+    TD技术分析计算部分（不访问网络）- 使用前复权数据
+    hist_data 与 max_profit_result 由调用方提前获取，可在线程或进程中独立运行
+    """
+    try:
         if len(hist_data) == 0:
             return {
                 'code': stock_code,
@@ -2614,13 +3229,7 @@ def perform_td_analysis_enhanced(stock_code, stock_name, target_date):
                 'analysis': "历史数据不足，无法进行完整分析"
             }
 
-        hist_data = hist_data.sort_values('trade_date')
-
-        # 计算均线（使用前复权数据）
-        hist_data['ma5'] = hist_data['close_qfq'].rolling(window=5).mean()
-        hist_data['ma10'] = hist_data['close_qfq'].rolling(window=10).mean()
-        hist_data['ma20'] = hist_data['close_qfq'].rolling(window=20).mean()
-        hist_data['ma60'] = hist_data['close_qfq'].rolling(window=60).mean()
+        hist_data = add_moving_averages(hist_data.sort_values('trade_date'))
 
         # 计算ATR
         atr_value = calculate_atr(hist_data)
@@ -2646,9 +3255,6 @@ def perform_td_analysis_enhanced(stock_code, stock_name, target_date):
         # 【新增】专业情绪分析
         emotion_analysis = calculate_emotion_analysis(hist_data)
 
-        # 【新增】计算目标日期之后60个交易日内的最大盈利
-        max_profit_result = calculate_max_profit_after_target_date(stock_code, target_date)
-
         # 获取最新数据
         latest = hist_data.iloc[-1]
 
@@ -2713,44 +3319,11 @@ def perform_td_analysis_enhanced(stock_code, stock_name, target_date):
         )
 
         # 计算信号评分（用于排序）
-        signal_score = 0
-        if abs(td_setup_current) == 9:
-            signal_score += 35
-        elif abs(td_setup_current) >= 7:
-            signal_score += 20
-        elif abs(td_setup_current) >= 4:
-            signal_score += 12
-        elif abs(td_setup_current) >= 1:
-            signal_score += 5
-
-        if abs(td_countdown_current) == 13:
-            signal_score += 45
-        elif abs(td_countdown_current) >= 10:
-            signal_score += 30
-        elif abs(td_countdown_current) >= 7:
-            signal_score += 20
-        elif abs(td_countdown_current) >= 3:
-            signal_score += 10
-
-        if abs(td_combo_current) >= 10:
-            signal_score += 18
-        elif abs(td_combo_current) >= 5:
-            signal_score += 8
-
-        if td_perfected_current:
-            signal_score += 20
-
-        if volume_analysis['volume_surge']:
-            signal_score += 18
-        elif volume_analysis['volume_ratio'] > 1.5:
-            signal_score += 12
-        elif volume_analysis['volume_ratio'] > 1.2:
-            signal_score += 8
-
-        if ma_trend == "多头排列":
-            signal_score += 12
-        elif ma_trend == "空头排列":
-            signal_score -= 8
+        signal_scores, _ = calculate_td_signal_score_batch(
+            td_setup_current, td_countdown_current, td_combo_current, td_perfected_current,
+            volume_analysis['volume_surge'], volume_analysis['volume_ratio'], ma_trend,
+            market_strength['strength_ratio'], weights=TD_SCORE_WEIGHTS)
+        signal_score = int(signal_scores[0])
 
         # 生成综合分析
         analysis = {
@@ -2803,9 +3376,108 @@ def perform_td_analysis_enhanced(stock_code, stock_name, target_date):
         }
 
 
-def draw_td_chart(hist_data, td_data, analysis, save_path=None):
+# 图表显示的交易日数量，以及图表数据包中保留的K线列和分析字段
+CHART_DISPLAY_BARS = 60
+CHART_PAYLOAD_COLUMNS = ['trade_date', 'open_qfq', 'high_qfq', 'low_qfq', 'close_qfq', 'ma5', 'ma10', 'ma20', 'vol',
+                         'td_setup', 'td_countdown', 'td_perfected', 'tdst_support', 'tdst_resistance']
+CHART_PAYLOAD_FIELDS = ('name', 'code', 'current_price', 'td_setup', 'td_countdown', 'td_signal_grade',
+                        'support_levels', 'resistance_levels', 'td_phase', 'td_risk_level', 'td_score',
+                        'reversal_probability')
+# 图表渲染进程数（None 表示使用全部CPU核心）
+CHART_RENDER_WORKERS = None
+# 图表缓存目录：图表按数据包内容哈希命名，各次运行和各交易日共用；修改绘图代码时需递增渲染器版本
+CHART_CACHE_DIR = 'td_chart_cache'
+CHART_RENDERER_VERSION = 2
+# 图表输出配置：分辨率、格式、是否裁剪白边（bbox_inches='tight' 需额外绘制一遍）以及图像编码参数
+CHART_RENDER_PROFILES = {
+    'thumbnail': {'dpi': 40, 'format': 'png', 'tight': False},
+    'report': {'dpi': 100, 'format': 'png', 'tight': False},
+    'compact': {'dpi': 100, 'format': 'webp', 'tight': False, 'pil_kwargs': {'quality': 80}},
+    'full': {'dpi': 300, 'format': 'png', 'tight': True},
+    'vector': {'format': 'svg', 'tight': True},
+}
+# 每次运行生成的图表档位，报告内嵌 CHART_REPORT_PROFILE 档位的图表；
+# 同时生成 'full' 或 'vector' 档位时，点击报告中的图表可打开大图
+CHART_OUTPUT_PROFILES = ('report',)
+CHART_REPORT_PROFILE = 'report'
+CHART_ZOOM_PROFILES = ('vector', 'full')
+# 图表模式：'image' 由 matplotlib 渲染图片；'interactive' 在报告中内嵌图表数据，
+# 展开详情时由浏览器用 plotly.js 绘制，服务端几乎没有绘图开销，报告中的全部股票都附带图表
+CHART_MODE = 'image'
+# 与 requirements 中 plotly 5.17 对应的 plotly.js 版本，首次展开交互式图表时才加载
+PLOTLY_JS_URL = 'https://cdn.plot.ly/plotly-2.26.0.min.js'
+
+
+def bar_polygons(x, bottom, top, width):
+    """以 x 为中心、宽 width 的矩形顶点数组 (N, 4, 2)，用于 PolyCollection 一次绘制全部K线实体或成交量柱"""
+    left, right = x - width / 2, x + width / 2
+    return np.stack([np.column_stack([left, bottom]), np.column_stack([right, bottom]),
+                     np.column_stack([right, top]), np.column_stack([left, top])], axis=1)
+
+
+@lru_cache(maxsize=256)
+def get_text_marker(text, fontsize, box_pad=None):
+    """
+    将文字（可带圆角底框）转换为以中心为原点的标记路径，返回 (文字标记, 文字s, 底框标记, 底框s)
+    scatter 会把标记缩放到 sqrt(s) 磅，这里按字号换算 s，使文字大小与 fontsize 一致；
+    曲线预先展平为多边形，避免绘制时反复计算贝塞尔曲线的范围
+    """
+    font = fm.FontProperties(weight='bold')
+    path = TextPath((0, 0), text, size=fontsize, prop=font)
+    extents = path.get_extents()
+    center = Affine2D().translate(-(extents.x0 + extents.x1) / 2, -(extents.y0 + extents.y1) / 2)
+    path = Path.make_compound_path(*map(Path, path.transformed(center).to_polygons()))
+    text_size = (2 * np.abs(path.vertices).max()) ** 2
+
+    box, box_size = None, None
+    if box_pad is not None:
+        # 底框高度按行高（约1.15倍字号）计算，与 annotate 的 bbox 一致
+        line_height = max(extents.height, fontsize * 1.15)
+        box = BoxStyle('Round', pad=box_pad)(-extents.width / 2, -line_height / 2, extents.width, line_height,
+                                             fontsize)
+        box = Path(box.to_polygons()[0])
+        box_size = (2 * np.abs(box.vertices).max()) ** 2
+    return path, text_size, box, box_size
+
+
+def draw_text_markers(ax, x, y, labels, fontsize, color, offset=0, va='center', box_color=None, box_alpha=1.0):
+    """
+    批量绘制数据点旁的文字标签：相同文字合并为一次 scatter，offset 为纵向偏移（磅），
+    va='bottom' 时标签位于偏移位置上方；box_color 给出时在文字下方绘制圆角底框；
+    与 annotate 一样不按坐标区裁剪，靠近边缘的标签（如最高成交量柱上的"放量"）完整显示
+    """
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    labels = np.asarray(labels)
+    for text in np.unique(labels):
+        marker, text_size, box, box_size = get_text_marker(str(text), fontsize,
+                                                           0.3 if box_color is not None else None)
+        shift = offset + (np.sqrt(text_size) / 2 if va == 'bottom' else 0)
+        transform = offset_copy(ax.transData, fig=ax.figure, x=0, y=shift, units='points')
+        selected = labels == text
+        if box is not None:
+            ax.scatter(x[selected], y[selected], s=box_size, marker=box, c=box_color, alpha=box_alpha,
+                       linewidths=0, transform=transform, clip_on=False)
+        ax.scatter(x[selected], y[selected], s=text_size, marker=marker, c=color, linewidths=0,
+                   transform=transform, clip_on=False)
+
+
+def save_chart_figure(fig, path, profile_name):
+    """按 CHART_RENDER_PROFILES 中的配置保存图表"""
+    profile = CHART_RENDER_PROFILES[profile_name]
+    options = {'format': profile['format'], 'facecolor': 'white'}
+    if 'dpi' in profile:
+        options['dpi'] = profile['dpi']
+    if profile.get('tight'):
+        options['bbox_inches'] = 'tight'
+    if profile.get('pil_kwargs'):
+        options['pil_kwargs'] = profile['pil_kwargs']
+    fig.savefig(path, **options)
+
+
+def draw_td_chart(hist_data, td_data, analysis, save_path=None, outputs=None):
     """
     绘制TD技术分析图表（使用前复权数据）
+    save_path 按 'full' 档位保存；outputs 为 [(保存路径, 档位名)]，图表只绘制一次，按各档位分别保存
     """
     try:
         # 确保使用非交互式后端
@@ -2817,7 +3489,7 @@ def draw_td_chart(hist_data, td_data, analysis, save_path=None):
         df['trade_date'] = pd.to_datetime(df['trade_date'])
 
         # 只显示最近60个交易日
-        df = df.tail(60)
+        df = df.tail(CHART_DISPLAY_BARS)
 
         if len(df) < 10:
             print(f"数据不足，无法绘制图表")
@@ -2834,35 +3506,23 @@ def draw_td_chart(hist_data, td_data, analysis, save_path=None):
             f'价格: ¥{analysis["current_price"]:.2f}(前复权) | TD Setup: {analysis["td_setup"]} | TD Countdown: {analysis["td_countdown"]} | 信号: {analysis["td_signal_grade"]}',
             fontsize=12, pad=20)
 
-        # 绘制K线（使用前复权数据）
-        for i in range(len(df)):
-            row = df.iloc[i]
-            date = row['trade_date']
-            open_price = row['open_qfq']
-            high_price = row['high_qfq']
-            low_price = row['low_qfq']
-            close_price = row['close_qfq']
-
-            # K线颜色
-            color = 'red' if close_price >= open_price else 'green'
-
-            # 绘制上下影线
-            ax1.plot([date, date], [low_price, high_price], color='black', linewidth=1)
-
-            # 绘制实体
-            body_height = abs(close_price - open_price)
-            body_bottom = min(open_price, close_price)
-
-            if close_price >= open_price:
-                # 阳线
-                rect = Rectangle((mdates.date2num(date) - 0.3, body_bottom), 0.6, body_height,
-                                 facecolor='red', edgecolor='black', linewidth=0.5)
-            else:
-                # 阴线
-                rect = Rectangle((mdates.date2num(date) - 0.3, body_bottom), 0.6, body_height,
-                                 facecolor='green', edgecolor='black', linewidth=0.5)
-
-            ax1.add_patch(rect)
+        # 绘制K线（使用前复权数据）：影线为一个 LineCollection，实体为一个 PolyCollection
+        ax1.xaxis_date()
+        x = mdates.date2num(df['trade_date'])
+        open_price = df['open_qfq'].to_numpy(dtype=float)
+        high_price = df['high_qfq'].to_numpy(dtype=float)
+        low_price = df['low_qfq'].to_numpy(dtype=float)
+        close_price = df['close_qfq'].to_numpy(dtype=float)
+        rising = close_price >= open_price
+        candle_colors = np.where(rising, 'red', 'green')
+
+        ax1.add_collection(LineCollection(np.stack([np.column_stack([x, low_price]),
+                                                    np.column_stack([x, high_price])], axis=1),
+                                          colors='black', linewidths=1))
+        ax1.add_collection(PolyCollection(bar_polygons(x, np.minimum(open_price, close_price),
+                                                       np.maximum(open_price, close_price), 0.6),
+                                          facecolors=candle_colors, edgecolors='black', linewidths=0.5))
+        ax1.autoscale_view()
 
         # 绘制均线（使用前复权数据）
         if 'ma5' in df.columns:
@@ -2872,74 +3532,44 @@ def draw_td_chart(hist_data, td_data, analysis, save_path=None):
         if 'ma20' in df.columns:
             ax1.plot(df['trade_date'], df['ma20'], label='MA20', color='blue', linewidth=2, alpha=0.8)
 
-        # 标注TD Setup序号
-        for i in range(len(df)):
-            row = df.iloc[i]
-            setup_value = row['td_setup']
-
-            if setup_value != 0:
-                date = row['trade_date']
-                high_price = row['high_qfq']
-                low_price = row['low_qfq']
-
-                # 确定标注位置
-                if setup_value > 0:  # 买入Setup
-                    y_pos = low_price * 0.995
-                    color = 'blue'
-                    marker = 'o'
-                else:  # 卖出Setup
-                    y_pos = high_price * 1.005
-                    color = 'red'
-                    marker = 'v'
-
-                # 绘制Setup序号
-                ax1.scatter(date, y_pos, c=color, s=100, marker=marker, alpha=0.8, edgecolors='white', linewidths=1)
-                ax1.annotate(f'{abs(setup_value)}', (date, y_pos),
-                             textcoords="offset points", xytext=(0, -15 if setup_value > 0 else 15),
-                             ha='center', va='center', fontsize=8, fontweight='bold', color='white',
-                             bbox=dict(boxstyle="round,pad=0.3", facecolor=color, alpha=0.8))
-
-                # Setup 9特殊标记
-                if abs(setup_value) == 9:
-                    ax1.annotate('Setup 9!', (date, y_pos),
-                                 textcoords="offset points", xytext=(20, -30 if setup_value > 0 else 30),
-                                 ha='center', va='center', fontsize=10, fontweight='bold', color=color,
-                                 bbox=dict(boxstyle="round,pad=0.5", facecolor='yellow', alpha=0.8),
-                                 arrowprops=dict(arrowstyle='->', color=color, lw=1.5))
+        # 标注TD Setup序号：买入/卖出各一次 scatter，序号标签按文字分组批量绘制
+        setup = df['td_setup'].to_numpy()
+        for side, color, marker in ((setup > 0, 'blue', 'o'), (setup < 0, 'red', 'v')):
+            if not side.any():
+                continue
+            buy = color == 'blue'
+            y_pos = low_price[side] * 0.995 if buy else high_price[side] * 1.005
+            labels = [f'{abs(value)}' for value in setup[side]]
+            ax1.scatter(x[side], y_pos, c=color, s=100, marker=marker, alpha=0.8, edgecolors='white', linewidths=1)
+            draw_text_markers(ax1, x[side], y_pos, labels, fontsize=8, color='white', offset=-15 if buy else 15,
+                              box_color=color, box_alpha=0.8)
+
+            # Setup 9特殊标记
+            for date, y in zip(x[side][np.abs(setup[side]) == 9], y_pos[np.abs(setup[side]) == 9]):
+                ax1.annotate('Setup 9!', (date, y),
+                             textcoords="offset points", xytext=(20, -30 if buy else 30),
+                             ha='center', va='center', fontsize=10, fontweight='bold', color=color,
+                             bbox=dict(boxstyle="round,pad=0.5", facecolor='yellow', alpha=0.8),
+                             arrowprops=dict(arrowstyle='->', color=color, lw=1.5))
 
         # 标注TD Countdown序号
-        for i in range(len(df)):
-            row = df.iloc[i]
-            countdown_value = row['td_countdown']
-
-            if countdown_value != 0:
-                date = row['trade_date']
-                high_price = row['high_qfq']
-                low_price = row['low_qfq']
-
-                # 确定标注位置
-                if countdown_value > 0:  # 买入Countdown
-                    y_pos = low_price * 0.99
-                    color = 'darkblue'
-                    marker = 's'
-                else:  # 卖出Countdown
-                    y_pos = high_price * 1.01
-                    color = 'darkred'
-                    marker = 's'
-
-                # 绘制Countdown序号
-                ax1.scatter(date, y_pos, c=color, s=120, marker=marker, alpha=0.9, edgecolors='white', linewidths=2)
-                ax1.annotate(f'C{abs(countdown_value)}', (date, y_pos),
-                             textcoords="offset points", xytext=(0, 0),
-                             ha='center', va='center', fontsize=7, fontweight='bold', color='white')
-
-                # Countdown 13特殊标记
-                if abs(countdown_value) == 13:
-                    ax1.annotate('Countdown 13!', (date, y_pos),
-                                 textcoords="offset points", xytext=(-30, -40 if countdown_value > 0 else 40),
-                                 ha='center', va='center', fontsize=11, fontweight='bold', color=color,
-                                 bbox=dict(boxstyle="round,pad=0.5", facecolor='gold', alpha=0.9),
-                                 arrowprops=dict(arrowstyle='->', color=color, lw=2))
+        countdown = df['td_countdown'].to_numpy()
+        for side, color in ((countdown > 0, 'darkblue'), (countdown < 0, 'darkred')):
+            if not side.any():
+                continue
+            buy = color == 'darkblue'
+            y_pos = low_price[side] * 0.99 if buy else high_price[side] * 1.01
+            labels = [f'C{abs(value)}' for value in countdown[side]]
+            ax1.scatter(x[side], y_pos, c=color, s=120, marker='s', alpha=0.9, edgecolors='white', linewidths=2)
+            draw_text_markers(ax1, x[side], y_pos, labels, fontsize=7, color='white')
+
+            # Countdown 13特殊标记
+            for date, y in zip(x[side][np.abs(countdown[side]) == 13], y_pos[np.abs(countdown[side]) == 13]):
+                ax1.annotate('Countdown 13!', (date, y),
+                             textcoords="offset points", xytext=(-30, -40 if buy else 40),
+                             ha='center', va='center', fontsize=11, fontweight='bold', color=color,
+                             bbox=dict(boxstyle="round,pad=0.5", facecolor='gold', alpha=0.9),
+                             arrowprops=dict(arrowstyle='->', color=color, lw=2))
 
         # 标注完美设置
         for i in range(len(df)):
@@ -2976,18 +3606,20 @@ def draw_td_chart(hist_data, td_data, analysis, save_path=None):
         ax1.xaxis.set_major_formatter(mdates.DateFormatter('%m-%d'))
         ax1.xaxis.set_major_locator(mdates.DayLocator(interval=5))
 
-        # 成交量图
-        ax2.bar(df['trade_date'], df['vol'] / 10000, width=0.8,
-                color=['red' if c >= o else 'green' for c, o in zip(df['close_qfq'], df['open_qfq'])],
-                alpha=0.6, label='成交量(万手)')
-
-        # 标注放量点
-        volume_avg = df['vol'].rolling(window=10).mean()
-        for i in range(len(df)):
-            if df.iloc[i]['vol'] > volume_avg.iloc[i] * 2:  # 放量2倍以上
-                ax2.annotate('放量', (df.iloc[i]['trade_date'], df.iloc[i]['vol'] / 10000),
-                             textcoords="offset points", xytext=(0, 10),
-                             ha='center', va='bottom', fontsize=8, color='red', fontweight='bold')
+        # 成交量图（一个 PolyCollection，纵轴从0开始）
+        ax2.xaxis_date()
+        volume = df['vol'].to_numpy(dtype=float) / 10000
+        ax2.add_collection(PolyCollection(bar_polygons(x, np.zeros_like(volume), volume, 0.8),
+                                          facecolors=candle_colors, alpha=0.6, label='成交量(万手)'))
+        ax2.autoscale_view()
+        ax2.set_ylim(bottom=0)
+
+        # 标注放量点（放量2倍以上）
+        volume_avg = df['vol'].rolling(window=10).mean().to_numpy()
+        surge = df['vol'].to_numpy() > volume_avg * 2
+        if surge.any():
+            draw_text_markers(ax2, x[surge], volume[surge], ['放量'] * int(surge.sum()), fontsize=8, color='red',
+                              offset=10, va='bottom')
 
         ax2.set_ylabel('成交量 (万手)', fontsize=12)
         ax2.set_xlabel('日期', fontsize=12)
@@ -3013,13 +3645,15 @@ def draw_td_chart(hist_data, td_data, analysis, save_path=None):
 
         # 保存图表
         if save_path:
-            plt.savefig(save_path, dpi=300, bbox_inches='tight', facecolor='white')
+            save_chart_figure(fig, save_path, 'full')
+        for output_path, profile_name in outputs or ():
+            save_chart_figure(fig, output_path, profile_name)
 
         # 关闭图表并清理资源
         plt.close(fig)
         plt.clf()  # 清理当前图形
 
-        return save_path
+        return save_path or (outputs[0][0] if outputs else None)
 
     except Exception as e:
         print(f"绘制图表时出错: {e}")
@@ -3032,8 +3666,195 @@ def draw_td_chart(hist_data, td_data, analysis, save_path=None):
         return None
 
 
-def analyze_stocks_parallel(stock_data, target_date, max_workers=4):
-    """并行分析股票 - 优化版本"""
+def build_chart_payload(td_data, analysis):
+    """提取绘图所需的最少数据：最近 CHART_DISPLAY_BARS 根K线的绘图列和图上显示的分析字段"""
+    df = td_data.sort_values('trade_date').tail(CHART_DISPLAY_BARS)
+    fields = {key: analysis.get(key) for key in CHART_PAYLOAD_FIELDS}
+    fields['td_strategy'] = {key: analysis['td_strategy'][key] for key in ('direction', 'position_size')}
+    return {'bars': {column: df[column].to_numpy() for column in CHART_PAYLOAD_COLUMNS if column in df.columns},
+            'analysis': fields}
+
+
+def get_chart_payload_hash(payload):
+    """图表数据包的内容哈希（K线列、显示字段和渲染器版本），相同哈希的图表内容相同"""
+    digest = hashlib.sha1(f"td-chart-v{CHART_RENDERER_VERSION}".encode())
+    for column, values in payload['bars'].items():
+        digest.update(column.encode())
+        if values.dtype == object:
+            digest.update('\x00'.join(map(str, values)).encode())
+        else:
+            digest.update(values.dtype.str.encode())
+            digest.update(np.ascontiguousarray(values).tobytes())
+    digest.update(json.dumps(payload['analysis'], sort_keys=True, ensure_ascii=False, default=str).encode())
+    return digest.hexdigest()
+
+
+def get_chart_output_filename(payload_hash, profile_name):
+    """图表缓存文件名：数据包哈希加上档位配置的哈希，修改档位配置后不会误用旧图"""
+    profile = CHART_RENDER_PROFILES[profile_name]
+    profile_hash = hashlib.sha1(json.dumps(profile, sort_keys=True).encode()).hexdigest()[:8]
+    return f"{payload_hash}_{profile_name}_{profile_hash}.{profile['format']}"
+
+
+def render_chart_payload(payload, outputs):
+    """渲染进程工作函数：由图表数据包绘制图表，按 outputs [(保存路径, 档位名)] 保存，失败时返回None"""
+    return draw_td_chart(None, pd.DataFrame(payload['bars']), payload['analysis'], outputs=outputs)
+
+
+def init_chart_worker():
+    """渲染进程初始化：使用 Agg 后端并预先加载字体，避免每张图表重复查找"""
+    import matplotlib
+    matplotlib.use('Agg')
+    plt.ioff()
+    fm.findfont(fm.FontProperties())
+    fm.findfont(fm.FontProperties(weight='bold'))
+
+
+def render_chart_jobs(jobs, max_workers=None):
+    """
+    多进程渲染图表，jobs 为 [(图表数据包, [(保存路径, 档位名)])]，返回各任务的首个保存路径（失败为None）
+    matplotlib 不是线程安全的，每个渲染进程各自使用独立的 Agg 后端；只有一个任务时直接在当前进程渲染
+    """
+    max_workers = min(max_workers or CHART_RENDER_WORKERS or os.cpu_count() or 1, len(jobs))
+    if max_workers <= 1:
+        return [render_chart_payload(payload, outputs) for payload, outputs in jobs]
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=init_chart_worker) as executor:
+        return list(executor.map(render_chart_payload, *zip(*jobs)))
+
+
+def build_chart_json(payload):
+    """
+    将图表数据包转换为内嵌在报告中的紧凑JSON（按列存放，价格保留3位小数，缺失值为null），
+    供浏览器绘制K线、均线、成交量、TD序号标记以及TDST和支撑阻力线
+    """
+    bars, analysis = payload['bars'], payload['analysis']
+
+    def series(column, digits=3, scale=1):
+        values = np.round(np.asarray(bars[column], dtype=float) / scale, digits)
+        return [None if np.isnan(value) else float(value) for value in values]
+
+    data = {
+        'title': f"{analysis['name']} ({analysis['code']}) - TD序列技术分析图表(前复权)",
+        'date': list(pd.to_datetime(bars['trade_date']).strftime('%Y-%m-%d')),
+        'open': series('open_qfq'), 'high': series('high_qfq'), 'low': series('low_qfq'),
+        'close': series('close_qfq'), 'vol': series('vol', 2, 10000),
+        'setup': [int(value) for value in bars['td_setup']],
+        'countdown': [int(value) for value in bars['td_countdown']],
+        'perfected': [int(i) for i in np.flatnonzero(np.asarray(bars['td_perfected'], dtype=bool))],
+        'tdst_support': float(bars['tdst_support'][-1]),
+        'tdst_resistance': float(bars['tdst_resistance'][-1]),
+        'support': float(analysis['support_levels'].split('S1: ')[1].split(',')[0]),
+        'resistance': float(analysis['resistance_levels'].split('R1: ')[1].split(',')[0]),
+    }
+    for column in ('ma5', 'ma10', 'ma20'):
+        if column in bars:
+            data[column] = series(column)
+    # 内嵌在 <script> 标签中，转义 "</" 以免提前结束标签
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).replace('</', '<\\/')
+
+
+def build_interactive_charts(stocks):
+    """交互式图表模式：为给定股票生成内嵌图表数据，返回图表信息列表（chart_data 为JSON字符串）"""
+    chart_files = []
+    for analysis in stocks:
+        try:
+            hist_data, td_data = restore_chart_data(analysis)
+            if hist_data is None or td_data is None:
+                print(f"⚠️ {analysis['name']} 缺少图表数据，跳过...")
+                continue
+            chart_files.append({
+                'analysis': analysis,
+                'chart_data': build_chart_json(build_chart_payload(td_data, analysis))
+            })
+        except Exception as e:
+            print(f"❌ 处理 {analysis.get('name', 'Unknown')} 时出错: {e}")
+    print(f"🧩 已生成 {len(chart_files)}/{len(stocks)} 个交互式图表数据")
+    return chart_files
+
+
+def render_analysis_charts(stocks, chart_dir=CHART_CACHE_DIR, profiles=None):
+    """
+    为给定股票准备图表数据包（精简记录按需重建图表数据），按内容哈希查找图表缓存，
+    只有未命中的图表交给渲染进程池并行绘制，返回图表信息列表（文件位于 chart_dir）
+    profiles 为生成的档位（默认 CHART_OUTPUT_PROFILES，并总是包含报告内嵌的档位）；
+    交互式图表模式下只生成内嵌的图表数据
+    """
+    if CHART_MODE == 'interactive':
+        return build_interactive_charts(stocks)
+
+    profiles = list(dict.fromkeys([CHART_REPORT_PROFILE, *(profiles or CHART_OUTPUT_PROFILES)]))
+    os.makedirs(chart_dir, exist_ok=True)
+    chart_entries = []
+    # 待渲染任务按数据包哈希去重：内容相同的股票（如重复输入的代码）只渲染一次，共用同一组文件
+    pending = {}
+    for i, analysis in enumerate(stocks, 1):
+        try:
+            print(f"📈 正在准备 {i}/{len(stocks)}: {analysis['name']}")
+            hist_data, td_data = restore_chart_data(analysis)
+            if hist_data is None or td_data is None:
+                print(f"⚠️ {analysis['name']} 缺少图表数据，跳过...")
+                continue
+
+            payload = build_chart_payload(td_data, analysis)
+            payload_hash = get_chart_payload_hash(payload)
+            chart_outputs = {name: get_chart_output_filename(payload_hash, name) for name in profiles}
+            missing = [(os.path.join(chart_dir, filename), name) for name, filename in chart_outputs.items()
+                       if not os.path.exists(os.path.join(chart_dir, filename))]
+            if missing:
+                pending.setdefault(payload_hash, (payload, missing))
+            chart_entries.append((analysis, payload_hash, chart_outputs))
+        except Exception as e:
+            print(f"❌ 处理 {analysis.get('name', 'Unknown')} 时出错: {e}")
+
+    cache_hits = sum(payload_hash not in pending for _, payload_hash, _ in chart_entries)
+    print(f"🗂️ 图表缓存命中 {cache_hits}/{len(chart_entries)}（档位: {', '.join(profiles)}）")
+    if pending:
+        workers = min(CHART_RENDER_WORKERS or os.cpu_count() or 1, len(pending))
+        print(f"🖼️ 使用 {workers} 个进程渲染 {len(pending)} 个图表...")
+        # 先写临时文件再改名，中断时缓存中不会留下不完整的图表
+        suffix = f".{os.getpid()}.tmp"
+        jobs = [(payload, [(f"{path}{suffix}", name) for path, name in missing])
+                for payload, missing in pending.values()]
+        for (_, missing), saved_path in zip(pending.values(), render_chart_jobs(jobs)):
+            for path, _ in missing:
+                if saved_path:
+                    os.replace(f"{path}{suffix}", path)
+                elif os.path.exists(f"{path}{suffix}"):
+                    os.remove(f"{path}{suffix}")
+
+    chart_files = []
+    for analysis, _, chart_outputs in chart_entries:
+        chart_outputs = {name: filename for name, filename in chart_outputs.items()
+                         if os.path.exists(os.path.join(chart_dir, filename))}
+        if CHART_REPORT_PROFILE in chart_outputs:
+            chart_files.append({
+                'analysis': analysis,
+                'chart_path': os.path.join(chart_dir, chart_outputs[CHART_REPORT_PROFILE]),
+                'chart_filename': chart_outputs[CHART_REPORT_PROFILE],
+                'chart_outputs': chart_outputs,
+                'chart_dir': chart_dir
+            })
+        else:
+            print(f"⚠️ 绘制 {analysis['name']} 图表失败")
+    return chart_files
+
+
+def analyze_stocks_parallel(stock_data, target_date, max_workers=4, use_processes=None,
+                            process_workers=None, chunk_size=None):
+    """
+    并行分析股票 - 优化版本
+    use_processes 为 True（默认取 ANALYSIS_USE_PROCESS_POOL）时切换到进程池模式，
+    此时 max_workers 为数据获取线程数，process_workers 为计算进程数
+    """
+    if use_processes is None:
+        use_processes = ANALYSIS_USE_PROCESS_POOL
+    if use_processes:
+        if ANALYSIS_USE_SHARED_MEMORY:
+            return analyze_stocks_shared_memory(stock_data, target_date, process_workers, chunk_size,
+                                                fetch_workers=max_workers)
+        return analyze_stocks_multiprocess(stock_data, target_date, process_workers, chunk_size,
+                                           fetch_workers=max_workers)
+
     # 设置matplotlib后端
     import matplotlib
     matplotlib.use('Agg')
@@ -3054,212 +3875,570 @@ def analyze_stocks_parallel(stock_data, target_date, max_workers=4):
             for idx, stock in stock_data.iterrows()
         ]
 
-        # 收集结果
-        for idx, future in enumerate(as_completed(futures), 1):
-            try:
-                result = future.result()
-                analyses.append(result)
-                print(f"📊 分析进度: {idx}/{len(stock_data)} - {result.get('name', '未知股票')}")
-            except Exception as e:
-                print(f"分析股票时出错: {e}")
-                continue
+        # 收集结果
+        for idx, future in enumerate(as_completed(futures), 1):
+            try:
+                result = future.result()
+                analyses.append(result)
+                print(f"📊 分析进度: {idx}/{len(stock_data)} - {result.get('name', '未知股票')}")
+            except Exception as e:
+                print(f"分析股票时出错: {e}")
+                continue
+
+    return analyses
+
+
+# 精简分析记录保存的字段：compute_td_analysis 的标量和汇总结果，外加用于重建图表数据的 target_date
+ANALYSIS_RECORD_FIELDS = (
+    'code', 'name', 'target_date', 'current_price', 'ma_trend', 'td_setup', 'td_countdown', 'td_perfected',
+    'td_combo', 'td_risk_level', 'td_pressure', 'td_momentum', 'td_phase', 'td_signal_grade', 'td_score',
+    'confidence', 'reversal_probability', 'tdst_levels', 'support_levels', 'resistance_levels', 'pivot',
+    'volume_analysis', 'pattern', 'td_stats', 'td_strategy', 'market_strength', 'atr_value',
+    'four_dimensional_analysis', 'top_bottom_analysis', 'max_profit_pct', 'max_profit_days',
+    'max_profit_status', 'emotion_analysis',
+)
+
+
+class AnalysisRecord:
+    """
+    单只股票的精简分析记录（__slots__，不持有 hist_data/td_data）
+    支持 analysis['key'] / get / in 等字典式访问，报告代码无需改动；
+    图表数据由 restore_chart_data 根据 code 和 target_date 从历史数据重新计算
+    """
+    __slots__ = ANALYSIS_RECORD_FIELDS
+
+    def __init__(self, **fields):
+        for key, value in fields.items():
+            setattr(self, key, value)
+
+    @classmethod
+    def from_analysis(cls, analysis, target_date=None):
+        """由 compute_td_analysis 的结果生成精简记录；出错结果（含 'analysis' 说明）原样返回"""
+        if isinstance(analysis.get('analysis'), str):
+            return analysis
+        fields = {key: value for key, value in analysis.items() if key in ANALYSIS_RECORD_FIELDS}
+        if target_date is not None:
+            fields['target_date'] = target_date
+        return cls(**fields)
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key) from None
+
+    def __setitem__(self, key, value):
+        if key not in ANALYSIS_RECORD_FIELDS:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in ANALYSIS_RECORD_FIELDS and hasattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default) if key in ANALYSIS_RECORD_FIELDS else default
+
+    def keys(self):
+        return [key for key in ANALYSIS_RECORD_FIELDS if hasattr(self, key)]
+
+    def items(self):
+        return [(key, getattr(self, key)) for key in self.keys()]
+
+    def to_dict(self):
+        return dict(self.items())
+
+
+# 整轮筛选结果表的固定结构：index 指向原分析结果列表，嵌套的明细字段仍保留在分析记录中
+RESULT_TABLE_DTYPE = np.dtype([
+    ('index', 'i4'), ('code', 'U12'), ('name', 'U32'), ('current_price', 'f8'), ('td_setup', 'i2'),
+    ('td_countdown', 'i2'), ('td_combo', 'i2'), ('td_risk_level', 'f8'), ('td_score', 'f8'), ('confidence', 'f8'),
+    ('grade', 'U2'), ('atr_value', 'f8'), ('max_profit_pct', 'f8'), ('max_profit_days', 'i4'),
+])
+
+# Setup阶段统计区间（按 |td_setup| 划分）
+SETUP_STAGES = {'初期': (1, 3), '中期': (4, 6), '后期': (7, 8), '完成': (9, 9)}
+
+
+def build_result_table(analyses):
+    """将一轮分析结果整理为结构化数组，每只分析成功的股票一行（保持原顺序），出错结果不进入表"""
+    valid = [index for index, analysis in enumerate(analyses) if not isinstance(analysis.get('analysis'), str)]
+    table = np.zeros(len(valid), dtype=RESULT_TABLE_DTYPE)
+    if not valid:
+        return table
+
+    records = [analyses[index] for index in valid]
+    table['index'] = valid
+    table['grade'] = [record.get('td_signal_grade', 'C级（弱）').split('级')[0] for record in records]
+    for field in RESULT_TABLE_DTYPE.names:
+        if field in ('index', 'grade'):
+            continue
+        values = [record.get(field, 0) for record in records]
+        kind = RESULT_TABLE_DTYPE[field].kind
+        table[field] = values if kind == 'U' else np.nan_to_num(np.asarray(values, dtype=float)) if kind == 'i' \
+            else np.asarray(values, dtype=float)
+    return table
+
+
+def select_focus_rows(table, min_score, min_countdown, min_confidence, grades='', limit=None):
+    """
+    重点关注股票：评分、|Countdown|、信心度或信号等级任一达标，按评分从高到低稳定排序
+    返回结果表中的行号，limit 限制返回数量
+    """
+    mask = ((table['td_score'] >= min_score) | (np.abs(table['td_countdown']) >= min_countdown)
+            | (table['confidence'] >= min_confidence))
+    if grades:
+        mask |= np.isin(table['grade'], list(grades))
+    rows = np.flatnonzero(mask)
+    rows = rows[np.argsort(-table['td_score'][rows], kind='stable')]
+    return rows[:limit] if limit is not None else rows
+
+
+def summarize_result_table(table):
+    """结果表汇总：信号等级分布、Setup阶段分布、Countdown进行中数量和平均价格"""
+    setup = np.abs(table['td_setup'])
+    grades, counts = np.unique(table['grade'], return_counts=True)
+    return {
+        'signal_grades': dict(zip(grades.tolist(), counts.tolist())),
+        'setup_stats': {stage: int(((setup >= low) & (setup <= high)).sum())
+                        for stage, (low, high) in SETUP_STAGES.items()},
+        'countdown_active': int((np.abs(table['td_countdown']) > 0).sum()),
+        'avg_price': float(table['current_price'].mean()) if len(table) else 0,
+    }
+
+
+def export_result_table(table, path):
+    """导出结果表：.parquet 通过 pandas/pyarrow 写出，未安装 pyarrow 时改存同名CSV；返回实际文件名"""
+    frame = pd.DataFrame(table).drop(columns='index')
+    if path.endswith('.parquet'):
+        try:
+            frame.to_parquet(path, index=False)
+            return path
+        except ImportError:
+            path = path[:-len('.parquet')] + '.csv'
+            print(f"⚠️ 未安装 pyarrow，结果表改存为CSV: {path}")
+    frame.to_csv(path, index=False, encoding='utf-8-sig')
+    return path
+
+
+def pack_stock_bars(hist_data):
+    """将历史数据转换为 {列名: NumPy数组} 的紧凑结构，用于跨进程传输"""
+    bars = {}
+    for column in hist_data.columns:
+        values = hist_data[column].to_numpy()
+        bars[column] = values.astype(str) if values.dtype == object else values
+    return bars
+
+
+def analyze_stock_chunk(tasks, target_date=None):
+    """进程池工作函数：计算一组股票的TD分析，返回不含图表数据的精简记录"""
+    results = []
+    for stock_code, stock_name, bars, max_profit_result in tasks:
+        analysis = compute_td_analysis(stock_code, stock_name, pd.DataFrame(bars), max_profit_result)
+        results.append(AnalysisRecord.from_analysis(analysis, target_date))
+    return results
+
+
+def fetch_stock_bundle(stock_code, stock_name, target_date):
+    """I/O阶段：获取单只股票的历史数据和60日最大盈利（API调用受全局限速），打包为计算任务"""
+    try:
+        hist_data = fetch_td_analysis_data(stock_code, target_date)
+        max_profit_result = None
+        if len(hist_data) >= 30:
+            max_profit_result = calculate_max_profit_after_target_date(stock_code, target_date)
+        return stock_code, stock_name, pack_stock_bars(hist_data), max_profit_result
+    except Exception as e:
+        return {
+            'code': stock_code,
+            'name': stock_name,
+            'analysis': f"TD分析过程出错: {str(e)}"
+        }
+
+
+def analyze_stocks_multiprocess(stock_data, target_date, max_workers=None, chunk_size=None, fetch_workers=4,
+                                queue_size=64, report_interval=5.0):
+    """
+    进程池模式并行分析股票（两阶段流水线）- 使用前复权数据
+    I/O阶段：fetch_workers 个线程限速获取数据，打包后放入容量为 queue_size 的有界队列，队列满时阻塞
+    计算阶段：主线程从队列按块取任务提交进程池，在途任务块数量有上限，整体内存保持平稳
+    运行中定期输出两个阶段的吞吐量和队列深度；返回精简记录，K线数据不随结果保留，
+    图表数据由 restore_chart_data 按需重建
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    stocks = [(stock['ts_code'], stock['name']) for _, stock in stock_data.iterrows()]
+    if not stocks:
+        return []
+
+    if chunk_size is None:
+        chunk_size = max(1, min(16, -(-len(stocks) // (max_workers * 4))))
+    fetch_workers = max(1, fetch_workers)
+    bundle_queue = queue.Queue(maxsize=max(queue_size, chunk_size))
+    finished = object()
+
+    analyses = []
+    stats = {'fetched': 0, 'fetch_done': None, 'computed': 0, 'depth_samples': [], 'start': time.time()}
+    stats_lock = threading.Lock()
+    stock_iter = iter(stocks)
+
+    def fetch_stage():
+        while True:
+            with stats_lock:
+                stock = next(stock_iter, None)
+            if stock is None:
+                break
+            bundle = fetch_stock_bundle(stock[0], stock[1], target_date)
+            bundle_queue.put(bundle)
+            with stats_lock:
+                stats['fetched'] += 1
+
+    def fetch_all():
+        with ThreadPoolExecutor(max_workers=fetch_workers) as fetch_executor:
+            for future in [fetch_executor.submit(fetch_stage) for _ in range(fetch_workers)]:
+                future.result()
+        stats['fetch_done'] = time.time()
+        bundle_queue.put(finished)
+
+    def report(final=False):
+        elapsed = max(time.time() - stats['start'], 1e-9)
+        fetch_elapsed = max((stats['fetch_done'] or time.time()) - stats['start'], 1e-9)
+        depth = bundle_queue.qsize()
+        print(f"{'📈 流水线统计' if final else '⏱️ 流水线进度'}: "
+              f"获取 {stats['fetched']}/{len(stocks)} ({stats['fetched'] / fetch_elapsed:.1f}只/秒) | "
+              f"计算 {stats['computed']}/{len(stocks)} ({stats['computed'] / elapsed:.1f}只/秒) | "
+              f"队列 {depth}/{bundle_queue.maxsize}")
+
+    def collect(done_futures):
+        for future in done_futures:
+            try:
+                chunk_results = future.result()
+            except Exception as e:
+                print(f"分析股票时出错: {e}")
+                continue
+            analyses.extend(chunk_results)
+            stats['computed'] += len(chunk_results)
+
+    print(f"🚀 流水线分析 {len(stocks)} 只股票: {fetch_workers} 个获取线程 → 队列({bundle_queue.maxsize}) → "
+          f"{max_workers} 个计算进程（每块 {chunk_size} 只）")
+
+    producer = threading.Thread(target=fetch_all, daemon=True)
+    producer.start()
+
+    pending = set()
+    chunk = []
+    last_report = time.time()
+    producer_finished = False
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        while not producer_finished or chunk:
+            try:
+                bundle = bundle_queue.get(timeout=0.5) if not producer_finished else None
+            except queue.Empty:
+                bundle = None
+            if stats['fetch_done'] is None:
+                # 只在I/O阶段运行期间采样，避免收尾排空队列时拉低平均深度
+                stats['depth_samples'].append(bundle_queue.qsize())
+
+            if bundle is finished:
+                producer_finished = True
+            elif isinstance(bundle, dict):
+                analyses.append(bundle)
+                stats['computed'] += 1
+            elif bundle is not None:
+                chunk.append(bundle)
+
+            if chunk and (len(chunk) >= chunk_size or producer_finished):
+                # 在途任务块达到上限时等待完成，向I/O阶段传导背压
+                while len(pending) >= max_workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                pending.add(executor.submit(analyze_stock_chunk, chunk, target_date))
+                chunk = []
+
+            done = {future for future in pending if future.done()}
+            if done:
+                pending -= done
+                collect(done)
+
+            if time.time() - last_report >= report_interval:
+                report()
+                last_report = time.time()
+
+        collect(as_completed(pending))
+
+    producer.join()
+    report(final=True)
+
+    depth_samples = stats['depth_samples'] or [0]
+    average_depth = sum(depth_samples) / len(depth_samples)
+    print(f"📦 队列深度: 平均 {average_depth:.1f}, 最大 {max(depth_samples)} / {bundle_queue.maxsize}"
+          f" → {'计算阶段为瓶颈' if average_depth >= bundle_queue.maxsize * 0.5 else '数据获取阶段为瓶颈'}")
+
+    return analyses
+
+
+# 共享输出块中按K线写回的TD序列列，以及每只股票一行的评分字段
+SHARED_TD_COLUMNS = ['td_setup', 'td_countdown', 'td_combo', 'td_risk_level', 'tdst_support', 'tdst_resistance']
+SHARED_SCORE_FIELDS = ['current_price', 'td_setup', 'td_countdown', 'td_combo', 'td_score', 'confidence',
+                       'atr_value', 'max_profit_pct', 'max_profit_days']
+
+# 子进程内已挂载的共享内存块（按名称复用）
+_attached_shared_blocks = {}
+
+
+def create_shared_array(shape, dtype=np.float64):
+    """创建共享内存数组，返回 (SharedMemory, ndarray视图, 描述信息)，由创建方负责 close/unlink"""
+    dtype = np.dtype(dtype)
+    size = max(int(np.prod(shape)) * dtype.itemsize, 1)
+    shm = shared_memory.SharedMemory(create=True, size=size)
+    array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    return shm, array, {'name': shm.name, 'shape': tuple(shape), 'dtype': dtype.str}
+
+
+def attach_shared_array(descriptor):
+    """按名称挂载共享内存数组，返回零拷贝的 ndarray 视图"""
+    name = descriptor['name']
+    if name not in _attached_shared_blocks:
+        _attached_shared_blocks[name] = shared_memory.SharedMemory(name=name)
+    return np.ndarray(descriptor['shape'], dtype=descriptor['dtype'], buffer=_attached_shared_blocks[name].buf)
+
+
+def create_shared_panel(hist_data_list):
+    """
+    将多只股票的历史数据放入共享内存面板 (字段数 × 股票数 × K线数)，靠右对齐
+    trade_date 以 YYYYMMDD 数值形式存放；返回 (SharedMemory, 面板描述, lengths, 每只股票的字段列表)
+    """
+    fields = []
+    for hist_data in hist_data_list:
+        for column in hist_data.columns:
+            if column != 'ts_code' and column not in fields:
+                fields.append(column)
+    bars = max([len(hist_data) for hist_data in hist_data_list] + [1])
+
+    panel = build_price_panel(hist_data_list, fields, bars=bars)
+    shm, values, descriptor = create_shared_array((len(fields), len(hist_data_list), bars))
+    for index, field in enumerate(fields):
+        values[index] = panel[field]
+    descriptor['fields'] = fields
+
+    columns = [[field for field in fields if panel['present'][field][row]] for row in range(len(hist_data_list))]
+    return shm, descriptor, panel['lengths'], columns
+
+
+def read_shared_stock_frame(values, fields, row, length, columns):
+    """从共享面板视图中读取单只股票的数据（按列取零拷贝切片后组装为DataFrame）"""
+    bars = values.shape[2]
+    data = {field: values[fields.index(field), row, bars - length:] for field in columns}
+    if 'trade_date' in data:
+        data['trade_date'] = np.char.mod('%08d', data['trade_date'].astype(np.int64))
+    return pd.DataFrame(data)
+
+
+def analyze_shared_panel_chunk(panel_descriptor, td_descriptor, score_descriptor, tasks, target_date=None):
+    """
+    共享内存模式的工作函数，tasks 为 (行号, 股票代码, 股票名称, K线数, 字段列表, 最大盈利结果)
+    从共享面板读取数据计算TD分析，TD序列列和评分写入共享输出块，返回精简记录
+    """
+    values = attach_shared_array(panel_descriptor)
+    td_output = attach_shared_array(td_descriptor)
+    score_output = attach_shared_array(score_descriptor)
+    fields = panel_descriptor['fields']
+    bars = values.shape[2]
+
+    results = []
+    for row, stock_code, stock_name, length, columns, max_profit_result in tasks:
+        hist_data = read_shared_stock_frame(values, fields, row, length, columns)
+        hist_data['ts_code'] = stock_code
+        analysis = compute_td_analysis(stock_code, stock_name, hist_data, max_profit_result)
+
+        td_data = analysis.get('td_data')
+        if td_data is not None:
+            for index, column in enumerate(SHARED_TD_COLUMNS):
+                td_output[index, row, bars - len(td_data):] = td_data[column].to_numpy(dtype=float)
+            for index, field in enumerate(SHARED_SCORE_FIELDS):
+                score_output[row, index] = analysis.get(field, np.nan)
+
+        results.append(AnalysisRecord.from_analysis(analysis, target_date))
+    return results
+
+
+def analyze_stocks_shared_memory(stock_data, target_date, max_workers=None, chunk_size=None, fetch_workers=4,
+                                 return_arrays=False):
+    """
+    共享内存模式并行分析股票 - 使用前复权数据
+    先用线程池获取全部股票数据并放入共享内存面板，子进程按名称挂载后零拷贝读取各自的数据，
+    TD序列列和评分写回共享输出块；return_arrays=True 时同时返回输出块的副本
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    stocks = [(stock['ts_code'], stock['name']) for _, stock in stock_data.iterrows()]
+
+    analyses = []
+    loaded = []
+    print(f"🌐 使用 {fetch_workers} 个线程获取 {len(stocks)} 只股票数据...")
+    with ThreadPoolExecutor(max_workers=max(1, fetch_workers)) as executor:
+        for bundle in executor.map(lambda stock: fetch_stock_bundle(stock[0], stock[1], target_date), stocks):
+            if isinstance(bundle, dict):
+                analyses.append(bundle)
+            else:
+                loaded.append(bundle)
 
-    return analyses
+    arrays = {'codes': [bundle[0] for bundle in loaded], 'td_columns': SHARED_TD_COLUMNS,
+              'score_fields': SHARED_SCORE_FIELDS}
+    if not loaded:
+        return (analyses, arrays) if return_arrays else analyses
 
+    hist_data_list = [pd.DataFrame(bundle[2]).sort_values('trade_date') for bundle in loaded]
+    panel_shm, panel_descriptor, lengths, columns = create_shared_panel(hist_data_list)
+    bars = panel_descriptor['shape'][2]
+    td_shm, td_output, td_descriptor = create_shared_array((len(SHARED_TD_COLUMNS), len(loaded), bars))
+    score_shm, score_output, score_descriptor = create_shared_array((len(loaded), len(SHARED_SCORE_FIELDS)))
+    td_output.fill(np.nan)
+    score_output.fill(np.nan)
 
-def create_td_charts_for_focus_stocks(analyses, target_date):
-    """为重点关注股票创建TD图表"""
-    # 设置matplotlib后端
-    import matplotlib
-    matplotlib.use('Agg')
-    plt.ioff()  # 关闭交互模式
+    try:
+        tasks = [(row, bundle[0], bundle[1], int(lengths[row]), columns[row], bundle[3])
+                 for row, bundle in enumerate(loaded)]
+        if chunk_size is None:
+            chunk_size = max(1, -(-len(tasks) // (max_workers * 4)))
+        chunks = [tasks[i:i + chunk_size] for i in range(0, len(tasks), chunk_size)]
+
+        print(f"🚀 使用 {max_workers} 个进程计算 {len(tasks)} 只股票（共享内存面板 "
+              f"{panel_shm.size / 1024 / 1024:.1f}MB，{len(chunks)} 个任务块）...")
+        completed = 0
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(analyze_shared_panel_chunk, panel_descriptor, td_descriptor,
+                                       score_descriptor, chunk, target_date) for chunk in chunks]
+            for future in as_completed(futures):
+                try:
+                    chunk_results = future.result()
+                except Exception as e:
+                    print(f"分析股票时出错: {e}")
+                    continue
+                for result in chunk_results:
+                    completed += 1
+                    analyses.append(result)
+                    print(f"📊 分析进度: {completed}/{len(tasks)} - {result.get('name', '未知股票')}")
 
-    # 创建图表保存目录
-    chart_dir = f"td_charts_{target_date}_{datetime.now().strftime('%H%M%S')}"
-    if not os.path.exists(chart_dir):
-        os.makedirs(chart_dir)
+        arrays['td'] = np.array(td_output)
+        arrays['scores'] = np.array(score_output)
+    finally:
+        del td_output, score_output
+        for shm in (panel_shm, td_shm, score_shm):
+            shm.close()
+            shm.unlink()
 
-    print(f"\n📊 开始为重点关注股票生成TD图表(前复权数据)...")
+    return (analyses, arrays) if return_arrays else analyses
 
-    # 筛选重点关注股票
-    focus_stocks = []
-    for analysis in analyses:
-        if 'analysis' in analysis and isinstance(analysis['analysis'], str):
-            continue
 
-        score = analysis.get('td_score', 0)
-        countdown = abs(analysis.get('td_countdown', 0))
-        confidence = analysis.get('confidence', 0)
+def restore_chart_data(analysis):
+    """
+    返回绘图用的历史数据和TD数据；精简记录按 code 和 target_date 重新取数计算
+    （批量分析时命中历史数据缓存，不产生额外API调用），只有绘图的股票才会重建
+    """
+    hist_data = analysis.get('hist_data')
+    td_data = analysis.get('td_data')
+    if hist_data is not None and td_data is not None:
+        return hist_data, td_data
 
-        # 筛选标准：评分≥25分 OR Countdown≥8 OR 信心度≥50%
-        if score >= 25 or countdown >= 8 or confidence >= 50:
-            focus_stocks.append(analysis)
+    target_date = analysis.get('target_date')
+    if not target_date:
+        return None, None
 
-    # 按评分排序，取前10只
-    focus_stocks.sort(key=lambda x: x.get('td_score', 0), reverse=True)
-    focus_stocks = focus_stocks[:10]
+    hist_data = fetch_td_analysis_data(analysis['code'], target_date)
+    if hist_data is None or len(hist_data) < 30:
+        return None, None
 
-    print(f"🎯 筛选出 {len(focus_stocks)} 只重点关注股票进行图表绘制")
+    hist_data = add_moving_averages(hist_data.sort_values('trade_date'))
+    return hist_data, calculate_td_sequential_enhanced(hist_data)
 
-    chart_files = []
 
-    for i, analysis in enumerate(focus_stocks, 1):
-        try:
-            print(f"📈 正在绘制 {i}/{len(focus_stocks)}: {analysis['name']}")
+def create_td_charts_for_focus_stocks(analyses, target_date, table=None):
+    """为重点关注股票创建TD图表（table 为 build_result_table 的结果，未传入时现场生成）"""
+    # 设置matplotlib后端
+    import matplotlib
+    matplotlib.use('Agg')
+    plt.ioff()  # 关闭交互模式
 
-            # 使用已有的历史数据和TD数据
-            hist_data = analysis.get('hist_data')
-            td_data = analysis.get('td_data')
+    print(f"\n📊 开始为重点关注股票生成TD图表(前复权数据)...")
 
-            if hist_data is None or td_data is None:
-                print(f"⚠️ {analysis['name']} 缺少图表数据，跳过...")
-                continue
+    # 筛选重点关注股票：评分≥25分 OR Countdown≥8 OR 信心度≥50%，按评分排序取前10只；
+    # 交互式图表由浏览器绘制，报告中的全部股票都生成图表数据
+    if table is None:
+        table = build_result_table(analyses)
+    if CHART_MODE == 'interactive':
+        focus_stocks = [analyses[index] for index in table['index']]
+    else:
+        focus_rows = select_focus_rows(table, 25, 8, 50, limit=10)
+        focus_stocks = [analyses[index] for index in table['index'][focus_rows]]
 
-            # 生成安全的图表文件名
-            safe_name = analysis['name'].replace('/', '_').replace('\\', '_').replace('*', '_').replace('?',
-                                                                                                        '_').replace(
-                ':', '_').replace('|', '_').replace('<', '_').replace('>', '_').replace('"', '_')
-            chart_filename = f"{safe_name}_{analysis['code'].replace('.', '_')}_td_chart.png"
-            chart_path = os.path.join(chart_dir, chart_filename)
+    print(f"🎯 筛选出 {len(focus_stocks)} 只重点关注股票进行图表绘制")
 
-            # 绘制图表 - 添加异常处理
-            try:
-                saved_path = draw_td_chart(hist_data, td_data, analysis, chart_path)
+    # 图表保存在共享的图表缓存目录，重复运行同一日期时直接复用
+    chart_files = render_analysis_charts(focus_stocks)
 
-                if saved_path:
-                    chart_files.append({
-                        'analysis': analysis,
-                        'chart_path': saved_path,
-                        'chart_filename': chart_filename,
-                        'chart_dir': chart_dir
-                    })
-
-            except Exception as draw_error:
-                print(f"⚠️ 绘制 {analysis['name']} 图表失败: {draw_error}")
-                continue
+    print(f"✅ 成功生成 {len(chart_files)} 个TD图表(前复权)")
+    return chart_files, CHART_CACHE_DIR if CHART_MODE == 'image' else None
 
-        except Exception as e:
-            print(f"❌ 处理 {analysis['name']} 时出错: {e}")
-            continue
 
-        print(f"✅ 成功生成 {len(chart_files)} 个TD图表(前复权)")
-        return chart_files, chart_dir
+def estimate_market_cap_yi(stock_code, current_price):
+    """报告中的总市值估算（模拟计算，实际应用中应从数据源获取），单位亿元"""
+    # 使用股票代码生成一致的模拟股本数据，5亿到15亿股；crc32 不受字符串哈希随机化影响，各次运行结果相同
+    simulated_shares = 500000000 + (zlib.crc32(stock_code.encode()) % 1000000) * 100000
+    return current_price * simulated_shares / 100000000
 
 
-def generate_html_report(analyses, target_date, chart_files=None):
-    """生成HTML可视化报告（前复权数据版本）"""
-    # 统计数据
-    total_stocks = len(analyses)
-    valid_analyses = [a for a in analyses if 'analysis' not in a or not isinstance(a.get('analysis'), str)]
-
-    # 重点关注股票（优化后标准）
-    focus_stocks = []
-    for analysis in valid_analyses:
-        score = analysis.get('td_score', 0)
-        countdown = abs(analysis.get('td_countdown', 0))
-        confidence = analysis.get('confidence', 0)
-
-        # 更灵活的筛选标准
-        if (score >= 20 or countdown >= 8 or confidence >= 45 or
-                analysis.get('td_signal_grade', '').startswith('B') or
-                analysis.get('td_signal_grade', '').startswith('A') or
-                analysis.get('td_signal_grade', '').startswith('S')):
-            focus_stocks.append(analysis)
-
-    # 按综合得分排序
-    focus_stocks.sort(key=lambda x: x.get('td_score', 0), reverse=True)
-
-    # 信号等级统计
-    signal_grades = {}
-    for analysis in valid_analyses:
-        grade = analysis.get('td_signal_grade', 'C级（弱）').split('级')[0]
-        signal_grades[grade] = signal_grades.get(grade, 0) + 1
-
-    # Setup阶段统计
-    setup_stats = {'初期': 0, '中期': 0, '后期': 0, '完成': 0}
-    countdown_active = 0
-
-    for analysis in valid_analyses:
-        setup = abs(analysis.get('td_setup', 0))
-        countdown = abs(analysis.get('td_countdown', 0))
-
-        if setup >= 1 and setup <= 3:
-            setup_stats['初期'] += 1
-        elif setup >= 4 and setup <= 6:
-            setup_stats['中期'] += 1
-        elif setup >= 7 and setup <= 8:
-            setup_stats['后期'] += 1
-        elif setup == 9:
-            setup_stats['完成'] += 1
-
-        if countdown > 0:
-            countdown_active += 1
-
-    avg_price = sum(a.get('current_price', 0) for a in valid_analyses) / len(valid_analyses) if valid_analyses else 0
+def report_row_order(table):
+    """报告表格的初始行顺序：与页面默认排序状态一致，按总市值升序（稳定排序）"""
+    market_caps = np.array([estimate_market_cap_yi(code, price)
+                            for code, price in zip(table['code'], table['current_price'])], dtype=float)
+    return np.argsort(market_caps, kind='stable')
 
-    # 创建图表代码映射
-    chart_map = {}
-    chart_dir_name = ""
-    if chart_files:
-        chart_dir_name = chart_files[0]['chart_dir']
-        for chart_info in chart_files:
-            chart_map[chart_info['analysis']['code']] = f"{chart_dir_name}/{chart_info['chart_filename']}"
 
-    html_content = f"""
-<!DOCTYPE html>
-<html lang="zh-CN">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>增强版TD股票筛选分析报告 - {target_date}</title>
-    <link rel="stylesheet" href="professional_styles.css">
-    <script src="professional_scripts.js"></script>
-    <style>
-        * {{
+# 报告样式和脚本：写出为报告目录下共享的静态资源，文件名带内容哈希，各报告共用并可被浏览器缓存
+REPORT_ASSET_DIR = 'td_report_assets'
+REPORT_STYLESHEET = """
+        * {
             margin: 0;
             padding: 0;
             box-sizing: border-box;
-        }}
+        }
 
-        body {{
+        body {
             font-family: 'Microsoft YaHei', 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
             background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
             min-height: 100vh;
             padding: 20px;
-        }}
+        }
 
-        .container {{
+        .container {
             max-width: 1400px;
             margin: 0 auto;
             background: rgba(255, 255, 255, 0.95);
             border-radius: 20px;
             padding: 30px;
             box-shadow: 0 20px 40px rgba(0, 0, 0, 0.1);
-        }}
+        }
 
-        .header {{
+        .header {
             text-align: center;
             margin-bottom: 40px;
             background: linear-gradient(135deg, #667eea, #764ba2);
             -webkit-background-clip: text;
             -webkit-text-fill-color: transparent;
             background-clip: text;
-        }}
+        }
 
-        .header h1 {{
+        .header h1 {
             font-size: 2.5rem;
             font-weight: 700;
             margin-bottom: 10px;
-        }}
+        }
 
-        .stats-grid {{
+        .stats-grid {
             display: grid;
             grid-template-columns: repeat(auto-fit, minmax(250px, 1fr));
             gap: 20px;
             margin-bottom: 40px;
-        }}
+        }
 
-        .stat-card {{
+        .stat-card {
             background: linear-gradient(135deg, #f093fb 0%, #f5576c 100%);
             color: white;
             padding: 25px;
@@ -3267,54 +4446,54 @@ def generate_html_report(analyses, target_date, chart_files=None):
             text-align: center;
             transform: translateY(0);
             transition: transform 0.3s ease;
-        }}
+        }
 
-        .stat-card:hover {{
+        .stat-card:hover {
             transform: translateY(-5px);
-        }}
+        }
 
-        .stat-number {{
+        .stat-number {
             font-size: 2.5rem;
             font-weight: 700;
             margin-bottom: 8px;
-        }}
+        }
 
-        .stat-label {{
+        .stat-label {
             font-size: 1rem;
             opacity: 0.9;
-        }}
+        }
 
-        .focus-section {{
+        .focus-section {
             margin-bottom: 40px;
             background: linear-gradient(135deg, #fa709a 0%, #fee140 100%);
             padding: 30px;
             border-radius: 15px;
             color: white;
-        }}
+        }
 
-        .focus-title {{
+        .focus-title {
             font-size: 1.8rem;
             font-weight: 600;
             margin-bottom: 20px;
             text-align: center;
-        }}
+        }
 
-        .focus-grid {{
+        .focus-grid {
             display: grid;
             grid-template-columns: repeat(auto-fit, minmax(300px, 1fr));
             gap: 20px;
-        }}
+        }
 
-        .focus-card {{
+        .focus-card {
             background: rgba(255, 255, 255, 0.15);
             padding: 20px;
             border-radius: 12px;
             backdrop-filter: blur(10px);
             border: 1px solid rgba(255, 255, 255, 0.2);
-        }}
+        }
 
         /* 新增：股票名称和代码的点击样式 */
-        .stock-link {{
+        .stock-link {
             color: #667eea;
             text-decoration: none;
             font-weight: bold;
@@ -3322,33 +4501,33 @@ def generate_html_report(analyses, target_date, chart_files=None):
             transition: all 0.3s ease;
             position: relative;
             display: inline-block;
-        }}
+        }
 
-        .stock-link:hover {{
+        .stock-link:hover {
             color: #ff4757;
             text-decoration: underline;
             transform: translateY(-1px);
-        }}
+        }
 
-        .stock-link::after {{
+        .stock-link::after {
             content: '🔗';
             opacity: 0;
             margin-left: 5px;
             transition: opacity 0.3s ease;
             font-size: 0.8em;
-        }}
+        }
 
-        .stock-link:hover::after {{
+        .stock-link:hover::after {
             opacity: 1;
-        }}
+        }
 
         /* 雪球跳转提示 */
-        .xueqiu-tooltip {{
+        .xueqiu-tooltip {
             position: relative;
             display: inline-block;
-        }}
+        }
 
-        .xueqiu-tooltip .tooltiptext {{
+        .xueqiu-tooltip .tooltiptext {
             visibility: hidden;
             width: 160px;
             background-color: #555;
@@ -3364,9 +4543,9 @@ def generate_html_report(analyses, target_date, chart_files=None):
             opacity: 0;
             transition: opacity 0.3s;
             font-size: 12px;
-        }}
+        }
 
-        .xueqiu-tooltip .tooltiptext::after {{
+        .xueqiu-tooltip .tooltiptext::after {
             content: "";
             position: absolute;
             top: 100%;
@@ -3375,46 +4554,46 @@ def generate_html_report(analyses, target_date, chart_files=None):
             border-width: 5px;
             border-style: solid;
             border-color: #555 transparent transparent transparent;
-        }}
+        }
 
-        .xueqiu-tooltip:hover .tooltiptext {{
+        .xueqiu-tooltip:hover .tooltiptext {
             visibility: visible;
             opacity: 1;
-        }}
+        }
 
         /* 优化的智能排序控制区域 */
-        .sort-controls {{
+        .sort-controls {
             background: linear-gradient(135deg, #4facfe 0%, #00f2fe 100%);
             padding: 25px;
             border-radius: 15px;
             margin-bottom: 30px;
             color: white;
             box-shadow: 0 8px 25px rgba(0, 0, 0, 0.15);
-        }}
+        }
 
-        .sort-title {{
+        .sort-title {
             font-size: 1.5rem;
             font-weight: 600;
             margin-bottom: 20px;
             text-align: center;
             text-shadow: 0 2px 4px rgba(0, 0, 0, 0.3);
-        }}
+        }
 
-        .sort-subtitle {{
+        .sort-subtitle {
             text-align: center;
             margin-bottom: 20px;
             font-size: 1.1rem;
             opacity: 0.9;
-        }}
+        }
 
-        .sort-buttons {{
+        .sort-buttons {
             display: grid;
             grid-template-columns: repeat(auto-fit, minmax(200px, 1fr));
             gap: 15px;
             margin-bottom: 20px;
-        }}
+        }
 
-        .sort-button {{
+        .sort-button {
             background: rgba(255, 255, 255, 0.2);
             color: white;
             border: 2px solid rgba(255, 255, 255, 0.3);
@@ -3431,9 +4610,9 @@ def generate_html_report(analyses, target_date, chart_files=None):
             text-align: center;
             position: relative;
             overflow: hidden;
-        }}
+        }
 
-        .sort-button::before {{
+        .sort-button::before {
             content: '';
             position: absolute;
             top: 0;
@@ -3442,50 +4621,50 @@ def generate_html_report(analyses, target_date, chart_files=None):
             height: 100%;
             background: linear-gradient(90deg, transparent, rgba(255, 255, 255, 0.2), transparent);
             transition: left 0.5s;
-        }}
+        }
 
-        .sort-button:hover {{
+        .sort-button:hover {
             background: rgba(255, 255, 255, 0.3);
             border-color: rgba(255, 255, 255, 0.5);
             transform: translateY(-2px);
             box-shadow: 0 6px 20px rgba(0, 0, 0, 0.2);
-        }}
+        }
 
-        .sort-button:hover::before {{
+        .sort-button:hover::before {
             left: 100%;
-        }}
+        }
 
-        .sort-button.active {{
+        .sort-button.active {
             background: rgba(255, 255, 255, 0.9);
             color: #4facfe;
             border-color: white;
             font-weight: 700;
             box-shadow: 0 6px 25px rgba(0, 0, 0, 0.3);
             transform: translateY(-3px);
-        }}
+        }
 
-        .sort-button .icon {{
+        .sort-button .icon {
             margin-right: 8px;
             font-size: 16px;
-        }}
+        }
 
-        .sort-button .arrow {{
+        .sort-button .arrow {
             margin-left: 8px;
             font-size: 16px;
             transition: transform 0.3s ease;
-        }}
+        }
 
-        .sort-button.active .arrow {{
+        .sort-button.active .arrow {
             animation: bounce 1s infinite;
-        }}
+        }
 
-        @keyframes bounce {{
-            0%, 50%, 100% {{ transform: translateY(0); }}
-            25% {{ transform: translateY(-3px); }}
-            75% {{ transform: translateY(3px); }}
-        }}
+        @keyframes bounce {
+            0%, 50%, 100% { transform: translateY(0); }
+            25% { transform: translateY(-3px); }
+            75% { transform: translateY(3px); }
+        }
 
-        .sort-status {{
+        .sort-status {
             text-align: center;
             padding: 15px;
             background: rgba(255, 255, 255, 0.15);
@@ -3493,107 +4672,107 @@ def generate_html_report(analyses, target_date, chart_files=None):
             font-size: 14px;
             border: 1px solid rgba(255, 255, 255, 0.2);
             backdrop-filter: blur(10px);
-        }}
+        }
 
-        .sort-status .status-icon {{
+        .sort-status .status-icon {
             font-size: 18px;
             margin-right: 8px;
-        }}
+        }
 
-        .stock-table {{
+        .stock-table {
             background: white;
             border-radius: 15px;
             overflow: hidden;
             box-shadow: 0 10px 30px rgba(0, 0, 0, 0.1);
             margin-bottom: 40px;
-        }}
+        }
 
-        .table-header {{
+        .table-header {
             background: linear-gradient(135deg, #667eea, #764ba2);
             color: white;
             padding: 20px;
             font-size: 1.3rem;
             font-weight: 600;
-        }}
+        }
 
-        table {{
+        table {
             width: 100%;
             border-collapse: collapse;
-        }}
+        }
 
-        th, td {{
+        th, td {
             padding: 15px;
             text-align: left;
             border-bottom: 1px solid #eee;
-        }}
+        }
 
-        th {{
+        th {
             background: #f8f9fa;
             font-weight: 600;
             color: #333;
             position: sticky;
             top: 0;
             z-index: 10;
-        }}
+        }
 
         /* 优化后的股票行样式 */
-        .stock-row {{
+        .stock-row {
             transition: all 0.3s ease;
             cursor: pointer;
-        }}
+        }
 
-        .stock-row:hover {{
+        .stock-row:hover {
             background: #f8f9fa;
             transform: translateX(5px);
-        }}
+        }
 
-        .stock-row.expanded {{
+        .stock-row.expanded {
             background: #e3f2fd;
             font-weight: 600;
-        }}
+        }
 
         /* 新增：详情行样式 */
-        .detail-row {{
+        .detail-row {
             display: none;
             background: #f8f9fa;
             border-left: 5px solid #667eea;
             animation: slideDown 0.5s ease-out;
-        }}
+        }
 
-        .detail-row.show {{
+        .detail-row.show {
             display: table-row;
-        }}
+        }
 
-        .detail-content {{
+        .detail-content {
             padding: 30px;
             background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
             color: white;
             border-radius: 15px;
             margin: 20px;
             position: relative;
-        }}
+        }
 
-        @keyframes slideDown {{
-            from {{
+        @keyframes slideDown {
+            from {
                 opacity: 0;
                 transform: translateY(-20px);
-            }}
-            to {{
+            }
+            to {
                 opacity: 1;
                 transform: translateY(0);
-            }}
-        }}
+            }
+        }
 
-        .detail-header {{
+        .detail-header {
             display: flex;
             justify-content: space-between;
             align-items: center;
             margin-bottom: 25px;
             padding-bottom: 15px;
             border-bottom: 2px solid rgba(255, 255, 255, 0.2);
-        }}
+        }
 
-        .close-btn {{
+        .close-btn {
             background: rgba(255, 255, 255, 0.2);
             color: white;
             border: none;
@@ -3604,65 +4783,65 @@ def generate_html_report(analyses, target_date, chart_files=None):
             font-weight: 600;
             transition: all 0.3s ease;
             backdrop-filter: blur(10px);
-        }}
+        }
 
-        .close-btn:hover {{
+        .close-btn:hover {
             background: rgba(255, 255, 255, 0.3);
             transform: scale(1.05);
-        }}
+        }
 
-        .analysis-grid {{
+        .analysis-grid {
             display: grid;
             grid-template-columns: repeat(auto-fit, minmax(300px, 1fr));
             gap: 20px;
             margin-bottom: 20px;
-        }}
+        }
 
-        .analysis-card {{
+        .analysis-card {
             background: rgba(255, 255, 255, 0.1);
             padding: 20px;
             border-radius: 12px;
             backdrop-filter: blur(10px);
             border: 1px solid rgba(255, 255, 255, 0.2);
             transition: transform 0.3s ease;
-        }}
+        }
 
-        .analysis-card:hover {{
+        .analysis-card:hover {
             transform: translateY(-3px);
             background: rgba(255, 255, 255, 0.15);
-        }}
+        }
 
-        .analysis-card h3 {{
+        .analysis-card h3 {
             color: #fff;
             margin-bottom: 15px;
             font-size: 1.2rem;
             border-bottom: 2px solid rgba(255, 255, 255, 0.3);
             padding-bottom: 8px;
-        }}
+        }
 
-        .analysis-card p {{
+        .analysis-card p {
             margin-bottom: 8px;
             line-height: 1.5;
-        }}
+        }
 
-        .chart-section {{
+        .chart-section {
             margin: 20px 0;
             text-align: center;
             background: rgba(255, 255, 255, 0.1);
             padding: 20px;
             border-radius: 12px;
             backdrop-filter: blur(10px);
-        }}
+        }
 
-        .chart-image {{
+        .chart-image {
             max-width: 100%;
             height: auto;
             border-radius: 10px;
             box-shadow: 0 5px 15px rgba(0, 0, 0, 0.3);
             margin: 10px 0;
-        }}
+        }
 
-        .signal-badge {{
+        .signal-badge {
             padding: 6px 12px;
             border-radius: 20px;
             font-size: 0.85rem;
@@ -3670,46 +4849,46 @@ def generate_html_report(analyses, target_date, chart_files=None):
             display: inline-block;
             text-align: center;
             min-width: 80px;
-        }}
+        }
 
-        .signal-s {{ 
+        .signal-s { 
             background: linear-gradient(135deg, #ff4757, #ff3742); 
             color: white; 
             box-shadow: 0 2px 10px rgba(255, 71, 87, 0.3);
-        }}
-        .signal-a {{ 
+        }
+        .signal-a { 
             background: linear-gradient(135deg, #ff7f50, #ff6348); 
             color: white; 
             box-shadow: 0 2px 10px rgba(255, 127, 80, 0.3);
-        }}
-        .signal-b {{ 
+        }
+        .signal-b { 
             background: linear-gradient(135deg, #ffa502, #ff9500); 
             color: white; 
             box-shadow: 0 2px 10px rgba(255, 165, 2, 0.3);
-        }}
-        .signal-c {{ 
+        }
+        .signal-c { 
             background: linear-gradient(135deg, #a4b0be, #9c88a4); 
             color: white; 
             box-shadow: 0 2px 10px rgba(164, 176, 190, 0.3);
-        }}
+        }
 
-        .probability-bar {{
+        .probability-bar {
             width: 100%;
             height: 8px;
             background: #e9ecef;
             border-radius: 4px;
             overflow: hidden;
             margin-top: 5px;
-        }}
+        }
 
-        .probability-fill {{
+        .probability-fill {
             height: 100%;
             background: linear-gradient(90deg, #667eea, #764ba2);
             border-radius: 4px;
             transition: width 0.3s ease;
-        }}
+        }
 
-        .action-button {{
+        .action-button {
             background: linear-gradient(135deg, #667eea, #764ba2);
             color: white;
             border: none;
@@ -3722,9 +4901,9 @@ def generate_html_report(analyses, target_date, chart_files=None):
             transition: all 0.3s ease;
             position: relative;
             overflow: hidden;
-        }}
+        }
 
-        .action-button::before {{
+        .action-button::before {
             content: '';
             position: absolute;
             top: 0;
@@ -3733,30 +4912,30 @@ def generate_html_report(analyses, target_date, chart_files=None):
             height: 100%;
             background: linear-gradient(90deg, transparent, rgba(255, 255, 255, 0.2), transparent);
             transition: left 0.5s;
-        }}
+        }
 
-        .action-button:hover {{
+        .action-button:hover {
             transform: translateY(-2px);
             box-shadow: 0 6px 20px rgba(102, 126, 234, 0.4);
-        }}
+        }
 
-        .action-button:hover::before {{
+        .action-button:hover::before {
             left: 100%;
-        }}
+        }
 
-        .action-button.active {{
+        .action-button.active {
             background: linear-gradient(135deg, #ff4757, #ff3742);
-        }}
+        }
 
-        .footer {{
+        .footer {
             text-align: center;
             padding: 30px;
             background: #f8f9fa;
             border-radius: 15px;
             margin-top: 40px;
-        }}
+        }
 
-        .search-box {{
+        .search-box {
             margin-bottom: 20px;
             padding: 15px;
             border: 2px solid #ddd;
@@ -3765,15 +4944,15 @@ def generate_html_report(analyses, target_date, chart_files=None):
             width: 100%;
             max-width: 400px;
             transition: border-color 0.3s ease;
-        }}
+        }
 
-        .search-box:focus {{
+        .search-box:focus {
             border-color: #667eea;
             outline: none;
             box-shadow: 0 0 10px rgba(102, 126, 234, 0.2);
-        }}
+        }
 
-        .back-to-top {{
+        .back-to-top {
             position: fixed;
             bottom: 30px;
             right: 30px;
@@ -3788,74 +4967,74 @@ def generate_html_report(analyses, target_date, chart_files=None):
             z-index: 1000;
             transition: all 0.3s ease;
             display: none;
-        }}
+        }
 
-        .back-to-top:hover {{
+        .back-to-top:hover {
             transform: translateY(-3px);
             box-shadow: 0 6px 20px rgba(102, 126, 234, 0.4);
-        }}
+        }
 
         /* 四维结构分析专用样式 */
-        .four-dimensional-section {{
+        .four-dimensional-section {
             background: rgba(255, 255, 255, 0.1);
             padding: 20px;
             border-radius: 12px;
             margin: 15px 0;
             backdrop-filter: blur(10px);
-        }}
+        }
 
-        .dimension-card {{
+        .dimension-card {
             background: rgba(255, 255, 255, 0.05);
             padding: 15px;
             border-radius: 10px;
             margin: 10px 0;
             border: 1px solid rgba(255, 255, 255, 0.1);
-        }}
+        }
 
-        .structure-badge {{
+        .structure-badge {
             padding: 8px 16px;
             border-radius: 25px;
             font-size: 0.9rem;
             font-weight: 600;
             margin: 5px;
             display: inline-block;
-        }}
+        }
 
-        .structure-strong {{ background: #28a745; color: white; }}
-        .structure-medium {{ background: #ffc107; color: black; }}
-        .structure-weak {{ background: #dc3545; color: white; }}
+        .structure-strong { background: #28a745; color: white; }
+        .structure-medium { background: #ffc107; color: black; }
+        .structure-weak { background: #dc3545; color: white; }
 
-        .level-indicator {{
+        .level-indicator {
             display: inline-block;
             padding: 4px 8px;
             border-radius: 12px;
             font-size: 0.8rem;
             margin: 2px;
-        }}
+        }
 
-        .level-high {{ background: #ff4757; color: white; }}
-        .level-medium {{ background: #ffa502; color: white; }}
-        .level-low {{ background: #a4b0be; color: white; }}
+        .level-high { background: #ff4757; color: white; }
+        .level-medium { background: #ffa502; color: white; }
+        .level-low { background: #a4b0be; color: white; }
 
         /* 滚动动画 */
-        .highlight-section {{
+        .highlight-section {
             border: 3px solid #667eea;
             border-radius: 15px;
             animation: highlightBorder 2s ease-in-out;
-        }}
+        }
 
-        @keyframes highlightBorder {{
-            0% {{ border-color: #667eea; }}
-            50% {{ border-color: #ff4757; }}
-            100% {{ border-color: #667eea; }}
-        }}
+        @keyframes highlightBorder {
+            0% { border-color: #667eea; }
+            50% { border-color: #ff4757; }
+            100% { border-color: #667eea; }
+        }
 
         /* 排序过渡动画 */
-        .table-row-transition {{
+        .table-row-transition {
             transition: all 0.5s ease;
-        }}
+        }
 
-        .sorting-indicator {{
+        .sorting-indicator {
             position: fixed;
             top: 50%;
             left: 50%;
@@ -3868,53 +5047,53 @@ def generate_html_report(analyses, target_date, chart_files=None):
             font-weight: 600;
             z-index: 9999;
             display: none;
-        }}
+        }
 
         /* 【新增】60日最大盈利相关样式 */
-        .profit-badge {{
+        .profit-badge {
             padding: 4px 8px;
             border-radius: 12px;
             font-size: 0.8rem;
             font-weight: 600;
             margin: 2px;
             display: inline-block;
-        }}
+        }
 
-        .profit-high {{ background: #28a745; color: white; }}
-        .profit-medium {{ background: #ffc107; color: black; }}
-        .profit-low {{ background: #dc3545; color: white; }}
-        .profit-none {{ background: #6c757d; color: white; }}
+        .profit-high { background: #28a745; color: white; }
+        .profit-medium { background: #ffc107; color: black; }
+        .profit-low { background: #dc3545; color: white; }
+        .profit-none { background: #6c757d; color: white; }
 
         /* 情绪分析相关样式 */
-        .emotion-badge {{
+        .emotion-badge {
             padding: 4px 8px;
             border-radius: 12px;
             font-size: 0.8rem;
             font-weight: 600;
             margin: 2px;
             display: inline-block;
-        }}
+        }
 
-        .emotion-乐观 {{ background: #28a745; color: white; }}
-        .emotion-悲观 {{ background: #dc3545; color: white; }}
-        .emotion-中性 {{ background: #6c757d; color: white; }}
-        .emotion-积极 {{ background: #20c997; color: white; }}
-        .emotion-消极 {{ background: #e83e8c; color: white; }}
+        .emotion-乐观 { background: #28a745; color: white; }
+        .emotion-悲观 { background: #dc3545; color: white; }
+        .emotion-中性 { background: #6c757d; color: white; }
+        .emotion-积极 { background: #20c997; color: white; }
+        .emotion-消极 { background: #e83e8c; color: white; }
 
-        .emotion-section {{
+        .emotion-section {
             background: rgba(255, 255, 255, 0.1);
             padding: 20px;
             border-radius: 12px;
             margin: 15px 0;
             backdrop-filter: blur(10px);
-        }}
+        }
 
-        .emotion-positive {{ background: #28a745; color: white; }}
-        .emotion-negative {{ background: #dc3545; color: white; }}
-        .emotion-neutral {{ background: #6c757d; color: white; }}
+        .emotion-positive { background: #28a745; color: white; }
+        .emotion-negative { background: #dc3545; color: white; }
+        .emotion-neutral { background: #6c757d; color: white; }
 
         /* 总市值标识样式 */
-        .market-cap-badge {{
+        .market-cap-badge {
             display: inline-block;
             padding: 4px 8px;
             border-radius: 6px;
@@ -3922,82 +5101,83 @@ def generate_html_report(analyses, target_date, chart_files=None):
             font-size: 0.875rem;
             text-align: center;
             min-width: 60px;
-        }}
+        }
 
-        .market-cap-huge {{
+        .market-cap-huge {
             background-color: #7c3aed;
             color: white;
-        }}
+        }
 
-        .market-cap-large {{
+        .market-cap-large {
             background-color: #2563eb;
             color: white;
-        }}
+        }
 
-        .market-cap-medium {{
+        .market-cap-medium {
             background-color: #059669;
             color: white;
-        }}
+        }
 
-        .market-cap-small {{
+        .market-cap-small {
             background-color: #dc2626;
             color: white;
-        }}
+        }
 
-        .market-cap-micro {{
+        .market-cap-micro {
             background-color: #9ca3af;
             color: white;
-        }}
+        }
 
-        .market-cap-unknown {{
+        .market-cap-unknown {
             background-color: #6b7280;
             color: #f3f4f6;
-        }}
+        }
 
-        @media (max-width: 768px) {{
-            .container {{
+        @media (max-width: 768px) {
+            .container {
                 padding: 15px;
                 margin: 10px;
-            }}
+            }
 
-            .header h1 {{
+            .header h1 {
                 font-size: 2rem;
-            }}
+            }
 
-            .stats-grid {{
+            .stats-grid {
                 grid-template-columns: 1fr;
-            }}
+            }
 
-            .sort-buttons {{
+            .sort-buttons {
                 grid-template-columns: 1fr;
-            }}
+            }
 
-            table {{
+            table {
                 font-size: 0.9rem;
-            }}
+            }
 
-            th, td {{
+            th, td {
                 padding: 10px 8px;
-            }}
+            }
 
-            .analysis-grid {{
+            .analysis-grid {
                 grid-template-columns: 1fr;
-            }}
+            }
 
-            .detail-content {{
+            .detail-content {
                 margin: 10px;
                 padding: 20px;
-            }}
+            }
 
-            .back-to-top {{
+            .back-to-top {
                 bottom: 20px;
                 right: 20px;
                 padding: 12px;
                 font-size: 16px;
-            }}
-        }}
-    </style>
-    <script>
+            }
+        }
+"""
+# 报告脚本中的 __PLOTLY_JS_URL__ 在生成资源时替换为 PLOTLY_JS_URL
+REPORT_SCRIPT = """
         // 全局变量
         let currentSortField = 'market_cap';
         let currentSortDirection = 'asc';
@@ -4006,29 +5186,29 @@ def generate_html_report(analyses, target_date, chart_files=None):
         let activeDetailRow = null;
 
         // 新增：雪球跳转功能
-        function openXueqiu(stockCode) {{
-            try {{
+        function openXueqiu(stockCode) {
+            try {
                 // 转换股票代码格式：从 "002413.SZ" 转换为 "SZ002413"
                 let xueqiuCode = '';
 
-                if (stockCode.endsWith('.SZ')) {{
+                if (stockCode.endsWith('.SZ')) {
                     // 深交所股票
                     xueqiuCode = 'SZ' + stockCode.replace('.SZ', '');
-                }} else if (stockCode.endsWith('.SH')) {{
+                } else if (stockCode.endsWith('.SH')) {
                     // 上交所股票
                     xueqiuCode = 'SH' + stockCode.replace('.SH', '');
-                }} else {{
+                } else {
                     // 其他情况直接使用原代码
                     xueqiuCode = stockCode;
-                }}
+                }
 
                 // 构建雪球URL
-                const xueqiuUrl = `https://xueqiu.com/S/${{xueqiuCode}}`;
+                const xueqiuUrl = `https://xueqiu.com/S/${xueqiuCode}`;
 
                 // 在新窗口中打开雪球页面
                 window.open(xueqiuUrl, '_blank');
 
-                console.log(`✅ 已打开雪球链接: ${{xueqiuUrl}}`);
+                console.log(`✅ 已打开雪球链接: ${xueqiuUrl}`);
 
                 // 显示成功提示（可选）
                 const notification = document.createElement('div');
@@ -4037,112 +5217,222 @@ def generate_html_report(analyses, target_date, chart_files=None):
                     background: #28a745; color: white; padding: 10px 20px;
                     border-radius: 5px; font-size: 14px; opacity: 0.9;
                 `;
-                notification.textContent = `已打开 ${{stockCode}} 的雪球页面`;
+                notification.textContent = `已打开 ${stockCode} 的雪球页面`;
                 document.body.appendChild(notification);
                 setTimeout(() => document.body.removeChild(notification), 2000);
 
-            }} catch (error) {{
+            } catch (error) {
                 console.error('❌ 打开雪球链接时出错:', error);
-                alert(`抱歉，无法打开 ${{stockCode}} 的雪球链接，请检查网络连接。`);
-            }}
-        }}
+                alert(`抱歉，无法打开 ${stockCode} 的雪球链接，请检查网络连接。`);
+            }
+        }
 
         // 显示雪球跳转提示
-        function showXueqiuTooltip(element, stockCode, stockName) {{
+        function showXueqiuTooltip(element, stockCode, stockName) {
             let xueqiuCode = '';
-            if (stockCode.endsWith('.SZ')) {{
+            if (stockCode.endsWith('.SZ')) {
                 xueqiuCode = 'SZ' + stockCode.replace('.SZ', '');
-            }} else if (stockCode.endsWith('.SH')) {{
+            } else if (stockCode.endsWith('.SH')) {
                 xueqiuCode = 'SH' + stockCode.replace('.SH', '');
-            }} else {{
+            } else {
                 xueqiuCode = stockCode;
-            }}
+            }
 
             // 更新提示文本
             const tooltip = element.querySelector('.tooltiptext');
-            if (tooltip) {{
-                tooltip.textContent = `点击查看 ${{stockName}} 在雪球的最新信息`;
-            }}
-        }}
+            if (tooltip) {
+                tooltip.textContent = `点击查看 ${stockName} 在雪球的最新信息`;
+            }
+        }
 
         // 排序指示器
-        function showSortingIndicator(text) {{
+        function showSortingIndicator(text) {
             const indicator = document.getElementById('sortingIndicator');
             indicator.textContent = text;
             indicator.style.display = 'block';
-        }}
+        }
 
-        function hideSortingIndicator() {{
+        function hideSortingIndicator() {
             const indicator = document.getElementById('sortingIndicator');
             indicator.style.display = 'none';
-        }}
+        }
 
         // 搜索功能
-        function searchStocks() {{
+        function searchStocks() {
             const input = document.getElementById('searchInput');
             const filter = input.value.toUpperCase();
             const table = document.getElementById('stockTable');
             const tr = table.getElementsByTagName('tr');
 
-            for (let i = 1; i < tr.length; i++) {{
+            for (let i = 1; i < tr.length; i++) {
                 // 跳过详情行
-                if (tr[i].classList.contains('detail-row')) {{
+                if (tr[i].classList.contains('detail-row')) {
                     continue;
-                }}
+                }
 
                 const td = tr[i].getElementsByTagName('td')[0];
                 const td2 = tr[i].getElementsByTagName('td')[1];
-                if (td || td2) {{
+                if (td || td2) {
                     const txtValue = (td.textContent || td.innerText) + (td2.textContent || td2.innerText);
-                    if (txtValue.toUpperCase().indexOf(filter) > -1) {{
+                    if (txtValue.toUpperCase().indexOf(filter) > -1) {
                         tr[i].style.display = '';
                         // 如果对应的详情行是展开的，也显示
                         const nextRow = tr[i].nextElementSibling;
-                        if (nextRow && nextRow.classList.contains('detail-row') && nextRow.classList.contains('show')) {{
+                        if (nextRow && nextRow.classList.contains('detail-row') && nextRow.classList.contains('show')) {
                             nextRow.style.display = 'table-row';
-                        }}
-                    }} else {{
+                        }
+                    } else {
                         tr[i].style.display = 'none';
                         // 隐藏对应的详情行
                         const nextRow = tr[i].nextElementSibling;
-                        if (nextRow && nextRow.classList.contains('detail-row')) {{
+                        if (nextRow && nextRow.classList.contains('detail-row')) {
                             nextRow.style.display = 'none';
-                        }}
-                    }}
-                }}
-            }}
-        }}
+                        }
+                    }
+                }
+            }
+        }
+
+        // 交互式图表：首次展开详情时才加载 plotly.js，并由详情中内嵌的JSON数据绘制
+        let plotlyLoader = null;
+        function loadPlotly() {
+            if (window.Plotly) return Promise.resolve(window.Plotly);
+            if (!plotlyLoader) {
+                plotlyLoader = new Promise((resolve, reject) => {
+                    const script = document.createElement('script');
+                    script.src = '__PLOTLY_JS_URL__';
+                    script.onload = () => resolve(window.Plotly);
+                    script.onerror = () => {
+                        plotlyLoader = null;
+                        reject(new Error('plotly.js 加载失败'));
+                    };
+                    document.head.appendChild(script);
+                });
+            }
+            return plotlyLoader;
+        }
+
+        function renderInteractiveChart(stockCode) {
+            const key = stockCode.replace('.', '_');
+            const container = document.getElementById(`chart_${key}`);
+            const source = document.getElementById(`chart_data_${key}`);
+            if (!container || !source || container.dataset.rendered) return;
+            container.dataset.rendered = '1';
+
+            const d = JSON.parse(source.textContent);
+            const n = d.date.length;
+            const line = (y, name, color, width, dash) => ({
+                type: 'scatter', mode: 'lines', x: d.date, y: y, name: name,
+                line: {color: color, width: width, dash: dash}
+            });
+            const level = (y, name, color, dash) => line([y, y], name, color, 2, dash);
+            // Setup/Countdown 序号：买入标在最低价下方，卖出标在最高价上方
+            const marks = (values, buy, prefix, gap, symbol, color, name) => {
+                const idx = values.map((v, i) => i).filter(i => buy ? values[i] > 0 : values[i] < 0);
+                return {
+                    type: 'scatter', mode: 'markers+text', name: name,
+                    x: idx.map(i => d.date[i]),
+                    y: idx.map(i => buy ? d.low[i] * (1 - gap) : d.high[i] * (1 + gap)),
+                    text: idx.map(i => prefix + Math.abs(values[i])),
+                    textposition: buy ? 'bottom center' : 'top center',
+                    textfont: {color: color, size: 10},
+                    marker: {symbol: symbol, size: 9, color: color}
+                };
+            };
+
+            const traces = [
+                {
+                    type: 'candlestick', name: 'K线', x: d.date,
+                    open: d.open, high: d.high, low: d.low, close: d.close,
+                    increasing: {line: {color: 'red'}}, decreasing: {line: {color: 'green'}}
+                },
+                marks(d.setup, true, '', 0.005, 'circle', 'blue', '买入Setup'),
+                marks(d.setup, false, '', 0.005, 'triangle-down', 'red', '卖出Setup'),
+                marks(d.countdown, true, 'C', 0.01, 'square', 'darkblue', '买入Countdown'),
+                marks(d.countdown, false, 'C', 0.01, 'square', 'darkred', '卖出Countdown'),
+                {
+                    type: 'bar', name: '成交量(万手)', x: d.date, y: d.vol, yaxis: 'y2', opacity: 0.6,
+                    marker: {color: d.close.map((c, i) => c >= d.open[i] ? 'red' : 'green')}
+                }
+            ];
+            if (d.ma5) traces.push(line(d.ma5, 'MA5', 'purple', 1));
+            if (d.ma10) traces.push(line(d.ma10, 'MA10', 'orange', 1));
+            if (d.ma20) traces.push(line(d.ma20, 'MA20', 'blue', 2));
+            const ends = [d.date[0], d.date[n - 1]];
+            const levels = [
+                [d.tdst_support, 'TDST支撑', 'green', 'dash'], [d.tdst_resistance, 'TDST阻力', 'red', 'dash'],
+                [d.support, '技术支撑', 'blue', 'dot'], [d.resistance, '技术阻力', 'red', 'dot']
+            ];
+            levels.filter(([y]) => y > 0).forEach(([y, name, color, dash]) => {
+                traces.push(Object.assign(level(y, name, color, dash), {x: ends}));
+            });
+
+            const annotations = d.perfected.map(i => ({
+                x: d.date[i], y: d.high[i], text: '★ 完美设置', ax: 10, ay: -30,
+                font: {color: 'gold', size: 11}, bgcolor: 'purple', arrowcolor: 'purple'
+            }));
+            d.setup.forEach((v, i) => {
+                if (Math.abs(v) === 9) annotations.push({
+                    x: d.date[i], y: v > 0 ? d.low[i] : d.high[i], text: 'Setup 9!', ax: 20, ay: v > 0 ? 40 : -40,
+                    font: {color: v > 0 ? 'blue' : 'red'}, bgcolor: 'yellow'
+                });
+            });
+            d.countdown.forEach((v, i) => {
+                if (Math.abs(v) === 13) annotations.push({
+                    x: d.date[i], y: v > 0 ? d.low[i] : d.high[i], text: 'Countdown 13!', ax: -30, ay: v > 0 ? 50 : -50,
+                    font: {color: v > 0 ? 'darkblue' : 'darkred'}, bgcolor: 'gold'
+                });
+            });
+
+            const layout = {
+                title: {text: d.title, font: {size: 15}},
+                height: 640, margin: {l: 60, r: 20, t: 50, b: 40},
+                paper_bgcolor: 'white', plot_bgcolor: 'white', showlegend: true,
+                legend: {orientation: 'h', y: 1.02, yanchor: 'bottom', font: {size: 11}},
+                xaxis: {type: 'category', anchor: 'y2', nticks: 12, rangeslider: {visible: false}},
+                yaxis: {domain: [0.3, 1], title: {text: '价格 (¥,前复权)'}, gridcolor: '#eee'},
+                yaxis2: {domain: [0, 0.22], title: {text: '成交量 (万手)'}, gridcolor: '#eee'},
+                annotations: annotations
+            };
+
+            loadPlotly()
+                .then(Plotly => Plotly.newPlot(container, traces, layout, {responsive: true, displaylogo: false}))
+                .catch(error => {
+                    container.dataset.rendered = '';
+                    container.innerHTML = `<p style="padding: 20px; text-align: center;">📊 ${error.message}，请检查网络后重新展开详情</p>`;
+                });
+        }
 
         // 优化后的显示详情功能
-        function toggleDetails(stockCode) {{
-            const stockRow = document.querySelector(`[data-stock-code="${{stockCode}}"]`);
-            const detailRow = document.getElementById(`detail_${{stockCode.replace('.', '_')}}`);
+        function toggleDetails(stockCode) {
+            const stockRow = document.querySelector(`[data-stock-code="${stockCode}"]`);
+            const detailRow = document.getElementById(`detail_${stockCode.replace('.', '_')}`);
             const actionButton = stockRow.querySelector('.action-button');
 
-            if (!detailRow) {{
+            if (!detailRow) {
                 console.error('Detail row not found for:', stockCode);
                 return;
-            }}
+            }
 
             // 如果当前有其他展开的详情，先关闭
-            if (activeDetailRow && activeDetailRow !== detailRow) {{
+            if (activeDetailRow && activeDetailRow !== detailRow) {
                 activeDetailRow.classList.remove('show');
                 activeDetailRow.style.display = 'none';
 
                 // 重置之前的按钮状态
                 const prevStockRow = activeDetailRow.previousElementSibling;
-                if (prevStockRow) {{
+                if (prevStockRow) {
                     prevStockRow.classList.remove('expanded');
                     const prevButton = prevStockRow.querySelector('.action-button');
-                    if (prevButton) {{
+                    if (prevButton) {
                         prevButton.classList.remove('active');
                         prevButton.textContent = prevButton.textContent.replace('🔽 收起详情', '📋 查看详情');
-                    }}
-                }}
-            }}
+                    }
+                }
+            }
 
             // 切换当前详情行
-            if (detailRow.classList.contains('show')) {{
+            if (detailRow.classList.contains('show')) {
                 // 收起详情
                 detailRow.classList.remove('show');
                 detailRow.style.display = 'none';
@@ -4150,7 +5440,7 @@ def generate_html_report(analyses, target_date, chart_files=None):
                 actionButton.classList.remove('active');
                 actionButton.textContent = actionButton.textContent.replace('🔽 收起详情', '📋 查看详情');
                 activeDetailRow = null;
-            }} else {{
+            } else {
                 // 展开详情
                 detailRow.classList.add('show');
                 detailRow.style.display = 'table-row';
@@ -4158,59 +5448,60 @@ def generate_html_report(analyses, target_date, chart_files=None):
                 actionButton.classList.add('active');
                 actionButton.textContent = actionButton.textContent.replace('📋 查看详情', '🔽 收起详情');
                 activeDetailRow = detailRow;
+                renderInteractiveChart(stockCode);
 
                 // 平滑滚动到详情区域
-                setTimeout(() => {{
-                    detailRow.scrollIntoView({{
+                setTimeout(() => {
+                    detailRow.scrollIntoView({
                         behavior: 'smooth',
                         block: 'center'
-                    }});
-                }}, 100);
-            }}
-        }}
+                    });
+                }, 100);
+            }
+        }
 
         // 关闭详情功能
-        function closeDetails(stockCode) {{
-            const detailRow = document.getElementById(`detail_${{stockCode.replace('.', '_')}}`);
-            const stockRow = document.querySelector(`[data-stock-code="${{stockCode}}"]`);
+        function closeDetails(stockCode) {
+            const detailRow = document.getElementById(`detail_${stockCode.replace('.', '_')}`);
+            const stockRow = document.querySelector(`[data-stock-code="${stockCode}"]`);
 
-            if (detailRow && stockRow) {{
+            if (detailRow && stockRow) {
                 detailRow.classList.remove('show');
                 detailRow.style.display = 'none';
                 stockRow.classList.remove('expanded');
 
                 const actionButton = stockRow.querySelector('.action-button');
-                if (actionButton) {{
+                if (actionButton) {
                     actionButton.classList.remove('active');
                     actionButton.textContent = actionButton.textContent.replace('🔽 收起详情', '📋 查看详情');
-                }}
+                }
 
                 activeDetailRow = null;
 
                 // 滚动回股票行
-                stockRow.scrollIntoView({{
+                stockRow.scrollIntoView({
                     behavior: 'smooth',
                     block: 'center'
-                }});
-            }}
-        }}
+                });
+            }
+        }
 
         // 回到顶部
-        function scrollToTop() {{
-            window.scrollTo({{
+        function scrollToTop() {
+            window.scrollTo({
                 top: 0,
                 behavior: 'smooth'
-            }});
-        }}
+            });
+        }
 
         // 增强版智能排序功能（新增支持60日最大盈利排序）
-        function smartSort(field, forceDirection = null) {{
+        function smartSort(field, forceDirection = null) {
             if (sortingInProgress) return;
             sortingInProgress = true;
 
             showSortingIndicator('🎛️ 智能排序中，请稍候...');
 
-            setTimeout(() => {{
+            setTimeout(() => {
                 const table = document.getElementById('stockTable');
                 const tbody = table.getElementsByTagName('tbody')[0];
                 const rows = Array.from(tbody.getElementsByTagName('tr'));
@@ -4219,39 +5510,39 @@ def generate_html_report(analyses, target_date, chart_files=None):
                 const stockRows = [];
                 const detailRowsMap = new Map();
 
-                for (let i = 0; i < rows.length; i++) {{
+                for (let i = 0; i < rows.length; i++) {
                     const row = rows[i];
-                    if (row.classList.contains('detail-row')) {{
+                    if (row.classList.contains('detail-row')) {
                         // 详情行，找到对应的股票行
                         const stockRow = rows[i - 1];
-                        if (stockRow && !stockRow.classList.contains('detail-row')) {{
+                        if (stockRow && !stockRow.classList.contains('detail-row')) {
                             detailRowsMap.set(stockRow, row);
-                        }}
-                    }} else {{
+                        }
+                    } else {
                         // 股票行
                         stockRows.push(row);
-                    }}
-                }}
+                    }
+                }
 
                 // 确定排序方向
                 let direction = forceDirection;
-                if (!direction) {{
-                    if (currentSortField === field) {{
+                if (!direction) {
+                    if (currentSortField === field) {
                         direction = currentSortDirection === 'asc' ? 'desc' : 'asc';
-                    }} else {{
+                    } else {
                         // 默认排序方向
                         const defaultAscFields = ['price', 'market_cap'];
                         direction = defaultAscFields.includes(field) ? 'asc' : 'desc';
-                    }}
-                }}
+                    }
+                }
 
                 // 排序股票行
-                stockRows.sort((a, b) => {{
+                stockRows.sort((a, b) => {
                     let aVal, bVal;
 
-                    switch(field) {{
+                    switch(field) {
                         case 'signal_grade':
-                            const gradeOrder = {{'S': 4, 'A': 3, 'B': 2, 'C': 1}};
+                            const gradeOrder = {'S': 4, 'A': 3, 'B': 2, 'C': 1};
                             aVal = gradeOrder[a.dataset.signalGrade] || 0;
                             bVal = gradeOrder[b.dataset.signalGrade] || 0;
                             break;
@@ -4289,32 +5580,32 @@ def generate_html_report(analyses, target_date, chart_files=None):
                             break;
                         default:
                             return 0;
-                    }}
+                    }
 
-                    if (direction === 'asc') {{
+                    if (direction === 'asc') {
                         return aVal - bVal;
-                    }} else {{
+                    } else {
                         return bVal - aVal;
-                    }}
-                }});
+                    }
+                });
 
                 // 重新插入表格（带动画效果）
                 tbody.style.opacity = '0.5';
-                setTimeout(() => {{
+                setTimeout(() => {
                     // 清空tbody
                     tbody.innerHTML = '';
 
                     // 重新插入排序后的股票行和对应的详情行
-                    stockRows.forEach(stockRow => {{
+                    stockRows.forEach(stockRow => {
                         tbody.appendChild(stockRow);
                         const detailRow = detailRowsMap.get(stockRow);
-                        if (detailRow) {{
+                        if (detailRow) {
                             tbody.appendChild(detailRow);
-                        }}
-                    }});
+                        }
+                    });
 
                     tbody.style.opacity = '1';
-                }}, 300);
+                }, 300);
 
                 // 更新状态
                 currentSortField = field;
@@ -4326,39 +5617,39 @@ def generate_html_report(analyses, target_date, chart_files=None):
                 // 更新排序状态显示
                 updateSortStatus();
 
-                setTimeout(() => {{
+                setTimeout(() => {
                     hideSortingIndicator();
                     sortingInProgress = false;
-                }}, 800);
-            }}, 200);
-        }}
+                }, 800);
+            }, 200);
+        }
 
         // 更新排序按钮状态
-        function updateSortButtons() {{
+        function updateSortButtons() {
             const buttons = document.querySelectorAll('.sort-button');
-            buttons.forEach(btn => {{
+            buttons.forEach(btn => {
                 btn.classList.remove('active');
                 const arrow = btn.querySelector('.arrow');
-                if (arrow) {{
+                if (arrow) {
                     arrow.textContent = '↕️';
-                }}
-            }});
+                }
+            });
 
             // 激活当前排序按钮
-            const activeBtn = document.querySelector(`[data-sort="${{currentSortField}}"]`);
-            if (activeBtn) {{
+            const activeBtn = document.querySelector(`[data-sort="${currentSortField}"]`);
+            if (activeBtn) {
                 activeBtn.classList.add('active');
                 const arrow = activeBtn.querySelector('.arrow');
-                if (arrow) {{
+                if (arrow) {
                     arrow.textContent = currentSortDirection === 'asc' ? '↑' : '↓';
-                }}
-            }}
-        }}
+                }
+            }
+        }
 
         // 更新排序状态显示
-        function updateSortStatus() {{
+        function updateSortStatus() {
             const statusDiv = document.getElementById('sortStatus');
-            const fieldNames = {{
+            const fieldNames = {
                 'signal_grade': '信号等级',
                 'probability': '反转概率',
                 'price': '股价',
@@ -4368,26 +5659,26 @@ def generate_html_report(analyses, target_date, chart_files=None):
                 'risk_level': '风险等级',
                 'td_score': 'TD评分',
                 'max_profit': '60日最大盈利'
-            }};
+            };
 
             const fieldName = fieldNames[currentSortField] || currentSortField;
             const directionText = currentSortDirection === 'asc' ? '升序' : '降序';
 
-            statusDiv.innerHTML = `<span class="status-icon">📊</span>当前排序：<strong>${{fieldName}}</strong> (${{directionText}}) | 点击任意排序按钮切换排序方式 | 🔗 点击股票名称或代码查看雪球信息`;
-        }}
+            statusDiv.innerHTML = `<span class="status-icon">📊</span>当前排序：<strong>${fieldName}</strong> (${directionText}) | 点击任意排序按钮切换排序方式 | 🔗 点击股票名称或代码查看雪球信息`;
+        }
 
         // 显示/隐藏回到顶部按钮
-        window.onscroll = function() {{
+        window.onscroll = function() {
             const backToTopBtn = document.getElementById('backToTopBtn');
-            if (document.body.scrollTop > 300 || document.documentElement.scrollTop > 300) {{
+            if (document.body.scrollTop > 300 || document.documentElement.scrollTop > 300) {
                 backToTopBtn.style.display = 'block';
-            }} else {{
+            } else {
                 backToTopBtn.style.display = 'none';
-            }}
-        }};
+            }
+        };
 
         // 页面加载完成后的初始化
-        document.addEventListener('DOMContentLoaded', function() {{
+        document.addEventListener('DOMContentLoaded', function() {
             // 保存原始顺序
             const table = document.getElementById('stockTable');
             const tbody = table.getElementsByTagName('tbody')[0];
@@ -4401,13 +5692,13 @@ def generate_html_report(analyses, target_date, chart_files=None):
 
             // 初始化雪球跳转提示
             const stockLinks = document.querySelectorAll('.stock-link');
-            stockLinks.forEach(link => {{
-                link.addEventListener('mouseenter', function() {{
+            stockLinks.forEach(link => {
+                link.addEventListener('mouseenter', function() {
                     const stockCode = this.dataset.stockCode;
                     const stockName = this.dataset.stockName;
                     showXueqiuTooltip(this.parentElement, stockCode, stockName);
-                }});
-            }});
+                });
+            });
 
             // 添加雪球跳转使用提示
             console.log('🔗 雪球跳转功能说明：');
@@ -4427,8 +5718,99 @@ def generate_html_report(analyses, target_date, chart_files=None):
             console.log('• 使用前复权数据计算，消除除权除息影响');
             console.log('• 显示达到最大盈利的天数');
             console.log('• 支持按60日最大盈利排序筛选');
-        }});
-    </script>
+        });
+"""
+
+
+@lru_cache(maxsize=1)
+def get_report_assets():
+    """报告静态资源内容及带内容哈希的文件名，返回 {'css': (文件名, 内容), 'js': (文件名, 内容)}"""
+    contents = {'css': REPORT_STYLESHEET, 'js': REPORT_SCRIPT.replace('__PLOTLY_JS_URL__', PLOTLY_JS_URL)}
+    return {kind: (f"td_report.{hashlib.sha1(content.encode()).hexdigest()[:10]}.{kind}", content)
+            for kind, content in contents.items()}
+
+
+def write_report_assets(output_dir='.'):
+    """
+    在报告目录下写出共享静态资源（已存在则跳过），返回相对报告目录的引用路径 {'css': ..., 'js': ...}
+    先写临时文件再改名，并发生成多个日期的报告时不会读到不完整的文件
+    """
+    asset_dir = os.path.join(output_dir, REPORT_ASSET_DIR)
+    os.makedirs(asset_dir, exist_ok=True)
+    assets = {}
+    for kind, (filename, content) in get_report_assets().items():
+        path = os.path.join(asset_dir, filename)
+        if not os.path.exists(path):
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                f.write(content)
+            os.replace(temp_path, path)
+        assets[kind] = f"{REPORT_ASSET_DIR}/{filename}"
+    return assets
+
+
+def report_asset_tags(assets=None):
+    """报告页头中的样式和脚本：assets 为 write_report_assets 的结果时引用共享资源，否则内联"""
+    if assets:
+        return (f'    <link rel="stylesheet" href="{assets["css"]}">\n'
+                f'    <script src="{assets["js"]}"></script>')
+    resources = get_report_assets()
+    return f"    <style>{resources['css'][1]}    </style>\n    <script>{resources['js'][1]}    </script>"
+
+
+def iter_html_report(analyses, target_date, chart_files=None, table=None, order=None, assets=None):
+    """
+    逐段生成HTML可视化报告（前复权数据版本）：先产出页头、统计和重点关注部分，
+    再按 order（结果表行号，默认 report_row_order）逐只产出表格行和详情，最后产出页尾
+    table 为 build_result_table 的结果，未传入时现场生成；assets 为共享静态资源路径，未传入时内联样式和脚本
+    """
+    # 统计数据
+    total_stocks = len(analyses)
+    if table is None:
+        table = build_result_table(analyses)
+
+    # 重点关注股票（优化后标准：评分/Countdown/信心度/B级及以上信号任一满足），按综合得分排序
+    focus_stocks = [analyses[index] for index in table['index'][select_focus_rows(table, 20, 8, 45, grades='SAB')]]
+
+    # 信号等级、Setup阶段统计
+    summary = summarize_result_table(table)
+    signal_grades = summary['signal_grades']
+    setup_stats = summary['setup_stats']
+    countdown_active = summary['countdown_active']
+    avg_price = summary['avg_price']
+    grade_order = [grade.split('级')[0] for _, grade in TD_SIGNAL_GRADES] + ['C']
+    grade_text = ' · '.join(f"{grade} {signal_grades[grade]}" for grade in grade_order if grade in signal_grades)
+    setup_text = ' · '.join(f"{stage} {count}" for stage, count in setup_stats.items() if count)
+
+    # 创建图表代码映射
+    chart_map = {}
+    chart_zoom_map = {}
+    chart_data_map = {}
+    chart_dir_name = ""
+    if chart_files:
+        for chart_info in chart_files:
+            code = chart_info['analysis']['code']
+            # 交互式图表只有内嵌数据，没有图片文件
+            if 'chart_data' in chart_info:
+                chart_map[code] = None
+                chart_data_map[code] = chart_info['chart_data']
+                continue
+            chart_dir_name = chart_info['chart_dir']
+            chart_map[code] = f"{chart_dir_name}/{chart_info['chart_filename']}"
+            # 同时生成了大图档位时，点击报告内嵌的图表打开大图
+            outputs = chart_info.get('chart_outputs', {})
+            zoom_profile = next((name for name in CHART_ZOOM_PROFILES if name in outputs), None)
+            if zoom_profile and zoom_profile != CHART_REPORT_PROFILE:
+                chart_zoom_map[code] = f"{chart_dir_name}/{outputs[zoom_profile]}"
+
+    html_content = f"""
+<!DOCTYPE html>
+<html lang="zh-CN">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>增强版TD股票筛选分析报告 - {target_date}</title>
+{report_asset_tags(assets)}
 </head>
 <body>
     <div class="container">
@@ -4459,6 +5841,14 @@ def generate_html_report(analyses, target_date, chart_files=None):
                 <div class="stat-number">¥{avg_price:.2f}</div>
                 <div class="stat-label">平均股价</div>
             </div>
+            <div class="stat-card">
+                <div class="stat-number" style="font-size: 1.4rem;">{grade_text or '-'}</div>
+                <div class="stat-label">信号等级分布</div>
+            </div>
+            <div class="stat-card">
+                <div class="stat-number" style="font-size: 1.4rem;">{setup_text or '-'}</div>
+                <div class="stat-label">Setup阶段分布</div>
+            </div>
         </div>
 """
 
@@ -4567,7 +5957,7 @@ def generate_html_report(analyses, target_date, chart_files=None):
     html_content += f"""
         <div class="stock-table">
             <div class="table-header">
-                📊 筛选股票TD分析列表 ({len(valid_analyses)}只) - {len(chart_map)}只含K线图表 - 🎛️ 优化详情展示 + 8种智能排序 + 💼总市值筛选 + 🔗雪球跳转 + 💰60日最大盈利
+                📊 筛选股票TD分析列表 ({len(table)}只) - {len(chart_map)}只含K线图表 - 🎛️ 优化详情展示 + 8种智能排序 + 💼总市值筛选 + 🔗雪球跳转 + 💰60日最大盈利
             </div>
             <div style="padding: 20px;">
                 <input type="text" id="searchInput" class="search-box" onkeyup="searchStocks()" 
@@ -4593,10 +5983,14 @@ def generate_html_report(analyses, target_date, chart_files=None):
                 <tbody>
 """
 
+    yield html_content
+
     # 添加股票行和对应的详情行（紧密排列） - 修改这部分添加雪球跳转功能和60日最大盈利功能
-    for analysis in valid_analyses:
-        if 'analysis' in analysis and isinstance(analysis['analysis'], str):
-            continue
+    if order is None:
+        order = report_row_order(table)
+    for index in table['index'][order]:
+        analysis = analyses[index]
+        html_content = ""
 
         signal_class = 'signal-c'
         signal_grade_letter = 'C'
@@ -4619,10 +6013,7 @@ def generate_html_report(analyses, target_date, chart_files=None):
 
         # 计算总市值（模拟计算，实际应用中应从数据源获取）
         try:
-            # 使用股票代码生成一致的模拟股本数据
-            stock_code_hash = hash(analysis['code']) % 1000000
-            simulated_shares = 500000000 + (stock_code_hash * 100000)  # 5亿到15亿股
-            market_cap_yi = (analysis['current_price'] * simulated_shares / 100000000)  # 转换为亿元
+            market_cap_yi = estimate_market_cap_yi(analysis['code'], analysis['current_price'])
             market_cap_text = f"{market_cap_yi:.1f}亿"
 
             # 市值分类样式
@@ -4755,16 +6146,28 @@ def generate_html_report(analyses, target_date, chart_files=None):
 
         # TD技术图表部分（如果有图表）
         if chart_available:
-            chart_filename = chart_map[analysis['code']]
-            html_content += f"""
-                                <div class="chart-section">
-                                    <h3>📈 TD序列K线技术图表</h3>
-                                    <img src="{chart_filename}" alt="{analysis['name']} TD图表" class="chart-image" 
-                                         onerror="this.style.display='none'; this.nextElementSibling.style.display='block';">
+            chart_key = analysis['code'].replace('.', '_')
+            if analysis['code'] in chart_data_map:
+                # 交互式图表：数据以JSON内嵌，展开详情时由浏览器绘制
+                chart_body = f"""<div id="chart_{chart_key}" class="chart-image" style="background: white; min-height: 640px;"></div>
+                                    <script type="application/json" id="chart_data_{chart_key}">{chart_data_map[analysis['code']]}</script>"""
+            else:
+                chart_filename = chart_map[analysis['code']]
+                chart_zoom = chart_zoom_map.get(analysis['code'])
+                error_target = 'this.parentElement.nextElementSibling' if chart_zoom else 'this.nextElementSibling'
+                chart_body = f"""<img src="{chart_filename}" alt="{analysis['name']} TD图表" class="chart-image" 
+                                         onerror="this.style.display='none'; {error_target}.style.display='block';">"""
+                if chart_zoom:
+                    chart_body = f"""<a href="{chart_zoom}" target="_blank" title="点击查看大图">{chart_body}</a>"""
+                chart_body += f"""
                                     <div style="display: none; padding: 20px; background: rgba(255, 255, 255, 0.1); border-radius: 8px; text-align: center; border: 2px dashed rgba(255, 255, 255, 0.3);">
                                         <p>📊 图表文件未找到</p>
                                         <p>图表路径: {chart_filename}</p>
-                                    </div>
+                                    </div>"""
+            html_content += f"""
+                                <div class="chart-section">
+                                    <h3>📈 TD序列K线技术图表</h3>
+                                    {chart_body}
                                     <div style="margin-top: 15px; padding: 15px; background: rgba(255, 255, 255, 0.1); border-radius: 8px; text-align: left;">
                                         <h4>📋 图表说明：</h4>
                                         <div style="display: grid; grid-template-columns: repeat(auto-fit, minmax(250px, 1fr)); gap: 10px; margin-top: 10px;">
@@ -5110,8 +6513,9 @@ def generate_html_report(analyses, target_date, chart_files=None):
                         </td>
                     </tr>
 """
+        yield html_content
 
-    html_content += """
+    html_content = """
                 </tbody>
             </table>
         </div>
@@ -5257,7 +6661,25 @@ def generate_html_report(analyses, target_date, chart_files=None):
 </html>
 """
 
-    return html_content
+    yield html_content
+
+
+def generate_html_report(analyses, target_date, chart_files=None, table=None, order=None):
+    """生成完整的HTML报告字符串；写文件请使用 write_html_report，避免在内存中拼接整页"""
+    return ''.join(iter_html_report(analyses, target_date, chart_files, table, order))
+
+
+def write_html_report(html_filename, analyses, target_date, chart_files=None, table=None, order=None):
+    """流式写出HTML报告：样式和脚本引用报告目录下的共享静态资源，表格行和详情逐只写入文件"""
+    assets = write_report_assets(os.path.dirname(html_filename) or '.')
+    with open(html_filename, 'w', encoding='utf-8') as f:
+        for chunk in iter_html_report(analyses, target_date, chart_files, table, order, assets):
+            f.write(chunk)
+    return html_filename
+
+
+# 选股筛选条件：前复权股价上限（元）、换手率下限（%）、总市值下限（万元）
+SCREEN_CRITERIA = {'max_price': 10, 'min_turnover': 1.5, 'min_total_mv': 400000}
 
 
 def stock_selector(target_date=None):
@@ -5269,12 +6691,7 @@ def stock_selector(target_date=None):
 
     # 第一步：获取所有A股股票列表
     print("\n第一步：获取股票列表（排除科创板、创业板、北交所和ST股票）...")
-    with api_lock:
-        stock_list = pro.stock_basic(exchange='', list_status='L', fields='ts_code,symbol,name,area,industry,list_date')
-
-    # 排除特定板块和ST股票
-    stock_list = stock_list[~stock_list['symbol'].str.startswith(('688', '300', '8'))]
-    stock_list = stock_list[~stock_list['name'].str.contains('ST', case=False, na=False)]
+    stock_list = load_stock_universe()
 
     print(f"排除后剩余股票数量: {len(stock_list)}")
 
@@ -5294,7 +6711,7 @@ def stock_selector(target_date=None):
 
         try:
             # 使用新接口获取前复权数据
-            with api_lock:
+            with rate_limited_api_call():
                 batch_data = pro.stk_factor_pro(**{
                     "ts_code": "",
                     "start_date": target_date,
@@ -5317,7 +6734,7 @@ def stock_selector(target_date=None):
             print(f"新接口获取第 {i // batch_size + 1} 批数据失败: {e}")
             # 备用方案：使用原接口
             try:
-                with api_lock:
+                with rate_limited_api_call():
                     batch_data = pro.daily(trade_date=target_date)
                 batch_data = batch_data[batch_data['ts_code'].isin(batch_codes)]
                 # 添加前复权字段（简化处理）
@@ -5343,12 +6760,13 @@ def stock_selector(target_date=None):
     stock_data = pd.merge(stock_list, daily_data, on='ts_code', how='inner')
 
     # 筛选股价 < 10元的股票（使用前复权价格）
+    max_price = SCREEN_CRITERIA['max_price']
     price_col = 'close_qfq' if 'close_qfq' in stock_data.columns else 'close'
-    stock_data = stock_data[stock_data[price_col] < 10]
-    print(f"股价小于10元的股票数量: {len(stock_data)}")
+    stock_data = stock_data[stock_data[price_col] < max_price]
+    print(f"股价小于{max_price:g}元的股票数量: {len(stock_data)}")
 
     if len(stock_data) == 0:
-        print("没有股价小于10元的股票")
+        print(f"没有股价小于{max_price:g}元的股票")
         return pd.DataFrame()
 
     # 第三步：获取市值和换手率数据（如果新接口没有提供完整数据）
@@ -5363,7 +6781,7 @@ def stock_selector(target_date=None):
         for i in range(0, len(missing_codes), batch_size):
             batch_codes = missing_codes[i:i + batch_size]
             try:
-                with api_lock:
+                with rate_limited_api_call():
                     market_data = pro.daily_basic(ts_code=','.join(batch_codes),
                                                   trade_date=target_date,
                                                   fields='ts_code,turnover_rate,total_mv')
@@ -5372,7 +6790,7 @@ def stock_selector(target_date=None):
                 # 单个获取
                 for code in batch_codes:
                     try:
-                        with api_lock:
+                        with rate_limited_api_call():
                             market_data = pro.daily_basic(ts_code=code,
                                                           trade_date=target_date,
                                                           fields='ts_code,turnover_rate,total_mv')
@@ -5394,15 +6812,15 @@ def stock_selector(target_date=None):
     # 筛选换手率大于1.5%的股票
     if 'turnover_rate' in stock_data.columns:
         stock_data = stock_data.dropna(subset=['turnover_rate'])
-        stock_data = stock_data[stock_data['turnover_rate'] > 1.5]
-        print(f"换手率大于1.5%的股票数量: {len(stock_data)}")
+        stock_data = stock_data[stock_data['turnover_rate'] > SCREEN_CRITERIA['min_turnover']]
+        print(f"换手率大于{SCREEN_CRITERIA['min_turnover']:g}%的股票数量: {len(stock_data)}")
     else:
         print("缺少换手率数据，跳过此筛选条件")
 
     # 筛选总市值大于40亿的股票
     if 'total_mv' in stock_data.columns:
-        stock_data = stock_data[stock_data['total_mv'] > 400000]
-        print(f"总市值大于40亿的股票数量: {len(stock_data)}")
+        stock_data = stock_data[stock_data['total_mv'] > SCREEN_CRITERIA['min_total_mv']]
+        print(f"总市值大于{SCREEN_CRITERIA['min_total_mv'] / 10000:g}亿的股票数量: {len(stock_data)}")
     else:
         print("缺少市值数据，跳过此筛选条件")
 
@@ -5482,7 +6900,7 @@ def format_output(df):
 def get_trade_dates_in_range(start_date, end_date):
     """获取日期区间内的所有交易日"""
     try:
-        with api_lock:
+        with rate_limited_api_call():
             trade_cal = pro.trade_cal(exchange='SSE', start_date=start_date, end_date=end_date, is_open=1)
         trade_dates = trade_cal.sort_values('cal_date')['cal_date'].tolist()
         return trade_dates
@@ -5491,8 +6909,158 @@ def get_trade_dates_in_range(start_date, end_date):
         return []
 
 
-def batch_analyze_dates(start_date, end_date):
-    """批量分析日期区间内的所有交易日"""
+# 多日期并行分析时每个交易日的内存占用估计（行情快照、个股历史数据、图表），用于计算同时进行的日期数
+BATCH_DATE_MEMORY_MB = 600
+# 多日期并行分析的默认内存上限（MB）
+BATCH_MEMORY_LIMIT_MB = 4096
+
+# matplotlib 不是线程安全的，多个交易日并行时图表依次生成
+chart_render_lock = threading.Lock()
+
+# 内存受限模式：RSS 超过预算的该比例时收缩个股历史数据缓存
+MEMORY_PRESSURE_RATIO = 0.8
+# 无法读取RSS时，每完成该数量的交易日收缩一次历史数据缓存
+MEMORY_BLIND_SHRINK_INTERVAL = 5
+
+
+def shrink_history_cache(keep_ratio=0.5):
+    """淘汰最久未使用的缓存股票，只保留 keep_ratio 比例，返回淘汰数量（被淘汰的股票再次用到时重新获取）"""
+    with _history_cache_lock:
+        evict = len(_history_cache) - int(len(_history_cache) * keep_ratio)
+        for stock_code in list(itertools.islice(_history_cache, evict)):
+            del _history_cache[stock_code]
+    return evict
+
+
+def get_process_rss_mb():
+    """当前进程常驻内存（MB）；psutil 和 /proc 都不可用时返回None"""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / 1024 / 1024
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def release_date_memory(target_date, memory_stats, budget_mb):
+    """
+    内存受限模式下每个交易日完成后调用：关闭残留图形、回收内存并采样RSS，记录逐日变化和峰值；
+    RSS 超过预算的 MEMORY_PRESSURE_RATIO 时淘汰一半历史数据缓存后重新采样；
+    无法读取RSS时改为每 MEMORY_BLIND_SHRINK_INTERVAL 个交易日淘汰一半缓存
+    """
+    with chart_render_lock:
+        plt.close('all')
+    gc.collect()
+    memory_stats['dates_done'] += 1
+    rss = get_process_rss_mb()
+    if rss is None:
+        if memory_stats['dates_done'] % MEMORY_BLIND_SHRINK_INTERVAL == 0:
+            evicted = shrink_history_cache()
+            gc.collect()
+            print(f"🧠 {target_date} 已完成 {memory_stats['dates_done']} 个交易日，淘汰 {evicted} 只股票的缓存数据")
+        return
+
+    evicted = 0
+    if rss > budget_mb * MEMORY_PRESSURE_RATIO:
+        evicted = shrink_history_cache()
+        gc.collect()
+        rss = get_process_rss_mb()
+
+    records = memory_stats['records']
+    previous = records[-1]['rss_mb'] if records else memory_stats['start_mb']
+    memory_stats['peak_mb'] = max(memory_stats['peak_mb'], rss)
+    records.append({'date': target_date, 'rss_mb': round(rss, 1), 'delta_mb': round(rss - previous, 1),
+                    'evicted': evicted})
+    print(f"🧠 {target_date} 内存: RSS {rss:.0f}MB（{rss - previous:+.0f}MB），峰值 {memory_stats['peak_mb']:.0f}MB"
+          f" / 预算 {budget_mb:.0f}MB" + (f"，淘汰 {evicted} 只股票的缓存数据" if evicted else ""))
+
+
+def analyze_trade_date(target_date):
+    """
+    分析单个交易日：筛选、TD分析、图表和HTML报告
+    返回 ('success', 结果信息) 或 ('failed', 失败原因)
+    """
+    try:
+        # 执行单日分析
+        result = stock_selector(target_date)
+
+        if len(result) == 0:
+            print(f"⚠️ {target_date} 未找到符合条件的股票")
+            return 'failed', {
+                'date': target_date,
+                'reason': '未找到符合条件的股票'
+            }
+
+        print(f"✅ {target_date} 筛选完成，找到 {len(result)} 只股票")
+
+        # 保存CSV
+        csv_filename = f"批量TD筛选_{target_date}_{datetime.now().strftime('%H%M%S')}.csv"
+        result.to_csv(csv_filename, index=False, encoding='utf-8-sig')
+        print(f"📄 CSV已保存: {csv_filename}")
+
+        # 执行TD分析
+        print(f"🔄 {target_date} 开始TD技术分析...")
+        max_workers = min(4, len(result))
+        analyses = analyze_stocks_parallel(result, target_date, max_workers)
+
+        # 生成图表 - 添加异常处理
+        # 结果表：图表筛选和报告统计共用，同时导出便于跨日期加载
+        table = build_result_table(analyses)
+        table_file = export_result_table(
+            table, f"批量TD结果表_{target_date}_{datetime.now().strftime('%H%M%S')}.parquet")
+
+        chart_files = []
+        chart_dir = None
+        try:
+            print(f"📈 {target_date} 开始生成图表...")
+            with chart_render_lock:
+                chart_files, chart_dir = create_td_charts_for_focus_stocks(analyses, target_date, table)
+            print(f"✅ {target_date} 图表生成完成: {len(chart_files)} 个")
+        except Exception as chart_error:
+            print(f"⚠️ 图表生成失败: {chart_error}")
+            print("继续生成HTML报告...")
+
+        # 生成HTML报告
+        html_filename = f"批量TD分析报告_{target_date}_{datetime.now().strftime('%H%M%S')}.html"
+        write_html_report(html_filename, analyses, target_date, chart_files, table)
+
+        print(f"📊 HTML报告已保存: {html_filename}")
+
+        return 'success', {
+            'date': target_date,
+            'stock_count': len(result),
+            'csv_file': csv_filename,
+            'table_file': table_file,
+            'html_file': html_filename,
+            'chart_dir': chart_dir if chart_files else None,
+            'chart_count': len(chart_files) if chart_files else 0
+        }
+
+    except Exception as e:
+        print(f"❌ {target_date} 分析失败: {e}")
+        return 'failed', {
+            'date': target_date,
+            'reason': str(e)
+        }
+
+
+def get_dates_in_flight(parallel_dates, max_memory_mb=None):
+    """根据并行度和内存上限计算同时分析的交易日数量"""
+    if max_memory_mb is None:
+        max_memory_mb = BATCH_MEMORY_LIMIT_MB
+    memory_slots = max(1, int(max_memory_mb // BATCH_DATE_MEMORY_MB)) if max_memory_mb else parallel_dates
+    return max(1, min(parallel_dates, memory_slots))
+
+
+def batch_analyze_dates(start_date, end_date, parallel_dates=1, max_memory_mb=None, bounded_memory=False):
+    """
+    批量分析日期区间内的所有交易日
+    parallel_dates > 1 时多个交易日并行分析，共享个股历史数据缓存和全局API限速，
+    同时进行的日期数同时受 max_memory_mb（默认 BATCH_MEMORY_LIMIT_MB）限制，结果按日期顺序汇总
+    bounded_memory=True 时以 max_memory_mb 作为RSS预算：每个交易日的结果写盘后立即释放，
+    逐日记录内存变化，接近预算时收缩历史数据缓存，结束后输出峰值并保存逐日内存记录
+    """
     print(f"\n🔍 获取 {start_date} 到 {end_date} 期间的交易日...")
 
     # 设置matplotlib后端
@@ -5511,9 +7079,25 @@ def batch_analyze_dates(start_date, end_date):
     for i, date in enumerate(trade_dates, 1):
         print(f"  {i}. {date}")
 
+    memory_stats = None
+    if bounded_memory:
+        budget_mb = max_memory_mb or BATCH_MEMORY_LIMIT_MB
+        start_mb = get_process_rss_mb()
+        if start_mb is None:
+            print(f"⚠️ 无法读取进程内存（未安装 psutil），内存受限模式每 {MEMORY_BLIND_SHRINK_INTERVAL} 个交易日"
+                  f"收缩一次缓存，不统计RSS")
+            start_mb = 0
+        memory_stats = {'start_mb': start_mb, 'peak_mb': start_mb, 'records': [], 'dates_done': 0}
+        # 已占用的内存不再分给并行的交易日
+        dates_in_flight = get_dates_in_flight(parallel_dates, max(budget_mb - start_mb, BATCH_DATE_MEMORY_MB))
+        print(f"🧠 内存受限模式: RSS预算 {budget_mb:.0f}MB，当前 {start_mb:.0f}MB")
+    else:
+        dates_in_flight = get_dates_in_flight(parallel_dates, max_memory_mb)
+    rounds = -(-len(trade_dates) // dates_in_flight)
+
     # 确认是否继续
     print(
-        f"\n⚠️ 批量分析将处理 {len(trade_dates)} 个交易日，预计耗时：{len(trade_dates) * 3:.0f}-{len(trade_dates) * 8:.0f} 分钟")
+        f"\n⚠️ 批量分析将处理 {len(trade_dates)} 个交易日（同时分析 {dates_in_flight} 个），预计耗时：{rounds * 3:.0f}-{rounds * 8:.0f} 分钟")
     confirm = input("是否继续？(Y/N): ").strip().upper()
 
     if confirm != 'Y':
@@ -5528,77 +7112,51 @@ def batch_analyze_dates(start_date, end_date):
     failed_analyses = []
     html_files = []
 
-    for i, target_date in enumerate(trade_dates, 1):
-        print(f"\n📊 正在分析第 {i}/{len(trade_dates)} 个交易日：{target_date}")
-        print(f"进度：{i / len(trade_dates) * 100:.1f}%")
-        print("-" * 60)
-
-        try:
-            # 执行单日分析
-            result = stock_selector(target_date)
-
-            if len(result) > 0:
-                print(f"✅ {target_date} 筛选完成，找到 {len(result)} 只股票")
-
-                # 保存CSV
-                csv_filename = f"批量TD筛选_{target_date}_{datetime.now().strftime('%H%M%S')}.csv"
-                result.to_csv(csv_filename, index=False, encoding='utf-8-sig')
-                print(f"📄 CSV已保存: {csv_filename}")
-
-                # 执行TD分析
-                print(f"🔄 开始TD技术分析...")
-                max_workers = min(4, len(result))
-                analyses = analyze_stocks_parallel(result, target_date, max_workers)
-
-                # 生成图表 - 添加异常处理
-                chart_files = []
-                chart_dir = None
-                try:
-                    print(f"📈 开始生成图表...")
-                    chart_files, chart_dir = create_td_charts_for_focus_stocks(analyses, target_date)
-                    print(f"✅ 图表生成完成: {len(chart_files)} 个")
-                except Exception as chart_error:
-                    print(f"⚠️ 图表生成失败: {chart_error}")
-                    print("继续生成HTML报告...")
-
-                # 生成HTML报告
-                html_content = generate_html_report(analyses, target_date, chart_files)
-                html_filename = f"批量TD分析报告_{target_date}_{datetime.now().strftime('%H%M%S')}.html"
-
-                with open(html_filename, 'w', encoding='utf-8') as f:
-                    f.write(html_content)
-
-                print(f"📊 HTML报告已保存: {html_filename}")
-
-                successful_analyses.append({
-                    'date': target_date,
-                    'stock_count': len(result),
-                    'csv_file': csv_filename,
-                    'html_file': html_filename,
-                    'chart_dir': chart_dir if chart_files else None,
-                    'chart_count': len(chart_files) if chart_files else 0
-                })
-
-                html_files.append(html_filename)
-
-            else:
-                print(f"⚠️ {target_date} 未找到符合条件的股票")
-                failed_analyses.append({
-                    'date': target_date,
-                    'reason': '未找到符合条件的股票'
-                })
-
-        except Exception as e:
-            print(f"❌ {target_date} 分析失败: {e}")
-            failed_analyses.append({
-                'date': target_date,
-                'reason': str(e)
-            })
-
-        # 添加延迟避免API限制
-        if i < len(trade_dates):
-            print("⏳ 等待3秒后继续下一个交易日...")
-            time.sleep(3)
+    # 各交易日共享个股历史数据缓存
+    enable_history_cache(trade_dates[0], trade_dates[-1])
+    try:
+        if dates_in_flight == 1:
+            outcomes = []
+            for i, target_date in enumerate(trade_dates, 1):
+                print(f"\n📊 正在分析第 {i}/{len(trade_dates)} 个交易日：{target_date}")
+                print(f"进度：{i / len(trade_dates) * 100:.1f}%")
+                print("-" * 60)
+
+                outcomes.append(analyze_trade_date(target_date))
+                if memory_stats is not None:
+                    release_date_memory(target_date, memory_stats, budget_mb)
+
+                # 添加延迟避免API限制
+                if i < len(trade_dates):
+                    print("⏳ 等待3秒后继续下一个交易日...")
+                    time.sleep(3)
+        else:
+            print(f"📊 并行分析 {len(trade_dates)} 个交易日，同时进行 {dates_in_flight} 个（API调用共享全局限速）")
+            outcomes = [None] * len(trade_dates)
+            with ThreadPoolExecutor(max_workers=dates_in_flight) as executor:
+                futures = {executor.submit(analyze_trade_date, target_date): index
+                           for index, target_date in enumerate(trade_dates)}
+                for completed, future in enumerate(as_completed(futures), 1):
+                    index = futures[future]
+                    outcomes[index] = future.result()
+                    print(f"\n📊 交易日进度：{completed}/{len(trade_dates)}（完成 {trade_dates[index]}）")
+                    if memory_stats is not None:
+                        release_date_memory(trade_dates[index], memory_stats, budget_mb)
+    finally:
+        disable_history_cache()
+
+    if memory_stats is not None and memory_stats['records']:
+        memory_filename = f"批量分析内存记录_{start_date}_{end_date}_{datetime.now().strftime('%H%M%S')}.csv"
+        pd.DataFrame(memory_stats['records']).to_csv(memory_filename, index=False, encoding='utf-8-sig')
+        print(f"\n🧠 内存峰值 {memory_stats['peak_mb']:.0f}MB / 预算 {budget_mb:.0f}MB，逐日记录已保存: {memory_filename}")
+
+    # 按日期顺序汇总结果
+    for status, info in outcomes:
+        if status == 'success':
+            successful_analyses.append(info)
+            html_files.append(info['html_file'])
+        else:
+            failed_analyses.append(info)
 
     # 显示批量分析结果汇总
     print("\n" + "=" * 80)
@@ -5630,6 +7188,7 @@ def batch_analyze_dates(start_date, end_date):
         for analysis in successful_analyses:
             print(f"  📊 {analysis['html_file']}")
             print(f"  📄 {analysis['csv_file']}")
+            print(f"  🗃️ {analysis['table_file']}")
             if analysis['chart_dir']:
                 print(f"  📈 图表目录: {analysis['chart_dir']}")
             print()
@@ -5905,6 +7464,457 @@ def generate_batch_summary_report(successful_analyses, failed_analyses, start_da
     return html_content
 
 
+# 信号回测：本地历史数据仓库目录、每批处理的股票数和分组统计维度
+BACKTEST_STORE_DIR = 'td_history_store'
+BACKTEST_STOCK_BATCH = 500
+# 回测特征计算进程数（None 表示使用全部CPU核心）
+BACKTEST_WORKERS = None
+BACKTEST_DIMENSIONS = {
+    'td_signal_grade': '信号等级',
+    'td_setup': 'TD Setup',
+    'td_countdown': 'TD Countdown',
+    'td_perfected': '完美设置',
+    'td_risk_level': '风险等级',
+    'emotion_level': '情绪等级'
+}
+# 特征库目录，以及标记特征库已完整写入的文件名
+FEATURE_STORE_DIR = 'td_feature_store'
+FEATURE_STORE_MARKER = '_SUCCESS.json'
+# 参数寻优重新评分所需的输入列（顺序与 calculate_td_signal_score_batch 的参数一致）和筛选字段
+SIGNAL_SCORE_INPUTS = ['td_setup', 'td_countdown', 'td_combo', 'td_perfected', 'volume_surge', 'volume_ratio',
+                       'ma_trend', 'strength_ratio']
+SCREEN_FIELDS = ['close_qfq', 'turnover_rate', 'total_mv']
+# 收益分布的分位点，以及"达标"所需的60日最大盈利（%）
+BACKTEST_QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9)
+BACKTEST_PROFIT_TARGET = 5
+# 与单日分析一致：窗口内不足30根K线的股票不参与统计
+BACKTEST_MIN_BARS = 30
+
+
+def load_stock_universe():
+    """获取A股股票列表（排除科创板、创业板、北交所和ST股票）"""
+    with rate_limited_api_call():
+        stock_list = pro.stock_basic(exchange='', list_status='L', fields='ts_code,symbol,name,area,industry,list_date')
+
+    stock_list = stock_list[~stock_list['symbol'].str.startswith(('688', '300', '8'))]
+    stock_list = stock_list[~stock_list['name'].str.contains('ST', case=False, na=False)]
+    return stock_list
+
+
+def load_history_store(stock_codes, start_date, end_date, store_dir=BACKTEST_STORE_DIR):
+    """
+    本地历史数据仓库：每只股票一个pickle文件，记录已覆盖的日期区间
+    已覆盖 [start_date, end_date] 的股票直接读取本地数据，其余股票并发获取后写回，返回 {股票代码: DataFrame}
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    # 未来日期还没有行情，覆盖区间最多记到今天
+    covered_end = min(end_date, datetime.now().strftime('%Y%m%d'))
+
+    histories = {}
+    missing = []
+    for stock_code in stock_codes:
+        path = os.path.join(store_dir, f'{stock_code}.pkl')
+        if os.path.exists(path):
+            stored = pd.read_pickle(path)
+            if stored['start_date'] <= start_date and stored['end_date'] >= covered_end:
+                data = stored['data']
+                in_range = (data['trade_date'] >= start_date) & (data['trade_date'] <= end_date)
+                histories[stock_code] = data[in_range].reset_index(drop=True)
+                continue
+        missing.append(stock_code)
+
+    if missing:
+        print(f"📥 本地仓库缺少 {len(missing)} 只股票的数据，从接口获取...")
+        if aiohttp is not None:
+            fetched = fetch_stock_histories(missing, start_date, end_date)
+        else:
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                fetched = dict(zip(missing, executor.map(
+                    lambda code: get_enhanced_stock_data_with_emotion(code, start_date, end_date), missing)))
+
+        for stock_code, data in fetched.items():
+            if len(data) == 0:  # 获取失败不写入仓库
+                continue
+            data = data.sort_values('trade_date').reset_index(drop=True)
+            pd.to_pickle({'start_date': start_date, 'end_date': covered_end, 'data': data},
+                         os.path.join(store_dir, f'{stock_code}.pkl'))
+            histories[stock_code] = data
+
+    return histories
+
+
+def build_signal_backtest_samples(histories, trade_dates, evaluation_dates, window_days=180):
+    """
+    生成回测样本（特征）：每只股票每个评估日一行，包含逐日回放快照的全部字段（TD计数、量比、均线、
+    市场强度、ATR、四维分项、情绪指标取值）、当日筛选字段（股价、换手率、市值）和之后的前瞻收益
+    评估日停牌或窗口内K线不足 BACKTEST_MIN_BARS 的股票不计入
+    """
+    snapshots = calculate_walk_forward_snapshots(histories, evaluation_dates, window_days)
+    if len(snapshots) == 0:
+        return pd.DataFrame()
+
+    snapshots = snapshots[(snapshots['trade_date'] == snapshots['eval_date']) &
+                          (snapshots['window_bars'] >= BACKTEST_MIN_BARS)]
+    screen_values = pd.concat([
+        pd.DataFrame({'ts_code': stock_code, 'trade_date': hist_data['trade_date'].astype(str),
+                      **{field: pd.to_numeric(hist_data[field], errors='coerce') if field in hist_data.columns
+                         else np.nan for field in SCREEN_FIELDS}})
+        for stock_code, hist_data in histories.items() if len(hist_data) > 0
+    ], ignore_index=True)
+    forward = calculate_forward_returns(histories, trade_dates, evaluation_dates)
+
+    samples = snapshots.drop(columns=['eval_date']).merge(screen_values, on=['ts_code', 'trade_date'], how='left')
+    return samples.merge(forward, on=['ts_code', 'trade_date'], how='inner')
+
+
+def summarize_signal_buckets(samples, dimension, horizons=FORWARD_RETURN_HORIZONS):
+    """
+    按单个维度分组统计信号表现：样本数、各持有周期胜率（收益>0）、平均收益和收益分位数，
+    以及60日最大盈利均值、达标率（最大盈利≥BACKTEST_PROFIT_TARGET）和最大回撤均值
+    """
+    grouped = samples.groupby(dimension)
+    summary = pd.DataFrame({'samples': grouped.size()})
+
+    for horizon in horizons:
+        returns = samples[f'return_{horizon}d']
+        summary[f'hit_rate_{horizon}d'] = (returns > 0).where(returns.notna()).groupby(samples[dimension]).mean() * 100
+        summary[f'avg_return_{horizon}d'] = grouped[f'return_{horizon}d'].mean()
+        quantiles = grouped[f'return_{horizon}d'].quantile(list(BACKTEST_QUANTILES)).unstack()
+        for quantile in BACKTEST_QUANTILES:
+            summary[f'p{int(quantile * 100)}_return_{horizon}d'] = quantiles[quantile]
+
+    summary['avg_max_profit_pct'] = grouped['max_profit_pct'].mean()
+    summary['profit_target_rate'] = (samples['max_profit_pct'] >= BACKTEST_PROFIT_TARGET).groupby(
+        samples[dimension]).mean() * 100
+    summary['avg_max_profit_days'] = grouped['max_profit_days'].mean()
+    summary['avg_max_drawdown_pct'] = grouped['max_drawdown_pct'].mean()
+
+    summary = summary.round(2).reset_index().rename(columns={dimension: 'bucket'})
+    summary.insert(0, 'dimension', BACKTEST_DIMENSIONS.get(dimension, dimension))
+    return summary
+
+
+def get_feature_store_path(start_date, end_date, window_days=180, store_dir=FEATURE_STORE_DIR):
+    """特征库目录：每个 (日期区间, 窗口天数) 一个子目录"""
+    return os.path.join(store_dir, f'{start_date}_{end_date}_w{window_days}')
+
+
+def write_feature_partition(path, part_index, samples):
+    """将一批样本按列写入一个 npz 分区文件，字符串列转为定长Unicode，读取时不需要pickle"""
+    columns = {}
+    for column in samples.columns:
+        values = samples[column].to_numpy()
+        columns[column] = values.astype(str) if values.dtype == object else values
+    np.savez(os.path.join(path, f'part-{part_index:05d}.npz'), **columns)
+
+
+def read_feature_store(path, columns=None, data_end=None):
+    """
+    读取特征库，只加载 columns 指定的列；特征库不存在或未写完时返回None
+    data_end 给出时，特征库记录的行情截止日早于该日期（建库时前瞻收益尚未走完）也返回None，需要重建
+    """
+    marker_path = os.path.join(path, FEATURE_STORE_MARKER)
+    if not os.path.exists(marker_path):
+        return None
+    if data_end is not None:
+        with open(marker_path, encoding='utf-8') as f:
+            stored_end = json.load(f).get('data_end', '')
+        if stored_end < data_end:
+            print(f"♻️ 特征库行情截止于 {stored_end or '未知'}，早于 {data_end}，前瞻收益不完整，重新计算")
+            return None
+
+    frames = []
+    for part in sorted(name for name in os.listdir(path) if name.endswith('.npz')):
+        with np.load(os.path.join(path, part), allow_pickle=False) as data:
+            names = data.files if columns is None else [column for column in columns if column in data.files]
+            frames.append(pd.DataFrame({name: data[name] for name in names}))
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+def compute_feature_batch(histories, trade_dates, evaluation_dates, window_days, feature_path=None, part_index=0,
+                          columns=None):
+    """特征计算进程工作函数：计算一批股票的回测样本，feature_path 给出时写入特征库分区，返回按 columns 裁剪的样本"""
+    samples = build_signal_backtest_samples(histories, trade_dates, evaluation_dates, window_days)
+    if len(samples) > 0:
+        if feature_path:
+            write_feature_partition(feature_path, part_index, samples)
+        if columns is not None:
+            samples = samples[[column for column in columns if column in samples.columns]]
+    return samples
+
+
+def build_signal_features(start_date, end_date, stock_codes=None, window_days=180, store_dir=BACKTEST_STORE_DIR,
+                          feature_dir=FEATURE_STORE_DIR, columns=None):
+    """
+    计算日期区间内全部股票的回测样本（逐日特征、筛选字段和前瞻收益）
+    全市场样本写入特征库（按股票批次分区的列式 npz 文件），再次运行同一区间时直接读取，
+    columns 指定时只加载这些列；历史数据来自本地仓库，按 BACKTEST_STOCK_BATCH 只股票分批，
+    由 BACKTEST_WORKERS 个进程并行计算（历史数据在主进程读取，接口限流只在主进程生效）
+    """
+    feature_path = get_feature_store_path(start_date, end_date, window_days, feature_dir)
+    history_start = (pd.to_datetime(start_date) - timedelta(days=window_days)).strftime('%Y%m%d')
+    forward_end = (pd.to_datetime(end_date) + timedelta(days=120)).strftime('%Y%m%d')
+    # 与 load_history_store 一致，未来日期还没有行情，实际数据最多到今天
+    data_end = min(forward_end, datetime.now().strftime('%Y%m%d'))
+    if stock_codes is None:
+        stored = read_feature_store(feature_path, columns, data_end)
+        if stored is not None:
+            print(f"📦 从特征库读取 {len(stored)} 个样本: {feature_path}")
+            return stored
+
+    trade_dates = get_trade_dates_in_range(history_start, forward_end)
+    evaluation_dates = [date for date in trade_dates if start_date <= date <= end_date]
+    if not evaluation_dates:
+        print("❌ 回测区间内没有交易日")
+        return pd.DataFrame()
+
+    save_features = stock_codes is None
+    if save_features:
+        stock_codes = load_stock_universe()['ts_code'].tolist()
+        print("⚠️ 股票池为当前上市股票，已退市股票不在统计范围内")
+        shutil.rmtree(feature_path, ignore_errors=True)
+        os.makedirs(feature_path)
+
+    print(f"📅 回测区间: {start_date} - {end_date}，共 {len(evaluation_dates)} 个交易日，{len(stock_codes)} 只股票")
+
+    start_time = time.time()
+    sample_parts = []
+    batch_starts = range(0, len(stock_codes), BACKTEST_STOCK_BATCH)
+    workers = min(BACKTEST_WORKERS or os.cpu_count() or 1, len(batch_starts))
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    if executor is not None:
+        print(f"🚀 使用 {workers} 个进程计算特征")
+
+    def collect(batch_end, batch_samples):
+        if len(batch_samples) > 0:
+            sample_parts.append(batch_samples)
+        print(f"  已完成 {batch_end}/{len(stock_codes)} 只股票，用时 {time.time() - start_time:.0f} 秒")
+
+    # 主进程依次读取各批历史数据并提交计算，最多 workers 个批次在途，限制内存占用
+    in_flight = []
+    try:
+        for part_index, batch_start in enumerate(batch_starts):
+            batch_codes = stock_codes[batch_start:batch_start + BACKTEST_STOCK_BATCH]
+            histories = load_history_store(batch_codes, history_start, forward_end, store_dir)
+            args = (histories, trade_dates, evaluation_dates, window_days,
+                    feature_path if save_features else None, part_index, columns)
+            batch_end = batch_start + len(batch_codes)
+            if executor is None:
+                collect(batch_end, compute_feature_batch(*args))
+                continue
+            in_flight.append((batch_end, executor.submit(compute_feature_batch, *args)))
+            if len(in_flight) >= workers:
+                batch_end, future = in_flight.pop(0)
+                collect(batch_end, future.result())
+        for batch_end, future in in_flight:
+            collect(batch_end, future.result())
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    if save_features:
+        with open(os.path.join(feature_path, FEATURE_STORE_MARKER), 'w', encoding='utf-8') as f:
+            json.dump({'start_date': start_date, 'end_date': end_date, 'window_days': window_days,
+                       'data_end': data_end, 'stock_count': len(stock_codes),
+                       'created': datetime.now().strftime('%Y-%m-%d %H:%M:%S')}, f)
+
+    if not sample_parts:
+        print("❌ 没有可用的回测样本")
+        return pd.DataFrame()
+
+    samples = pd.concat(sample_parts, ignore_index=True)
+    print(f"✅ 样本计算完成：{len(samples)} 个样本，用时 {time.time() - start_time:.0f} 秒")
+    return samples
+
+
+def rescore_features(features, weights=None, grades=None, emotion_rules=None):
+    """
+    评分阶段：只读取特征中的评分输入，重新计算 td_score、信号分、信号等级、信心度、
+    四维综合得分和情绪得分/等级，调整 TD_SIGNAL_WEIGHTS、TD_SIGNAL_GRADES、FOUR_DIMENSION_WEIGHTS
+    或 EMOTION_SCORING_RULES 后无需重新获取和分析数据；返回与 features 行对应的评分DataFrame
+    """
+    weights = TD_SIGNAL_WEIGHTS if weights is None else weights
+    inputs = [features[name].to_numpy() for name in SIGNAL_SCORE_INPUTS]
+    signal_score, signal_grade = calculate_td_signal_score_batch(*inputs, weights=weights, grades=grades)
+    td_score, _ = calculate_td_signal_score_batch(
+        *inputs, weights=dict(weights, **{key: TD_SCORE_WEIGHTS[key] for key in
+                                          ('volume_shrink', 'market_strong', 'market_weak')}))
+
+    sub_scores = {column: features[column].to_numpy(dtype=float) for column in FOUR_DIMENSION_SCORE_COLUMNS}
+    comprehensive_score = np.minimum(sum(sub_scores[f'{name}_score'] * weight
+                                         for name, weight in FOUR_DIMENSION_WEIGHTS.items()), 100)
+
+    emotion = score_emotion_matrix({'matrix': features[EMOTION_INDICATOR_COLUMNS].to_numpy(dtype=float),
+                                    'lengths': features['window_bars'].to_numpy()}, rules=emotion_rules)
+
+    return pd.DataFrame({
+        'ts_code': features['ts_code'].to_numpy(),
+        'trade_date': features['trade_date'].to_numpy(),
+        'td_score': td_score,
+        'td_signal_score': signal_score,
+        'td_signal_grade': signal_grade,
+        'confidence': calculate_td_confidence_batch(signal_score, grades),
+        'comprehensive_score': np.where(np.isnan(sub_scores['time_score']), 0, comprehensive_score),
+        'emotion_score': emotion['emotion_score'],
+        'emotion_level': emotion['emotion_level']
+    })
+
+
+def run_signal_backtest(start_date, end_date, stock_codes=None, window_days=180, store_dir=BACKTEST_STORE_DIR,
+                        feature_dir=FEATURE_STORE_DIR):
+    """
+    TD信号胜率回测：对日期区间内每个交易日、全部股票逐日回放TD序列和情绪分析，
+    统计各信号等级、Setup、Countdown、完美设置、风险等级和情绪等级之后5/10/20/60日的胜率与收益分布
+    返回 (样本DataFrame, 统计DataFrame)
+    """
+    samples = build_signal_features(start_date, end_date, stock_codes, window_days, store_dir, feature_dir)
+    if len(samples) == 0:
+        return samples, pd.DataFrame()
+
+    # 按当前评分标准重新评分，特征库中保存的等级可能来自旧的权重
+    scores = rescore_features(samples)
+    samples['td_signal_grade'] = scores['td_signal_grade'].to_numpy()
+    samples['emotion_level'] = scores['emotion_level'].to_numpy()
+
+    summary = pd.concat([summarize_signal_buckets(samples, dimension) for dimension in BACKTEST_DIMENSIONS],
+                        ignore_index=True)
+    return samples, summary
+
+
+def format_backtest_summary(summary):
+    """在控制台打印各信号等级和关键TD信号的胜率与平均收益"""
+    key_buckets = {
+        '信号等级': None,
+        'TD Setup': [9, -9],
+        'TD Countdown': [13, -13],
+        '完美设置': [True]
+    }
+    for dimension, buckets in key_buckets.items():
+        rows = summary[summary['dimension'] == dimension]
+        if buckets is not None:
+            rows = rows[rows['bucket'].isin(buckets)]
+        if len(rows) == 0:
+            continue
+
+        print(f"\n📊 {dimension}")
+        print("-" * 100)
+        for _, row in rows.iterrows():
+            print(f"  {str(row['bucket']):<12} 样本: {row['samples']:>8} | "
+                  f"10日胜率: {row['hit_rate_10d']:>6.2f}% | 20日胜率: {row['hit_rate_20d']:>6.2f}% | "
+                  f"20日平均收益: {row['avg_return_20d']:>6.2f}% | 60日最大盈利: {row['avg_max_profit_pct']:>6.2f}% | "
+                  f"最大回撤: {row['avg_max_drawdown_pct']:>6.2f}%")
+
+
+# 参数寻优默认网格：键为 SCREEN_CRITERIA、TD_SIGNAL_WEIGHTS 中的参数名，或 'grade_cutoffs'（S/A/B/C+ 级最低分）
+SWEEP_DEFAULT_GRID = {
+    'max_price': [10, 20],
+    'min_turnover': [1.0, 1.5, 3.0],
+    'min_total_mv': [200000, 400000],
+    'perfected': [10, 20, 30],
+    'grade_cutoffs': [(70, 50, 25, 10), (80, 60, 35, 15)]
+}
+# 入选信号少于该数量的配置不参与排名
+SWEEP_MIN_PICKS = 30
+# 参数寻优用到的特征列：评分输入、筛选字段和前瞻收益
+SWEEP_FEATURE_COLUMNS = SIGNAL_SCORE_INPUTS + SCREEN_FIELDS + ['max_profit_pct', 'max_drawdown_pct'] + [
+    f'return_{horizon}d' for horizon in FORWARD_RETURN_HORIZONS]
+
+# 参数寻优子进程持有的特征数据（由进程池初始化函数设置，每个进程只传输一次）
+_sweep_features = None
+
+
+def expand_parameter_grid(grid):
+    """将参数网格展开为配置列表（笛卡尔积）"""
+    keys = list(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*(grid[key] for key in keys))]
+
+
+def init_sweep_worker(features):
+    """参数寻优子进程初始化"""
+    global _sweep_features
+    _sweep_features = features
+
+
+def evaluate_sweep_config(config, features=None):
+    """
+    评估单组参数：按筛选条件过滤样本，用配置的权重和等级门槛重新计算信号分，
+    统计达到B级门槛的入选信号之后的胜率、平均收益、60日最大盈利和最大回撤
+    """
+    features = _sweep_features if features is None else features
+    criteria = {key: config.get(key, value) for key, value in SCREEN_CRITERIA.items()}
+    weights = {key: config.get(key, value) for key, value in TD_SIGNAL_WEIGHTS.items()}
+    cutoffs = config.get('grade_cutoffs', tuple(threshold for threshold, _ in TD_SIGNAL_GRADES))
+    grades = tuple(zip(cutoffs, [grade for _, grade in TD_SIGNAL_GRADES]))
+
+    with np.errstate(invalid='ignore'):
+        screened = ((features['close_qfq'] < criteria['max_price']) &
+                    (features['turnover_rate'] > criteria['min_turnover']) &
+                    (features['total_mv'] > criteria['min_total_mv']))
+    score, _ = calculate_td_signal_score_batch(*(features[name][screened] for name in SIGNAL_SCORE_INPUTS),
+                                               weights=weights, grades=grades)
+    picked = np.flatnonzero(screened)[score >= cutoffs[2]]
+
+    result = dict(config)
+    result['screened'] = int(screened.sum())
+    result['picks'] = len(picked)
+    for horizon in FORWARD_RETURN_HORIZONS:
+        returns = features[f'return_{horizon}d'][picked]
+        returns = returns[~np.isnan(returns)]
+        result[f'hit_rate_{horizon}d'] = (returns > 0).mean() * 100 if len(returns) else np.nan
+        result[f'avg_return_{horizon}d'] = returns.mean() if len(returns) else np.nan
+
+    max_profit = features['max_profit_pct'][picked]
+    result['avg_max_profit_pct'] = max_profit.mean() if len(picked) else np.nan
+    result['profit_target_rate'] = (max_profit >= BACKTEST_PROFIT_TARGET).mean() * 100 if len(picked) else np.nan
+    result['avg_max_drawdown_pct'] = np.nanmean(features['max_drawdown_pct'][picked]) if len(picked) else np.nan
+    return result
+
+
+def run_parameter_sweep(samples, grid=None, max_workers=None, rank_by='avg_return_20d', min_picks=SWEEP_MIN_PICKS):
+    """
+    并行参数寻优：特征（回测样本）只计算一次，每组参数只需筛选和重新评分
+    各配置在进程池中并行评估，返回按 rank_by 降序排列的结果表，入选信号少于 min_picks 的配置排在最后
+    """
+    configs = expand_parameter_grid(SWEEP_DEFAULT_GRID if grid is None else grid)
+    features = {column: samples[column].to_numpy() for column in SWEEP_FEATURE_COLUMNS}
+    for column in ['volume_ratio', 'strength_ratio'] + SCREEN_FIELDS:
+        features[column] = features[column].astype(float)
+
+    max_workers = min(max_workers or os.cpu_count() or 1, len(configs))
+    print(f"🔧 参数寻优：{len(configs)} 组参数，{len(samples)} 个样本，{max_workers} 个进程")
+    start_time = time.time()
+    if max_workers <= 1:
+        results = [evaluate_sweep_config(config, features) for config in configs]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=init_sweep_worker,
+                                 initargs=(features,)) as executor:
+            results = list(executor.map(evaluate_sweep_config, configs,
+                                        chunksize=max(1, len(configs) // (max_workers * 4))))
+    print(f"✅ 参数寻优完成，用时 {time.time() - start_time:.1f} 秒")
+
+    table = pd.DataFrame(results)
+    table['sufficient'] = table['picks'] >= min_picks
+    table = table.sort_values(['sufficient', rank_by], ascending=[False, False], na_position='last')
+    table = table.round(2).reset_index(drop=True)
+    table.insert(0, 'rank', np.arange(1, len(table) + 1))
+    return table
+
+
+def format_sweep_results(table, top=10):
+    """在控制台打印排名靠前的参数组合"""
+    parameter_columns = [column for column in table.columns if column not in (
+        'rank', 'screened', 'picks', 'sufficient', 'avg_max_profit_pct', 'profit_target_rate',
+        'avg_max_drawdown_pct') and not column.startswith(('hit_rate_', 'avg_return_'))]
+    print(f"\n🏆 参数组合排名（前{min(top, len(table))}名）")
+    print("-" * 100)
+    for _, row in table.head(top).iterrows():
+        parameters = ", ".join(f"{column}={row[column]}" for column in parameter_columns)
+        print(f"  {row['rank']:>3}. {parameters}")
+        print(f"       入选: {row['picks']} | 20日胜率: {row['hit_rate_20d']:.2f}% | "
+              f"20日平均收益: {row['avg_return_20d']:.2f}% | 60日最大盈利: {row['avg_max_profit_pct']:.2f}% | "
+              f"最大回撤: {row['avg_max_drawdown_pct']:.2f}%")
+
+
 # 主程序
 if __name__ == "__main__":
     # 过滤matplotlib和tkinter相关警告
@@ -5960,9 +7970,49 @@ if __name__ == "__main__":
         print("\n请选择分析模式：")
         print("1. 单日分析 - 分析指定单个交易日")
         print("2. 批量分析 - 分析日期区间内所有交易日")
+        print("3. 信号回测 - 统计TD信号和情绪等级的历史胜率与收益分布")
+        print("4. 参数寻优 - 并行评估筛选条件和评分权重组合，按历史收益排名")
         print("直接按回车则使用最近交易日进行单日分析")
 
-        mode_input = input("\n请选择模式(1/2): ").strip()
+        mode_input = input("\n请选择模式(1/2/3/4): ").strip()
+
+        if mode_input in ("3", "4"):
+            # 信号回测 / 参数寻优模式
+            if mode_input == "3":
+                print("\n=== 信号回测模式 ===")
+                print("逐日回放区间内全部股票的TD序列，统计信号出现后5/10/20/60日的收益表现")
+            else:
+                print("\n=== 参数寻优模式 ===")
+                print("样本只计算一次，各组参数（SWEEP_DEFAULT_GRID）只重新筛选和评分")
+            print("历史数据保存在本地仓库，重复回测同一区间无需再次下载")
+
+            start_date_input = input("\n请输入开始日期（格式：YYYYMMDD，例如：20220101）: ").strip()
+            end_date_input = input("请输入结束日期（格式：YYYYMMDD，例如：20241231）: ").strip()
+
+            if len(start_date_input) != 8 or not start_date_input.isdigit() or len(
+                    end_date_input) != 8 or not end_date_input.isdigit() or start_date_input > end_date_input:
+                print("\n日期格式错误！请使用YYYYMMDD格式，且开始日期不晚于结束日期")
+                input("\n按回车键退出程序...")
+                exit(1)
+
+            if mode_input == "3":
+                samples, summary = run_signal_backtest(start_date_input, end_date_input)
+                if len(summary) > 0:
+                    format_backtest_summary(summary)
+                    summary_filename = f"TD信号回测_{start_date_input}到{end_date_input}_{datetime.now().strftime('%H%M%S')}.csv"
+                    summary.to_csv(summary_filename, index=False, encoding='utf-8-sig')
+                    print(f"\n📄 回测统计已保存: {summary_filename}")
+            else:
+                samples = build_signal_features(start_date_input, end_date_input, columns=SWEEP_FEATURE_COLUMNS)
+                if len(samples) > 0:
+                    sweep_table = run_parameter_sweep(samples)
+                    format_sweep_results(sweep_table)
+                    sweep_filename = f"TD参数寻优_{start_date_input}到{end_date_input}_{datetime.now().strftime('%H%M%S')}.csv"
+                    sweep_table.to_csv(sweep_filename, index=False, encoding='utf-8-sig')
+                    print(f"\n📄 寻优结果已保存: {sweep_filename}")
+
+            input("\n按回车键退出程序...")
+            exit(0)
 
         if mode_input == "2":
             # 批量分析模式
@@ -6009,8 +8059,17 @@ if __name__ == "__main__":
                 input("\n按回车键退出程序...")
                 exit(1)
 
+            # 并行度设置
+            parallel_input = input("\n同时分析的交易日数量（默认1，逐日顺序分析）: ").strip()
+            parallel_dates = int(parallel_input) if parallel_input.isdigit() and int(parallel_input) > 0 else 1
+
+            # 内存受限模式（长区间批量分析时使用）
+            budget_input = input("RSS内存预算（MB，输入后启用内存受限模式，直接回车不启用）: ").strip()
+            memory_budget = int(budget_input) if budget_input.isdigit() and int(budget_input) > 0 else None
+
             # 执行批量分析
-            batch_analyze_dates(start_date_input, end_date_input)
+            batch_analyze_dates(start_date_input, end_date_input, parallel_dates, max_memory_mb=memory_budget,
+                                bounded_memory=memory_budget is not None)
 
         else:
             # 单日分析模式（原有逻辑）
@@ -6087,22 +8146,21 @@ if __name__ == "__main__":
 
             print(f"\n✅ TD分析完成！共分析 {len(analyses)} 只股票（含60日最大盈利计算）")
 
-            # 为重点关注股票生成TD图表
+            # 为重点关注股票生成TD图表（精简记录只为绘图的股票重新取数）
+            table = build_result_table(analyses)
             print("\n📊 开始生成TD技术图表(前复权数据)...")
-            chart_files, chart_dir = create_td_charts_for_focus_stocks(analyses, selected_date)
+            chart_files, chart_dir = create_td_charts_for_focus_stocks(analyses, selected_date, table)
 
             # 生成HTML可视化报告（前复权版本 + 60日最大盈利）
             print("\n🎨 生成增强版HTML报告(前复权数据版 + 60日最大盈利)...")
-            html_content = generate_html_report(analyses, selected_date, chart_files)
 
-            # 保存HTML报告
+            # 流式写出HTML报告
             html_filename = f"增强版TD筛选分析报告_前复权_60日最大盈利_优化版_{selected_date}_{datetime.now().strftime('%H%M%S')}.html"
-            with open(html_filename, 'w', encoding='utf-8') as f:
-                f.write(html_content)
+            write_html_report(html_filename, analyses, selected_date, chart_files, table)
 
             print(f"📊 增强版HTML报告已保存: {html_filename}")
 
-            if chart_files:
+            if chart_files and chart_dir:
                 print(f"📈 TD图表文件夹: {chart_dir}")
                 print(f"🎯 成功生成 {len(chart_files)} 个TD技术图表(前复权)")
 
@@ -6118,16 +8176,12 @@ if __name__ == "__main__":
                 print(f"\n❌ 无法自动打开HTML报告，请手动打开：{html_filename}")
 
             # 显示重点关注股票汇总（包含60日最大盈利信息）
-            focus_stocks = [a for a in analyses if 'analysis' not in a and (
-                    a.get('td_score', 0) >= 20 or
-                    abs(a.get('td_countdown', 0)) >= 8 or
-                    a.get('confidence', 0) >= 45
-            )]
+            focus_stocks = [analyses[index] for index in table['index'][select_focus_rows(table, 20, 8, 45)]]
 
             if focus_stocks:
                 print(f"\n🎯 重点关注股票汇总 ({len(focus_stocks)}只，前复权数据 + 60日最大盈利)：")
                 print("=" * 100)
-                for stock in sorted(focus_stocks, key=lambda x: x.get('td_score', 0), reverse=True):
+                for stock in focus_stocks:
                     max_profit_pct = stock.get('max_profit_pct', 0)
                     max_profit_days = stock.get('max_profit_days', 0)
                     profit_info = f"60日最大盈利: +{max_profit_pct}%({max_profit_days}天)" if max_profit_pct > 0 else "60日最大盈利: 无盈利"